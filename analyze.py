@@ -1,11 +1,17 @@
 """
 analyze.py
 
-* class Analyzer - Uploads the snapshotted state from the specified pickle_jar.
+* class Analyzer - Uploads the taint timeline, or the snapshotted state, from the specified pickle_jar.
 Provides abstractions for plotting the change in register/memory taint across the 
 execution of the program. 
 Outputs generated graphs to the directory <pickle_jar_path>/data/
---memory_graph and --register_graph flags determine which graphs to generate.
+--memory_graph, --register_graph and --flag_graph flags determine which graphs to generate.
+
+Jars with a timeline (see timeline.py) are plotted straight from the memory mapped columns,
+downsampled to at most MAX_POINTS points, so memory stays flat however long the run was.
+Older jars without one fall back to reading every snapshot. Binary snapshots (see
+snapshot_format.py) are memory mapped and only their taint sections read; pickled ones are
+restored.
 
 # Example Execution.
 # analyzer.py --pickle_jar=<pickle_jar_path> --memory_graph --register_graph
@@ -19,54 +25,133 @@ import matplotlib
 matplotlib.use('TkAgg')
 import matplotlib.pyplot as plt
 from interpreter import *
+from snapshot import iter_snapshots, get_snapshot_paths
+from snapshot_format import SnapshotFile, is_binary_snapshot
+from taint import SHADOW_PAGED
+from timeline import Timeline
+from instruction import TAINT_FLAGS
+
+# Most points drawn per graph.
+MAX_POINTS = 4096
 
 class Analyzer():
-    def __init__(self, pickle_jar):
+    def __init__(self, pickle_jar, max_points=MAX_POINTS):
         self.pickle_jar = pickle_jar
         self.wd = os.getcwd()
-        self.interpreters = []
-
-        # Load the pickles
-        self.load_pickled_state()
-
-    def load_pickle(self, filename):
-        file = open("{}/pickles/{}".format(self.pickle_jar, filename), 'rb')
-        return pickle.load(file)
+        self.max_points = max_points
+
+        # Steps plotted, and the taint percentages at each, in execution order.
+        self.steps = []
+        self.register_taint = []
+        self.memory_taint = []
+        # Mapping of taint flag name to the number of tainted locations carrying it at each step.
+        self.flag_taint = {}
+
+        path = "{}/{}".format(self.wd, self.pickle_jar)
+        if Timeline.exists(path):
+            self.load_timeline()
+        else:
+            # Load the pickles
+            self.load_pickled_state()
+
+    def load_timeline(self):
+        timeline = Timeline("{}/{}".format(self.wd, self.pickle_jar))
+        num_registers = timeline.metadata.get("num_registers") or 33
+        mem_size = timeline.metadata.get("mem_size") or MEM_SIZE
+
+        # Plotted against instructions run, like the snapshots.
+        self.steps, registers = timeline.downsample("tainted_registers", self.max_points,
+                                                    "instructions")
+        _, memory = timeline.downsample("tainted_memory", self.max_points)
+        self.register_taint = [count / num_registers for count in registers]
+        self.memory_taint = [count / mem_size for count in memory]
+        for name, _ in TAINT_FLAGS:
+            _, self.flag_taint[name] = timeline.downsample(name.lower(), self.max_points)
+
+        print("Loaded {} of {} timeline steps".format(len(self.steps), len(timeline)))
+        timeline.close()
+        return
 
     def load_pickled_state(self):
-        path = "{}/{}/pickles".format(self.wd, self.pickle_jar)
-        pickles = os.listdir(path)
-        for pfile in pickles:
-            intr = self.load_pickle(pfile)
-            self.interpreters.append(intr)
-        print("Loaded {} interpreters".format(len(self.interpreters)))
+        path = "{}/{}".format(self.wd, self.pickle_jar)
+        paths = get_snapshot_paths(path)
+        if all(is_binary_snapshot(snapshot) for snapshot in paths):
+            self.load_snapshot_files(paths)
+            return
+
+        # Deltas restore into one shared interpreter, so read each snapshot as it is restored.
+        for _, intr in iter_snapshots(path):
+            self.register_taint.append(intr.tracker.percentage_tainted_registers())
+            self.memory_taint.append(intr.tracker.percentage_tainted_memory())
+            self.steps.append(intr.tracker.num_total_instr_run)
+        print("Loaded {} interpreters".format(len(self.register_taint)))
+        return
+
+    # Read the taint of binary snapshots in place, without restoring any interpreter.
+    def load_snapshot_files(self, paths):
+        # Tainted cells per shadow memory page, brought up to date by each delta.
+        page_counts = {}
+        tainted_memory = 0
+        # The same for the whole run, so read once.
+        mem_size = shadow_memory = None
+        for path in paths:
+            with SnapshotFile(path) as snapshot:
+                header = snapshot.header
+                if mem_size is None:
+                    mem_size = snapshot.get_metadata("mem_size")
+                    shadow_memory = snapshot.get_metadata("shadow_memory")
+                num_registers = len(snapshot.get_section("shadow_registers"))
+                self.register_taint.append(snapshot.count_tainted_registers() / num_registers)
+
+                runs = snapshot.count_tainted_runs()
+                if runs is not None:
+                    tainted_memory = runs
+                elif shadow_memory == SHADOW_PAGED:
+                    if header["keyframe"]:
+                        page_counts = {}
+                    page_counts.update(snapshot.count_tainted_pages())
+                    tainted_memory = sum(page_counts.values())
+                self.memory_taint.append(tainted_memory / mem_size)
+                self.steps.append(snapshot.get_counter("num_total_instr_run"))
+        print("Read {} snapshots".format(len(self.register_taint)))
         return
 
     def plot_register_taint(self):
         path = "{}/{}/data".format(self.wd, self.pickle_jar)
 
-        y = [intr.tracker.percentage_tainted_registers() for intr in self.interpreters]
-        x = list(range(len(self.interpreters)))
-        plt.plot(x, y)
+        plt.plot(self.steps, self.register_taint)
         plt.savefig('{}/registers_taint_graph.jpg'.format(path))
         plt.close()
 
     def plot_memory_taint(self):
         path = "{}/{}/data".format(self.wd, self.pickle_jar)
 
-        y = [intr.tracker.percentage_tainted_memory() for intr in self.interpreters]
-        x = list(range(len(self.interpreters)))
-        plt.plot(x, y)
+        plt.plot(self.steps, self.memory_taint)
         plt.savefig('{}/memory_taint_graph.jpg'.format(path))
         plt.close()
 
+    # Number of tainted locations carrying each taint flag. Needs a timeline.
+    def plot_flag_taint(self):
+        path = "{}/{}/data".format(self.wd, self.pickle_jar)
+
+        if not self.flag_taint:
+            print("No timeline in {}, skipping the flag graph".format(self.pickle_jar))
+            return
+        for name, counts in self.flag_taint.items():
+            plt.plot(self.steps, counts, label=name)
+        plt.legend()
+        plt.savefig('{}/flag_taint_graph.jpg'.format(path))
+        plt.close()
+
 
 @click.command()
 @click.option('--pickle_jar', required=True, help='Requires a path to a pickle jar.')
 @click.option('--memory_graph/--no-memory_graph', default=False)
 @click.option('--register_graph/--no-register_graph', default=False)
-def main(pickle_jar, memory_graph, register_graph):
-    analyzer = Analyzer(pickle_jar)
+@click.option('--flag_graph/--no-flag_graph', default=False)
+@click.option('--max_points', default=MAX_POINTS, help='Most points drawn per graph.')
+def main(pickle_jar, memory_graph, register_graph, flag_graph, max_points):
+    analyzer = Analyzer(pickle_jar, max_points)
 
     if register_graph:
         analyzer.plot_register_taint()
@@ -74,6 +159,9 @@ def main(pickle_jar, memory_graph, register_graph):
     if memory_graph:
         analyzer.plot_memory_taint()
 
+    if flag_graph:
+        analyzer.plot_flag_taint()
+
     return
 
 
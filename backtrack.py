@@ -4,6 +4,10 @@ backtrack.py
 A proof of concept showing our taint tracking interpreter is capable of uploading snapshots 
 and executing them easily. This feature is essential for a dynamic taint tracking system, 
 allowing the potential for increasing/decreasing taint policies mid-program execution.
+explore.py continues a snapshot under several policies at once and compares them.
+
+With --peek, a binary snapshot (see snapshot_format.py) is memory mapped and its registers,
+taint, and counters are printed without restoring the interpreter.
 
 # Example Execution.
 #python backtrack.py --pickle_path=<path to a pickled state>
@@ -13,35 +17,88 @@ import sys
 import os
 import click
 import pickle
+import tempfile
 from interpreter import *
+from snapshot import load_snapshot
+from snapshot_format import SnapshotFile, is_binary_snapshot
+from instruction import TAINT_FLAGS
+from tracer import Tracer, TRACE_LINES
 
-<<<<<<< Updated upstream
 # Example Execution.
 # python backtrack.py --pickle_path=pickle_cabinet/jar_get_loc/pickles/state-instr008-line009
-=======
->>>>>>> Stashed changes
 
 
 def fetch_interpreter(pickle_path):
-    file = open("{}".format(pickle_path), 'rb')
-    return pickle.load(file)
+    # Keyframes and deltas are both restored to a full interpreter.
+    return load_snapshot(pickle_path)
 
 
 def backtrack(pickle_path):
     interpreter = fetch_interpreter(pickle_path)
 
-    # Run interpreter.
-    while(interpreter.run()):
-        print("")
+    # Run interpreter, printing each line as it runs. The trace file is written to a scratch
+    # directory so the trace of the snapshot's own run is left alone.
+    with tempfile.TemporaryDirectory() as scratch:
+        tracer = Tracer(scratch, interpreter, TRACE_LINES)
+        interpreter.set_tracer(tracer)
+        try:
+            while(interpreter.run()):
+                pass
+        finally:
+            interpreter.set_tracer(None)
+            tracer.close()
+
+    return
+
+
+def format_taint(taint, label_mode):
+    if taint == 0:
+        return "CLEAN"
+    if label_mode:
+        return "label set {}".format(taint)
+    return "|".join(name for name, flag in TAINT_FLAGS if taint & flag)
+
+
+# Print the fields of a binary snapshot, reading only the sections printed.
+def peek_snapshot(pickle_path):
+    if not is_binary_snapshot(pickle_path):
+        raise Exception("'{}' is pickled. Only binary snapshots can be peeked".format(pickle_path))
+    with SnapshotFile(pickle_path) as snapshot:
+        header = snapshot.header
+        kind = "keyframe" if header["keyframe"] else "delta of {}".format(header["previous"])
+        print("Step {}, line {}, {}".format(header["step"], header["pc"], kind))
+        for name, val in zip(snapshot.get_metadata("counters"), snapshot.get_section("counters")):
+            print("{} = {}".format(name, val))
+
+        print("\nREGISTERS:")
+        label_mode = snapshot.get_metadata("label_mode")
+        registers = snapshot.get_section("registers")
+        shadow_registers = snapshot.get_section("shadow_registers")
+        for reg, idx in ABI_TO_REGISTER_IDX.items():
+            print("'{}' = {}, taint = {}".format(
+                reg, registers[idx], format_taint(shadow_registers[idx], label_mode)))
 
+        runs = snapshot.count_tainted_runs()
+        if runs is not None:
+            print("\nTainted memory cells: {}".format(runs))
+        elif header["keyframe"]:
+            print("\nTainted memory cells: {}".format(sum(snapshot.count_tainted_pages().values())))
+        else:
+            print("\nShadow memory pages changed: {}".format(
+                len(snapshot.get_pages("shadow_memory"))))
     return
 
 
 @click.command()
 @click.option('--pickle_path', required=True, help='Requires a path to a specific pickle.')
-def main(pickle_path):
+@click.option('--peek/--no-peek', default=False,
+              help='Print the registers, taint, and counters of a binary snapshot without running.')
+def main(pickle_path, peek):
 
-    backtrack(pickle_path)
+    if peek:
+        peek_snapshot(pickle_path)
+    else:
+        backtrack(pickle_path)
     return
 
 
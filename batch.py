@@ -0,0 +1,236 @@
+"""
+batch.py
+
+Runs every combination of programs, policies, and snapshot settings listed in a manifest,
+spread across a pool of worker processes, and writes one aggregated report.
+
+The manifest is a JSON file:
+
+    {
+        "programs": ["testfiles/hash.s", "testfiles/add.s"],
+        "policies": ["policy", "my_policies:strict_policy"],
+        "settings": [{"engine": "block"}, {"keyframe_interval": 16, "snapshot_queue": 0}]
+    }
+
+A policy is named as on the interpreter's command line: a module path or a file path and,
+after a ':', the attribute holding the policy mapping ('policy' by default). The module's
+hooks are applied with it. Every setting is optional and named like the interpreter's
+command line options; "settings" defaults to a single entry of defaults.
+
+Each job gets its own jar, '<pickle_cabinet>/batch_<manifest>/jar_<job>', holding its
+snapshots, timeline, and interpreter output in 'data/output.txt'. Programs are parsed once into
+the program cache before the jobs start, so workers load them instead of parsing.
+
+* load_manifest - Expands a manifest into a list of jobs.
+* run_job - Runs one job in its own jar and returns its results.
+* run_batch - Runs jobs across a process pool and returns the report.
+
+# Example Execution.
+# python batch.py manifest.json --workers=8 --report=report.json
+"""
+
+import os
+import sys
+import json
+import time
+import click
+import itertools
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from interpreter import (
+    RiscvInterpreter,
+    make_pickle_jar,
+    run_with_snapshots,
+    ENGINE_DECODED,
+    MEM_SIZE,
+    PICKLE_CABINET,
+)
+from snapshot import KEYFRAME_INTERVAL, SNAPSHOT_QUEUE_SIZE, OVERFLOW_BLOCK, SNAPSHOT_PICKLE
+from page_store import DEFAULT_COMPRESSION
+from program_cache import load_program, PROGRAM_CACHE
+from state import ABI_TO_REGISTER_IDX
+from taint import SHADOW_PAGED
+from tracer import TRACE_BINARY
+from reachability import PRUNE_OFF
+from policy_compiler import load_policy, DEFAULT_POLICY
+
+# Settings a manifest may give, with their defaults.
+DEFAULT_SETTINGS = {
+    "engine": ENGINE_DECODED,
+    "mem_size": MEM_SIZE,
+    "idle_fast_path": True,
+    "hh_sketch_width": 0,
+    "keyframe_interval": KEYFRAME_INTERVAL,
+    "snapshot_queue": SNAPSHOT_QUEUE_SIZE,
+    "snapshot_overflow": OVERFLOW_BLOCK,
+    "snapshot_interval": 1,
+    "snapshot_format": SNAPSHOT_PICKLE,
+    "page_compression": DEFAULT_COMPRESSION,
+    "taint_log": False,
+    "trace": TRACE_BINARY,
+    "trace_ring": 0,
+    "timeline": True,
+    "taint_labels": False,
+    "shadow_memory": SHADOW_PAGED,
+    "taint_prune": PRUNE_OFF,
+}
+
+
+def load_manifest(manifest_path):
+    """
+    Returns the jobs of a manifest, one per (program, policy, settings) combination.
+    """
+    with open(manifest_path) as file:
+        manifest = json.load(file)
+
+    programs = manifest.get("programs", [])
+    policies = manifest.get("policies", [DEFAULT_POLICY])
+    settings = manifest.get("settings", [{}])
+    if not programs:
+        raise Exception("Manifest '{}' lists no programs".format(manifest_path))
+    for setting in settings:
+        unknown = set(setting) - set(DEFAULT_SETTINGS)
+        if unknown:
+            raise Exception("Unknown settings {} in '{}'".format(sorted(unknown), manifest_path))
+
+    jobs = []
+    for program, policy, setting in itertools.product(programs, policies, settings):
+        job_settings = dict(DEFAULT_SETTINGS)
+        job_settings.update(setting)
+        jobs.append({
+            "job": len(jobs),
+            "program": program,
+            "policy": policy,
+            "settings": job_settings,
+        })
+    return jobs
+
+
+def get_job_jar(batch_dir, job):
+    return "{}/jar_{:04d}".format(batch_dir, job["job"])
+
+
+def run_job(job, batch_dir, program_cache=PROGRAM_CACHE):
+    """
+    Runs one job to completion in its own jar. Errors are reported, not raised,
+    so one bad job does not stop the batch.
+    """
+    settings = job["settings"]
+    pickle_jar = get_job_jar(batch_dir, job)
+    result = dict(job, jar=pickle_jar, error=None)
+    make_pickle_jar(pickle_jar)
+
+    start = time.perf_counter()
+    try:
+        # Keep what the program and its hooks print in the jar rather than on the console.
+        with open("{}/data/output.txt".format(pickle_jar), 'w') as output, \
+                contextlib.redirect_stdout(output):
+            policy, hooks = load_policy(job["policy"])
+            interpreter = RiscvInterpreter(
+                job["program"], policy, hooks=hooks,
+                engine=settings["engine"], mem_size=settings["mem_size"],
+                idle_fast_path=settings["idle_fast_path"],
+                hh_sketch_width=settings["hh_sketch_width"], program_cache=program_cache,
+                label_mode=settings["taint_labels"], shadow_memory=settings["shadow_memory"],
+                taint_prune=settings["taint_prune"])
+            run_with_snapshots(interpreter, pickle_jar, settings["keyframe_interval"],
+                               settings["snapshot_queue"], settings["snapshot_overflow"],
+                               settings["timeline"], settings["snapshot_interval"],
+                               settings["taint_log"], settings["trace"], settings["trace_ring"],
+                               settings["snapshot_format"], settings["page_compression"])
+    except Exception as error:
+        result["error"] = "{}: {}".format(type(error).__name__, error)
+        result["wall_time"] = time.perf_counter() - start
+        return result
+    result["wall_time"] = time.perf_counter() - start
+
+    tracker = interpreter.tracker
+    instructions = interpreter._instructions
+    heavy_hitters = tracker.heavy_hitters.get_heavy_hitters(
+        interpreter.hh_threshold, range(len(instructions)))
+    result.update({
+        "return_value": interpreter.state.get_register('a0'),
+        "register_taint": {
+            reg: tracker.print_taint(tracker.get_register_taint(idx))
+            for reg, idx in ABI_TO_REGISTER_IDX.items()
+            if tracker.get_register_taint(idx)
+        },
+        "heavy_hitters": [
+            {"line": line, "instruction": instructions[line].to_string()}
+            for line in heavy_hitters
+        ],
+        "instructions_run": tracker.num_total_instr_run,
+    })
+    return result
+
+
+def run_batch(jobs, batch_dir, workers=None, program_cache=PROGRAM_CACHE):
+    """
+    Runs 'jobs' across 'workers' processes (all cores by default).
+    Returns the report: every job's results, in job order, and a summary.
+    """
+    os.makedirs(batch_dir, exist_ok=True)
+
+    # Parse each program once, up front, so workers only read the program cache.
+    # A program that fails to load is left for its jobs to report.
+    if program_cache is not None:
+        for program in sorted({job["program"] for job in jobs}):
+            try:
+                load_program(program, program_cache)
+            except Exception:
+                continue
+
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_job, job, batch_dir, program_cache) for job in jobs]
+        for future in as_completed(futures):
+            result = future.result()
+            status = "FAILED" if result["error"] else "done"
+            print("job {} {}: {} with {} ({:.3f}s)".format(
+                result["job"], status, result["program"], result["policy"], result["wall_time"]))
+            results.append(result)
+    results.sort(key=lambda result: result["job"])
+
+    return {
+        "summary": {
+            "jobs": len(results),
+            "failed": sum(1 for result in results if result["error"]),
+            "workers": workers or os.cpu_count(),
+            "wall_time": time.perf_counter() - start,
+        },
+        "results": results,
+    }
+
+
+@click.command()
+@click.argument('manifest')
+@click.option('--workers', default=0, help='Worker processes. 0 uses every core.')
+@click.option('--report', default=None,
+              help='Where to write the JSON report. Defaults to <batch dir>/report.json.')
+@click.option('--program_cache/--no-program_cache', default=True,
+              help='Parse each program once and share it with the workers through {}/.'.format(
+                  PROGRAM_CACHE))
+def main(manifest, workers, report, program_cache):
+    jobs = load_manifest(manifest)
+    name = os.path.splitext(os.path.basename(manifest))[0]
+    batch_dir = "{}/batch_{}".format(PICKLE_CABINET, name)
+
+    print("Running {} jobs from '{}'".format(len(jobs), manifest))
+    batch_report = run_batch(jobs, batch_dir, workers or None,
+                             PROGRAM_CACHE if program_cache else None)
+
+    report = report or "{}/report.json".format(batch_dir)
+    with open(report, 'w') as file:
+        json.dump(batch_report, file, indent=2)
+
+    summary = batch_report["summary"]
+    print("\n{} jobs, {} failed, {:.3f}s. Report written to {}".format(
+        summary["jobs"], summary["failed"], summary["wall_time"], report))
+    if summary["failed"]:
+        sys.exit(1)
+    return 0
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""
+benchmark.py
+
+Benchmarks the interpreter over the pre-generated RISC-V fixtures in testfiles/.
+
+For each program reports, as JSON:
+* parse_time - Seconds to parse the file (no program cache).
+* instructions - Instructions executed per run.
+* instructions_per_sec - Execution speed with the taint policy.
+* taint_overhead - Extra run time of the taint policy over a policy that tracks nothing.
+* snapshot_cost_per_step - Extra seconds per step of writing snapshots and the timeline.
+* peak_rss_kb - Peak resident memory of the process that benchmarked the program.
+
+Every program is benchmarked in a freshly spawned process, so peak RSS is its own, and every
+timing is the fastest of 'repeats' runs. The fixtures were generated by gen_riscv.sh, so the
+suite runs without clang or llc.
+
+Pass the JSON of an earlier version with --baseline to list the metrics that regressed by more
+than --tolerance; the exit status is then 1 if any did.
+
+# Example Execution.
+# python benchmark.py --output=bench.json --baseline=bench_old.json
+"""
+
+import io
+import os
+import sys
+import json
+import glob
+import time
+import click
+import shutil
+import resource
+import platform
+import tempfile
+import contextlib
+import multiprocessing
+from interpreter import (
+    RiscvInterpreter,
+    make_pickle_jar,
+    run_with_snapshots,
+    ENGINES,
+    ENGINE_DECODED,
+)
+from parser import RiscvParser, PARSER_VERSION
+from policy_compiler import load_policy, DEFAULT_POLICY
+
+FIXTURES = "testfiles/*.s"
+REPEATS = 20
+# Each timing runs the program enough times to take at least this many seconds,
+# so tiny programs are not lost in timer noise.
+MIN_SAMPLE_TIME = 0.01
+
+# For each compared metric, whether larger values are better.
+METRICS = {
+    "parse_time": False,
+    "instructions_per_sec": True,
+    "taint_overhead": False,
+    "snapshot_cost_per_step": False,
+    "peak_rss_kb": False,
+}
+# Metrics that are already fractions, compared by difference rather than by ratio.
+FRACTION_METRICS = {"taint_overhead"}
+
+
+# Handler that propagates nothing, for the untracked baseline.
+def untracked(tracker, state, operands):
+    return
+
+
+def time_run(riscv_file, policy, engine, runs=1, scratch=None, hooks=None):
+    """
+    Mean seconds to run the program from the first instruction to the final return, over
+    'runs' runs. Snapshots and the timeline are written to jars in 'scratch' when it is given.
+    """
+    # Steps are traced to the jar, not printed; any other output is not part of the report.
+    with contextlib.redirect_stdout(io.StringIO()):
+        # Interpreters and jars are set up before the clock starts.
+        interpreters = [RiscvInterpreter(riscv_file, policy, engine=engine, hooks=hooks)
+                        for _ in range(runs)]
+        jars = []
+        if scratch is not None:
+            jars = ["{}/jar_{}".format(scratch, run) for run in range(runs)]
+            for jar in jars:
+                make_pickle_jar(jar)
+
+        start = time.perf_counter()
+        for run, interpreter in enumerate(interpreters):
+            if scratch is None:
+                while interpreter.run():
+                    pass
+            else:
+                run_with_snapshots(interpreter, jars[run])
+        elapsed = time.perf_counter() - start
+    return elapsed / runs, interpreters[0].tracker.num_total_instr_run
+
+
+# Runs per timing, so a timing takes at least MIN_SAMPLE_TIME.
+def get_runs_per_sample(riscv_file, policy, engine, hooks):
+    elapsed, _ = time_run(riscv_file, policy, engine, hooks=hooks)
+    return max(1, min(1000, int(MIN_SAMPLE_TIME / max(elapsed, 1e-7)) + 1))
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def best_of(repeats, fn):
+    return min(fn() for _ in range(repeats))
+
+
+def benchmark_program(riscv_file, policy_name, engine, repeats):
+    policy, hooks = load_policy(policy_name)
+    no_policy = {opcode: untracked for opcode in policy}
+
+    runs = get_runs_per_sample(riscv_file, policy, engine, hooks)
+
+    parse_time = best_of(repeats, lambda: timed(RiscvParser, riscv_file))
+    tracked, instructions = best_of(repeats, lambda: time_run(
+        riscv_file, policy, engine, runs, hooks=hooks))
+    plain, _ = best_of(repeats, lambda: time_run(riscv_file, no_policy, engine, runs))
+
+    # Snapshot runs write a jar per run, so they take fewer.
+    scratch = tempfile.mkdtemp(prefix="benchmark_")
+    try:
+        snapshotted, _ = best_of(repeats, lambda: time_run(
+            riscv_file, policy, engine, max(1, runs // 10), scratch, hooks))
+    finally:
+        shutil.rmtree(scratch)
+
+    return {
+        "parse_time": parse_time,
+        "instructions": instructions,
+        "run_time": tracked,
+        "runs_per_sample": runs,
+        "instructions_per_sec": instructions / tracked if tracked else 0,
+        "taint_overhead": tracked / plain - 1 if plain else 0,
+        "snapshot_cost_per_step": (snapshotted - tracked) / max(1, instructions),
+        # Kilobytes on Linux.
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+# Metrics of 'results' worse than 'baseline' by more than 'tolerance' (a fraction).
+def find_regressions(results, baseline, tolerance):
+    regressions = []
+    for program, metrics in results["programs"].items():
+        old = baseline.get("programs", {}).get(program)
+        if old is None:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            if not old.get(metric) or metric not in metrics:
+                continue
+            if metric in FRACTION_METRICS:
+                change = metrics[metric] - old[metric]
+            else:
+                change = metrics[metric] / old[metric] - 1
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append((program, metric, old[metric], metrics[metric]))
+    return regressions
+
+
+@click.command()
+@click.option('--fixtures', default=FIXTURES, help='Glob of the RISC-V files to benchmark.')
+@click.option('--engine', type=click.Choice(ENGINES), default=ENGINE_DECODED)
+@click.option('--policy', default=DEFAULT_POLICY, help="Policy as 'module' or 'module:attribute'.")
+@click.option('--repeats', default=REPEATS, help='Runs per measurement. The fastest is reported.')
+@click.option('--output', default="benchmark.json", help='Where to write the JSON results.')
+@click.option('--baseline', default=None, help='JSON results of an earlier version to compare.')
+@click.option('--tolerance', default=0.25, help='Fraction a metric may worsen before it regresses.')
+def main(fixtures, engine, policy, repeats, output, baseline, tolerance):
+    programs = sorted(glob.glob(fixtures))
+    if not programs:
+        print("No fixtures match '{}'".format(fixtures))
+        sys.exit(1)
+
+    results = {
+        "parser_version": PARSER_VERSION,
+        "python": platform.python_version(),
+        "engine": engine,
+        "policy": policy,
+        "repeats": repeats,
+        "programs": {},
+    }
+    # A fresh process per program, so peak RSS is not inherited from earlier programs.
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        for program in programs:
+            metrics = pool.apply(benchmark_program, (program, policy, engine, repeats))
+            results["programs"][os.path.basename(program)] = metrics
+            print("{}: {:.0f} instr/s, taint overhead {:.1%}, snapshot {:.1f}us/step, "
+                  "parse {:.2f}ms, peak RSS {} kB".format(
+                      program, metrics["instructions_per_sec"], metrics["taint_overhead"],
+                      metrics["snapshot_cost_per_step"] * 1e6, metrics["parse_time"] * 1e3,
+                      metrics["peak_rss_kb"]))
+
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print("\nResults written to {}".format(output))
+
+    if baseline is not None:
+        with open(baseline) as file:
+            old_results = json.load(file)
+        for key in ("engine", "policy", "parser_version"):
+            if old_results.get(key) != results[key]:
+                print("WARNING: baseline {} is {}, not {}".format(
+                    key, old_results.get(key), results[key]))
+        regressions = find_regressions(results, old_results, tolerance)
+        for program, metric, old, new in regressions:
+            print("REGRESSION {} {}: {:.6g} -> {:.6g}".format(program, metric, old, new))
+        if regressions:
+            sys.exit(1)
+        print("No regressions against {}".format(baseline))
+    return 0
+
+
+if __name__ == '__main__':
+    main()
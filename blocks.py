@@ -0,0 +1,360 @@
+"""
+blocks.py
+
+Basic-block compiler. Splits the parsed program into basic blocks at labels and after
+branches, jumps, calls, and returns. Each block is compiled once into a generated Python
+function that executes the whole block and propagates its taint inline, then cached by the
+pc the block starts at.
+
+* find_leaders - Returns the set of pcs that start a basic block.
+* class BlockCompiler - Compiles blocks on first use and runs them from the cache.
+
+Taint handlers from policy.py are inlined. Any other policy handler, and any instruction
+form the compiler does not specialize, falls back to the handlers bound by decoder.py,
+so results match the instruction-at-a-time engines exactly.
+"""
+
+import policy as default_policy
+from decoder import PC, resolve_memory
+from taint import TAINT_DEST
+from instruction import SUPPORTED_FUNCTIONS
+from state import ABI_TO_REGISTER_IDX
+
+RA = ABI_TO_REGISTER_IDX['ra']
+A0 = ABI_TO_REGISTER_IDX['a0']
+
+# Opcodes that end a basic block.
+TERMINATORS = {"beq", "bne", "bnez", "blt", "bge", "call", "j", "jalr", "ret"}
+
+ARITH_OPERATORS = {
+    "addi": "+", "add": "+",
+    "subi": "-", "sub": "-",
+    "andi": "&", "and": "&",
+    "xori": "^", "xor": "^",
+    "srli": ">>", "srl": ">>",
+    "slli": "<<", "sll": "<<",
+}
+
+BRANCH_OPERATORS = {"beq": "==", "bne": "!=", "blt": "<", "bge": ">="}
+
+# Policy handlers whose behaviour the compiler emits inline.
+# Two operand handlers: (dest operand, source operands).
+INLINE_TAINT_FLOWS = {
+    default_policy.taint_arith: (0, (1, 2)),
+    default_policy.taint_subi: (0, (1, 2)),
+    default_policy.taint_sw: (1, (0,)),
+    default_policy.taint_lw: (0, (1,)),
+    default_policy.taint_lui: (0, (1,)),
+    default_policy.taint_mv: (0, (1,)),
+}
+INLINE_TAINT_NOOPS = {
+    default_policy.thunk,
+    default_policy.taint_j,
+}
+
+
+def find_leaders(instructions, labels):
+    leaders = {0}
+    leaders.update(pc for pc in labels.values() if pc < len(instructions))
+    for pc, instr in enumerate(instructions):
+        if instr.opcode in TERMINATORS and pc + 1 < len(instructions):
+            leaders.add(pc + 1)
+    return leaders
+
+
+class BlockCompiler:
+    """
+    Compiles basic blocks of decoded instructions into Python functions.
+    """
+    def __init__(self, decoded, labels, inline_taint=True, clean=None):
+        self._decoded = decoded
+        # Without inlining every taint write goes through the tracker, so a taint log sees it.
+        self.inline_taint = inline_taint
+        # Lines proven clean by reachability.py skip the policy even in taint mode.
+        self._clean = clean
+        self._leaders = find_leaders([d.instr for d in decoded], labels)
+        # Mappings of block start pc to its compiled function,
+        # one for taint mode and one for taint-free mode.
+        self._cache = {}
+        self._idle_cache = {}
+        # Mapping of block start pc to the pc of its last line.
+        self._ends = {}
+
+    def run(self, pc, state, tracker, propagate=True):
+        cache = self._cache if propagate else self._idle_cache
+        block = cache.get(pc)
+        if block is None:
+            block = self.compile(pc, propagate)
+        return block(state, tracker)
+
+    def get_block_end(self, start):
+        if start not in self._ends:
+            self._ends[start] = self.get_block_range(start)[1]
+        return self._ends[start]
+
+    def get_block_range(self, start):
+        # Blocks can also start mid-block when a jalr lands there, so any pc is a valid start.
+        end = start
+        while (self._decoded[end].opcode not in TERMINATORS
+               and end + 1 < len(self._decoded)
+               and end + 1 not in self._leaders):
+            end += 1
+        return start, end
+
+    # With propagate=False the block skips the policy and records every line as untainted.
+    def compile(self, start, propagate=True):
+        start, end = self.get_block_range(start)
+        self._lines = []
+        # Objects the generated code refers to by index.
+        self._consts = []
+
+        self._emit("tracker.num_total_instr_run += {}".format(end - start + 1))
+        if propagate:
+            self._emit("tracker.num_tainted_instr_run += {}".format(end - start + 1))
+
+        for pc in range(start, end + 1):
+            decoded = self._decoded[pc]
+            self._emit("# {}: {}".format(pc, decoded.to_string()))
+            if propagate and not (self._clean is not None and self._clean[pc]):
+                self._emit_taint(pc, decoded)
+                self._emit_history(pc, decoded)
+            else:
+                self._emit("record({}, 0)".format(pc))
+            self._emit_execute(pc, decoded, is_last=(pc == end))
+
+        source = "\n".join([
+            "def block(state, tracker):",
+            "    regs = state.registers",
+            "    sr = tracker.shadow_registers",
+            "    get_memory = state.get_memory",
+            "    set_memory = state.set_memory",
+            "    get_mem_taint = tracker.get_memory_taint",
+            "    set_mem_taint = tracker.replace_memory_taint",
+            "    record = tracker.heavy_hitters.record",
+            "    OR = tracker.OR",
+        ] + ["    " + line for line in self._lines])
+
+        namespace = {"K": self._consts}
+        exec(compile(source, "<block {}-{}>".format(start, end), "exec"), namespace)
+        block = namespace["block"]
+        block.source = source
+        if propagate:
+            self._cache[start] = block
+        else:
+            self._idle_cache[start] = block
+        return block
+
+    def _emit(self, line):
+        self._lines.append(line)
+
+    # Register an object for the generated code and return an expression naming it.
+    def _const(self, obj):
+        self._consts.append(obj)
+        return "K[{}]".format(len(self._consts) - 1)
+
+    ## OPERAND EXPRESSIONS
+    # Each returns None when the operand form is not specialized.
+
+    def _value_expr(self, operand):
+        if operand.is_register():
+            return "regs[{}]".format(operand.register_idx)
+        elif operand.is_constant():
+            return repr(operand.constant)
+        elif operand.is_memory():
+            base, offset = resolve_memory(operand)
+            return "get_memory(regs[{}] + {})".format(base, offset)
+        return None
+
+    def _taint_expr(self, operand):
+        if operand.is_register():
+            return "sr[{}]".format(operand.register_idx)
+        elif operand.is_constant():
+            return "0"
+        elif operand.is_memory():
+            base, offset = resolve_memory(operand)
+            return "get_mem_taint(regs[{}] + {})".format(base, offset)
+        return None
+
+    def _set_taint_stmt(self, operand, expr):
+        if operand.is_register():
+            return "sr[{}] = {}".format(operand.register_idx, expr)
+        elif operand.is_memory():
+            base, offset = resolve_memory(operand)
+            return "set_mem_taint(regs[{}] + {}, {})".format(base, offset, expr)
+        return None
+
+    def _try(self, build):
+        try:
+            return build()
+        except Exception:
+            return None
+
+    ## TAINT PROPAGATION
+
+    def _emit_taint(self, pc, decoded):
+        handler = decoded.propagate
+        operands = decoded.operands
+
+        code = None
+        if not self.inline_taint:
+            pass
+        elif handler in INLINE_TAINT_NOOPS:
+            code = []
+        elif handler in INLINE_TAINT_FLOWS:
+            dest, sources = INLINE_TAINT_FLOWS[handler]
+            code = self._try(lambda: self._inline_flow(operands, dest, sources))
+        elif handler is default_policy.taint_call:
+            code = self._try(lambda: self._inline_call(operands))
+        elif handler is default_policy.taint_ret:
+            code = [
+                "if tracker.taint_source != 0:",
+                "    sr[{}] = tracker.taint_source".format(A0),
+                "tracker.taint_source = 0",
+            ]
+
+        if code is None:
+            # Custom handlers may read the pc, so make it current first.
+            self._emit("regs[{}] = {}".format(PC, pc))
+            self._emit("{}(tracker=tracker, state=state, operands={})".format(
+                self._const(handler), self._const(operands)))
+        else:
+            for line in code:
+                self._emit(line)
+
+    def _inline_flow(self, operands, dest, sources):
+        exprs = [self._taint_expr(operands[src]) for src in sources]
+        if None in exprs:
+            return None
+        taint = exprs[0] if len(exprs) == 1 else "OR({}, {})".format(*exprs)
+        stmt = self._set_taint_stmt(operands[dest], taint)
+        return None if stmt is None else [stmt]
+
+    def _inline_call(self, operands):
+        function_name = operands[0].get_target_name()
+        if function_name in SUPPORTED_FUNCTIONS:
+            return ["tracker.taint_source = tracker.get_source_taint({!r})".format(function_name)]
+        return []
+
+    ## HEAVY HITTER BOOKKEEPING
+
+    def _emit_history(self, pc, decoded):
+        strategy = TAINT_DEST.get(decoded.opcode)
+        expr = None
+        if strategy == 0 or strategy == 1:
+            expr = self._try(lambda: self._taint_expr(decoded.operands[strategy]))
+        elif strategy == "call":
+            expr = self._try(lambda: repr(
+                SUPPORTED_FUNCTIONS.get(decoded.operands[0].to_string(), 0)))
+        elif strategy == "ret" or strategy == "jump":
+            expr = "0"
+
+        if expr is None:
+            expr = "{}(tracker, state)".format(self._const(decoded.dest_taint))
+        self._emit("record({}, {})".format(pc, expr))
+
+    ## EXECUTION
+
+    def _emit_execute(self, pc, decoded, is_last):
+        code = self._try(lambda: self._inline_execute(pc, decoded))
+
+        if code is None:
+            self._emit("regs[{}] = {}".format(PC, pc))
+            if decoded.opcode in TERMINATORS:
+                self._emit("return {}(state)".format(self._const(decoded.execute)))
+                return
+            self._emit("{}(state)".format(self._const(decoded.execute)))
+        else:
+            for line in code:
+                self._emit(line)
+            if decoded.opcode in TERMINATORS:
+                return
+
+        if is_last:
+            # Fall through: the interpreter advances the pc past the last line.
+            self._emit("regs[{}] = {}".format(PC, pc))
+            self._emit("return 1")
+
+    def _inline_execute(self, pc, decoded):
+        opcode = decoded.opcode
+        operands = decoded.operands
+        instr = decoded.instr
+
+        if opcode in ARITH_OPERATORS:
+            if len(operands) < 3 or not operands[0].is_register():
+                return None
+            src1 = self._value_expr(operands[1])
+            src2 = self._value_expr(operands[2])
+            if src1 is None or src2 is None:
+                return None
+            return self._assign(operands[0], "{} {} {}".format(
+                src1, ARITH_OPERATORS[opcode], src2))
+        elif opcode == "lui" or opcode == "mv" or opcode == "lw":
+            if len(operands) < 2 or not operands[0].is_register():
+                return None
+            if opcode == "lw" and not operands[1].is_memory():
+                return None
+            src = self._value_expr(operands[1])
+            if src is None:
+                return None
+            if opcode == "lui":
+                src = "{} << 12".format(src)
+            return self._assign(operands[0], src)
+        elif opcode == "sw":
+            if len(operands) < 2 or not operands[1].is_memory():
+                return None
+            src = self._value_expr(operands[0])
+            if src is None:
+                return None
+            base, offset = resolve_memory(operands[1])
+            return ["set_memory(regs[{}] + {}, {})".format(base, offset, src)]
+        elif opcode in BRANCH_OPERATORS or opcode == "bnez":
+            num_operands = 2 if opcode == "bnez" else 3
+            if (opcode == "bnez" and len(operands) != 2) or len(operands) < num_operands:
+                return None
+            target_name = operands[num_operands - 1].get_target_name()
+            target = instr.get_jump_target(target_name)
+            src1 = self._value_expr(operands[0])
+            src2 = "0" if opcode == "bnez" else self._value_expr(operands[1])
+            if src1 is None or src2 is None:
+                return None
+            compare = "!=" if opcode == "bnez" else BRANCH_OPERATORS[opcode]
+            return [
+                "if {} {} {}:".format(src1, compare, src2),
+                "    regs[{}] = {}".format(PC, target),
+                "    return {!r}".format(target_name),
+                "regs[{}] = {}".format(PC, pc),
+                "return 1",
+            ]
+        elif opcode == "call":
+            if len(operands) != 1:
+                return None
+            target_name = operands[0].get_target_name()
+            target = instr.get_jump_target(target_name)
+            return [
+                "regs[{}] = {}".format(RA, pc + 1),
+                "regs[{}] = {}".format(PC, target),
+                "return {!r}".format(target_name),
+            ]
+        elif opcode == "j":
+            if len(operands) < 1:
+                return None
+            target_name = operands[0].get_target_name()
+            target = instr.get_jump_target(target_name)
+            return [
+                "regs[{}] = {}".format(PC, target),
+                "return {!r}".format(target_name),
+            ]
+        elif opcode == "ret":
+            if len(operands) != 0:
+                return None
+            return [
+                "regs[{}] = regs[{}]".format(PC, RA),
+                "return -1 if regs[{}] == -1 else 0".format(PC),
+            ]
+        return None
+
+    def _assign(self, operand, expr):
+        # Writes to 'zero' are dropped, but the value is still computed.
+        if operand.register_idx == 0:
+            return [expr]
+        return ["regs[{}] = {}".format(operand.register_idx, expr)]
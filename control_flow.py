@@ -0,0 +1,117 @@
+"""
+control_flow.py
+
+Static control flow of a parsed program, for implicit-flow taint.
+
+The control flow graph is intraprocedural: a call falls through to the next line, and returns,
+indirect jumps (jalr), and jumps or fall through out of the enclosing function all lead to a
+single virtual EXIT. Immediate post-dominators are computed once, when the program is loaded,
+with the iterative algorithm of Cooper, Harvey, and Kennedy over the reversed graph.
+
+A tainted branch opens a control-taint scope that closes at its immediate post-dominator,
+where both of its paths meet again (see TaintTracker.push_control_scope). A branch whose paths
+only meet at EXIT keeps its scope until its function returns.
+
+* EXIT - Post-dominator of lines whose paths only meet again when their function returns.
+* BRANCH_OPCODES - Conditional branches, the only lines that open a scope.
+* get_successors - Returns the successor pcs of every line.
+* get_post_dominators - Returns the immediate post-dominator of every line.
+"""
+
+EXIT = -1
+
+BRANCH_OPCODES = {"beq", "bne", "blt", "bge", "bnez"}
+# Lines after which control does not reach the next line or a label in the same function.
+EXIT_OPCODES = {"ret", "jalr"}
+
+
+def get_target(instr):
+    return instr.get_jump_target(instr.operands[-1].get_target_name())
+
+
+def get_successors(instructions, label_index):
+    """
+    Returns a list with the successor pcs of each line, where EXIT stands for leaving the function.
+    """
+    functions = label_index.functions
+
+    # Control that leaves the enclosing function goes to EXIT.
+    def within(pc, target):
+        if 0 <= target < len(instructions) and functions[target] == functions[pc]:
+            return target
+        return EXIT
+
+    successors = []
+    for pc, instr in enumerate(instructions):
+        if instr.opcode in EXIT_OPCODES:
+            succs = [EXIT]
+        elif instr.opcode == "j":
+            succs = [within(pc, get_target(instr))]
+        elif instr.opcode in BRANCH_OPCODES:
+            succs = [within(pc, pc + 1), within(pc, get_target(instr))]
+        else:
+            succs = [within(pc, pc + 1)]
+        successors.append(sorted(set(succs)))
+    return successors
+
+
+def get_post_dominators(instructions, label_index):
+    """
+    Returns a list with the immediate post-dominator of each line, or EXIT.
+    Lines that never reach EXIT, like the body of an infinite loop, also get EXIT.
+    """
+    num_lines = len(instructions)
+    successors = get_successors(instructions, label_index)
+    # The virtual exit is node 'num_lines' while solving.
+    exit_node = num_lines
+    successors = [[exit_node if succ == EXIT else succ for succ in succs] for succs in successors]
+    predecessors = [[] for _ in range(num_lines + 1)]
+    for pc, succs in enumerate(successors):
+        for succ in succs:
+            predecessors[succ].append(pc)
+
+    # Postorder of the reversed graph from the exit, without recursion.
+    order = []
+    visited = [False] * (num_lines + 1)
+    visited[exit_node] = True
+    stack = [(exit_node, iter(predecessors[exit_node]))]
+    while stack:
+        node, preds = stack[-1]
+        for pred in preds:
+            if not visited[pred]:
+                visited[pred] = True
+                stack.append((pred, iter(predecessors[pred])))
+                break
+        else:
+            stack.pop()
+            order.append(node)
+    rank = [-1] * (num_lines + 1)
+    for idx, node in enumerate(order):
+        rank[node] = idx
+
+    ipdom = [None] * (num_lines + 1)
+    ipdom[exit_node] = exit_node
+
+    def intersect(node1, node2):
+        while node1 != node2:
+            while rank[node1] < rank[node2]:
+                node1 = ipdom[node1]
+            while rank[node2] < rank[node1]:
+                node2 = ipdom[node2]
+        return node1
+
+    changed = True
+    while changed:
+        changed = False
+        # Reverse postorder, skipping the exit itself.
+        for node in reversed(order[:-1]):
+            new_ipdom = None
+            for succ in successors[node]:
+                if ipdom[succ] is None:
+                    continue
+                new_ipdom = succ if new_ipdom is None else intersect(succ, new_ipdom)
+            if ipdom[node] != new_ipdom:
+                ipdom[node] = new_ipdom
+                changed = True
+
+    return [EXIT if node is None or node == exit_node else node for node in ipdom[:num_lines]]
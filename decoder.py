@@ -0,0 +1,391 @@
+"""
+decoder.py
+
+Decode stage that runs once after parsing, ahead of execution.
+Resolves register indices, integer memory offsets, and jump target pcs for every instruction,
+so that the interpreter does not re-inspect operand tokens on every step.
+
+* DISPATCH - Maps opcodes to factories that build a bound execute handler for an instruction.
+* class DecodedInstr - An instruction with its execute, taint, and bookkeeping handlers bound.
+* decode_program - Decodes a parsed instruction list against its per-line taint handlers.
+"""
+
+import operator
+from state import ABI_TO_REGISTER_IDX
+from taint import TAINT_DEST
+from instruction import SUPPORTED_FUNCTIONS, InsufficientOperands
+
+PC = ABI_TO_REGISTER_IDX['pc']
+
+
+## OPERAND RESOLUTION
+
+# Resolve 'offset(base)' into (base register index, integer offset).
+def resolve_memory(operand):
+    base = ABI_TO_REGISTER_IDX[operand.mem_reference.get_base()]
+    offset = int(operand.mem_reference.get_offset())
+    return base, offset
+
+
+# Resolve a label operand into the pc it points at.
+def resolve_target(instr, operand):
+    return instr.get_jump_target(operand.get_target_name())
+
+
+# Build a function of (state) returning the value of a source operand.
+def make_reader(operand):
+    if operand.is_register():
+        idx = operand.register_idx
+        return lambda state: state.registers[idx]
+    elif operand.is_memory():
+        base, offset = resolve_memory(operand)
+        return lambda state: state.get_memory(state.registers[base] + offset)
+    elif operand.is_constant():
+        constant = operand.constant
+        return lambda state: constant
+    elif operand.is_label():
+        raise Exception("Operand is a label. Use operand.get_target_name() instead.")
+    else:
+        raise Exception("Operand is not register, memory reference, or constant")
+
+
+# Build a function of (state, val) writing to a destination operand.
+def make_writer(operand):
+    if operand.is_register():
+        idx = operand.register_idx
+        # Writes to 'zero' are dropped.
+        if idx == 0:
+            return lambda state, val: None
+
+        def write_register(state, val):
+            state.registers[idx] = val
+        return write_register
+    elif operand.is_memory():
+        base, offset = resolve_memory(operand)
+        return lambda state, val: state.set_memory(state.registers[base] + offset, val)
+    else:
+        raise Exception("Instruction operand not register or memory")
+
+
+# Build a handler that raises 'error' when executed.
+# Keeps decoding lazy: unsupported lines only fail if they are reached.
+def make_raiser(error):
+    def raiser(*args, **kwargs):
+        raise error
+    return raiser
+
+
+## EXECUTE HANDLER FACTORIES
+# A factory takes a RiscvInstr and returns a function of (state).
+# The function returns the same result codes as RiscvInstr.execute:
+#   -1 final return, 0 return, 1 fall through, anything else a taken jump.
+
+# op0 = op1 <op> op2
+def decode_arith(op):
+    def factory(instr):
+        operands = instr.operands
+        if len(operands) < 3:
+            raise InsufficientOperands()
+        write = make_writer(operands[0])
+        src1, src2 = operands[1], operands[2]
+
+        # Specialize the common register destination forms.
+        if operands[0].is_register() and src1.is_register():
+            rd, rs1 = operands[0].register_idx, src1.register_idx
+            if rd != 0 and src2.is_register():
+                rs2 = src2.register_idx
+
+                def execute(state):
+                    regs = state.registers
+                    regs[rd] = op(regs[rs1], regs[rs2])
+                    return 1
+                return execute
+            elif rd != 0 and src2.is_constant():
+                imm = src2.constant
+
+                def execute(state):
+                    regs = state.registers
+                    regs[rd] = op(regs[rs1], imm)
+                    return 1
+                return execute
+
+        read1, read2 = make_reader(src1), make_reader(src2)
+
+        def execute(state):
+            write(state, op(read1(state), read2(state)))
+            return 1
+        return execute
+    return factory
+
+
+# lui    op0, op1
+# op0 = op1 << 12
+def decode_lui(instr):
+    operands = instr.operands
+    if len(operands) < 2:
+        raise InsufficientOperands()
+    write = make_writer(operands[0])
+    read = make_reader(operands[1])
+
+    def execute(state):
+        write(state, read(state) << 12)
+        return 1
+    return execute
+
+
+# mv    op0, op1
+# Pseudoinstruction for: addi    op0, op1, 0
+def decode_mv(instr):
+    operands = instr.operands
+    if len(operands) < 2:
+        raise InsufficientOperands()
+    write = make_writer(operands[0])
+    read = make_reader(operands[1])
+
+    def execute(state):
+        write(state, read(state))
+        return 1
+    return execute
+
+
+# Branch on compare(op0, op1), target in the last operand.
+def decode_branch(compare, num_operands):
+    def factory(instr):
+        operands = instr.operands
+        if len(operands) < num_operands:
+            raise InsufficientOperands()
+        target_name = operands[num_operands - 1].get_target_name()
+        target = resolve_target(instr, operands[num_operands - 1])
+        read1 = make_reader(operands[0])
+        read2 = make_reader(operands[1]) if num_operands == 3 else (lambda state: 0)
+
+        def execute(state):
+            if compare(read1(state), read2(state)):
+                state.registers[PC] = target
+                return target_name
+            return 1  # no_jump
+        return execute
+    return factory
+
+
+# bnez    op0, op1
+# Requires exactly two operands, like RiscvInstr.execute_bnez.
+def decode_bnez(instr):
+    if len(instr.operands) != 2:
+        raise InsufficientOperands()
+    return decode_branch(operator.ne, 2)(instr)
+
+
+# lw    op0, op1(op2)
+# op0 = val(op2 + op1)
+def decode_lw(instr):
+    operands = instr.operands
+    if len(operands) < 2:
+        raise InsufficientOperands()
+    write = make_writer(operands[0])
+    base, offset = resolve_memory(operands[1])
+
+    def execute(state):
+        write(state, state.get_memory(state.registers[base] + offset))
+        return 1
+    return execute
+
+
+# sw    op0, op1(op2)
+# val(op2 + op1) = op0
+def decode_sw(instr):
+    operands = instr.operands
+    if len(operands) < 2:
+        raise InsufficientOperands()
+    read = make_reader(operands[0])
+    base, offset = resolve_memory(operands[1])
+
+    def execute(state):
+        state.set_memory(state.registers[base] + offset, read(state))
+        return 1
+    return execute
+
+
+# call   op0
+# Set 'ra' to the next line and jump to function op0.
+def decode_call(instr):
+    operands = instr.operands
+    if len(operands) < 1:
+        raise InsufficientOperands()
+    elif len(operands) != 1:
+        raise Exception("Function args not yet handled")
+    target_name = operands[0].get_target_name()
+    target = resolve_target(instr, operands[0])
+    ra = ABI_TO_REGISTER_IDX['ra']
+
+    def execute(state):
+        regs = state.registers
+        regs[ra] = regs[PC] + 1
+        regs[PC] = target
+        return target_name
+    return execute
+
+
+# j    op0
+# jump to op0
+def decode_j(instr):
+    operands = instr.operands
+    if len(operands) < 1:
+        raise InsufficientOperands()
+    target_name = operands[0].get_target_name()
+    target = resolve_target(instr, operands[0])
+
+    def execute(state):
+        state.registers[PC] = target
+        return target_name
+    return execute
+
+
+# jalr    op0, op1, op2
+# jump to (op1 + op2), set op0 to the line following the jump.
+def decode_jalr(instr):
+    operands = instr.operands
+    if len(operands) != 3:
+        raise InsufficientOperands()
+    read1, read2 = make_reader(operands[1]), make_reader(operands[2])
+    rd = state_reg_idx(operands[0])
+
+    def execute(state):
+        regs = state.registers
+        pc = regs[PC]
+        jump_val = read1(state) + read2(state)
+        regs[PC] = jump_val
+        if rd != 0:
+            regs[rd] = pc + 1
+        return jump_val
+    return execute
+
+
+# ret
+# Pseudoinstruction for: jalr    zero, ra, zero
+def decode_ret(instr):
+    if len(instr.operands) != 0:
+        raise InsufficientOperands()
+    ra = ABI_TO_REGISTER_IDX['ra']
+
+    def execute(state):
+        regs = state.registers
+        jump_val = regs[ra]
+        regs[PC] = jump_val
+        # If return address is -1 then final return was executed.
+        return -1 if jump_val == -1 else 0
+    return execute
+
+
+# jalr names its destination register by token rather than by operand type.
+def state_reg_idx(operand):
+    return ABI_TO_REGISTER_IDX[operand.to_string()]
+
+
+DISPATCH = {
+    "addi": decode_arith(operator.add),
+    "add": decode_arith(operator.add),
+    "subi": decode_arith(operator.sub),
+    "sub": decode_arith(operator.sub),
+    "andi": decode_arith(operator.and_),
+    "and": decode_arith(operator.and_),
+    "xori": decode_arith(operator.xor),
+    "xor": decode_arith(operator.xor),
+    "srli": decode_arith(operator.rshift),
+    "srl": decode_arith(operator.rshift),
+    "slli": decode_arith(operator.lshift),
+    "sll": decode_arith(operator.lshift),
+    "lui": decode_lui,
+    "beq": decode_branch(operator.eq, 3),
+    "bne": decode_branch(operator.ne, 3),
+    "bnez": decode_bnez,
+    "blt": decode_branch(operator.lt, 3),
+    "bge": decode_branch(operator.ge, 3),
+    "mv": decode_mv,
+    "lw": decode_lw,
+    "sw": decode_sw,
+    "call": decode_call,
+    "j": decode_j,
+    "jalr": decode_jalr,
+    "ret": decode_ret,
+}
+
+
+## TAINT BOOKKEEPING
+# Mirrors TaintTracker.propagation_history_track with the destination resolved up front.
+# Returns a function of (tracker, state) giving the taint recorded for the line.
+
+def decode_dest_taint(instr):
+    strategy = TAINT_DEST[instr.opcode]
+
+    if strategy == 0 or strategy == 1:
+        operand = instr.operands[strategy]
+        if operand.is_register():
+            idx = operand.register_idx
+            return lambda tracker, state: tracker.shadow_registers[idx]
+        elif operand.is_memory():
+            base, offset = resolve_memory(operand)
+            return lambda tracker, state: tracker.get_memory_taint(
+                state.registers[base] + offset
+            )
+        return lambda tracker, state: 0
+    elif strategy == "call":
+        taint = SUPPORTED_FUNCTIONS.get(instr.operands[0].to_string(), 0)
+        return lambda tracker, state: taint
+    elif strategy == "ret" or strategy == "jump":
+        return lambda tracker, state: 0
+    raise Exception("Strategy {} not handled.".format(strategy))
+
+
+class DecodedInstr:
+    """
+    A RiscvInstr with its operands resolved and its handlers bound.
+    """
+    __slots__ = ("instr", "pc", "opcode", "operands", "execute", "propagate", "dest_taint")
+
+    # 'handler' is the line's taint handler from compile_policy, or None if it has none.
+    def __init__(self, instr, pc, handler):
+        self.instr = instr
+        self.pc = pc
+        self.opcode = instr.opcode
+        self.operands = instr.operands
+
+        if handler is not None:
+            self.propagate = handler
+        else:
+            self.propagate = make_raiser(
+                Exception("Taint opcode '{}' not handled.".format(self.opcode))
+            )
+
+        if self.opcode in DISPATCH:
+            self.execute = self._bind(DISPATCH[self.opcode])
+        else:
+            self.execute = make_raiser(
+                Exception("Execute operand {} not handled.".format(self.opcode))
+            )
+        self.dest_taint = self._bind(decode_dest_taint)
+
+    # Run a factory now, deferring any decode error until the line executes.
+    def _bind(self, factory):
+        try:
+            return factory(self.instr)
+        except Exception as error:
+            return make_raiser(error)
+
+    def to_string(self):
+        return self.instr.to_string()
+
+    def step(self, state, tracker):
+        # Same order as RiscvInstr.execute: propagate taint, then execute.
+        self.propagate(tracker=tracker, state=state, operands=self.operands)
+        tracker.record_propagation(self.pc, self.dest_taint(tracker, state))
+        return self.execute(state)
+
+    def step_idle(self, state, tracker):
+        # Nothing is tainted, so the policy is skipped and the line propagates no taint.
+        tracker.record_propagation(self.pc, 0)
+        return self.execute(state)
+
+
+def decode_program(instructions, handlers):
+    return [DecodedInstr(instr, pc, handlers[pc]) for pc, instr in enumerate(instructions)]
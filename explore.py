@@ -0,0 +1,273 @@
+"""
+explore.py
+
+Runs the rest of a program from one snapshot under several taint policies at once, and compares
+how each policy ends: final taint, heavy hitters, and the calls that passed taint to a sink.
+
+The snapshot is restored once. Each policy then runs in its own process forked from the
+restored interpreter, so every continuation starts from the same state, shared copy-on-write,
+without unpickling it again. At most 'workers' continuations run at a time. Each writes what the
+program and its hooks print to '<pickle_jar>/explore/output_<n>.txt', numbered in the order the
+policies are given, and its results next to it.
+
+A sink is a function that data should not reach tainted, like 'printf' or 'send'. Every call to
+a sink with a tainted argument register (a0 to a7) is a sink event. Sinks are watched by a hook
+on every 'call', so policies without a 'call' handler record no sink events.
+
+Forking needs a POSIX system.
+
+* SINK_FUNCTIONS - Functions watched as sinks by default.
+* explore - Runs a snapshot's continuation under every policy and returns the comparison.
+* print_comparison - Prints the results of every policy side by side.
+
+# Example Execution.
+# python explore.py --pickle_path=pickle_cabinet/jar_get_loc/pickles/state-instr008-line009 \
+#     --policy=policy --policy=policy:implicit_policy --sink=hash
+"""
+
+import os
+import gc
+import sys
+import json
+import time
+import click
+import contextlib
+from snapshot import load_snapshot
+# Snapshots taken by 'python interpreter.py' pickle the interpreter as '__main__.RiscvInterpreter'.
+from interpreter import RiscvInterpreter
+from state import ABI_TO_REGISTER_IDX
+from policy_compiler import Hook, load_policy, DEFAULT_POLICY
+
+SINK_FUNCTIONS = ("printf", "puts", "putchar", "fputs", "fprintf", "fwrite", "write", "send",
+                  "sendto")
+ARGUMENT_REGISTERS = ["a{}".format(idx) for idx in range(8)]
+
+
+class SinkRecorder():
+    """
+    Hook on 'call' that records every call to a sink with tainted arguments.
+    """
+    def __init__(self, interpreter, sinks):
+        self.interpreter = interpreter
+        self.sinks = frozenset(sinks)
+        self.events = []
+
+    def __call__(self, tracker, state, operands):
+        function = operands[0].get_target_name()
+        if function not in self.sinks:
+            return
+        arguments = {
+            reg: tracker.print_taint(tracker.get_register_taint(reg))
+            for reg in ARGUMENT_REGISTERS if tracker.get_register_taint(reg)
+        }
+        if arguments:
+            self.events.append({
+                "step": self.interpreter.step_count,
+                "line": state.get_register('pc'),
+                "function": function,
+                "arguments": arguments,
+            })
+
+
+def get_explore_dir(pickle_path):
+    # Snapshots live in '<pickle_jar>/pickles/'.
+    pickle_jar = os.path.dirname(os.path.dirname(os.path.abspath(pickle_path)))
+    return "{}/explore".format(pickle_jar)
+
+
+def run_continuation(interpreter, policy_name, sinks):
+    """
+    Runs 'interpreter' to completion under a policy and returns its results.
+    Meant to run in a forked child, since it changes the interpreter.
+    """
+    policy, hooks = load_policy(policy_name)
+    recorder = SinkRecorder(interpreter, sinks)
+    interpreter.set_policy(policy, hooks + [Hook(recorder, opcodes=["call"])])
+
+    start_step = interpreter.step_count
+    start = time.perf_counter()
+    while interpreter.step():
+        pass
+    wall_time = time.perf_counter() - start
+
+    tracker = interpreter.tracker
+    instructions = interpreter._instructions
+    heavy_hitters = tracker.heavy_hitters.get_heavy_hitters(
+        interpreter.hh_threshold, range(len(instructions)))
+    return {
+        "return_value": interpreter.state.get_register('a0'),
+        "register_taint": {
+            reg: tracker.print_taint(tracker.get_register_taint(idx))
+            for reg, idx in ABI_TO_REGISTER_IDX.items()
+            if tracker.get_register_taint(idx)
+        },
+        "tainted_memory": tracker.count_tainted_memory(),
+        "heavy_hitters": [
+            {"line": line, "instruction": instructions[line].to_string()}
+            for line in heavy_hitters
+        ],
+        "sink_events": recorder.events,
+        "steps_run": interpreter.step_count - start_step,
+        "wall_time": wall_time,
+    }
+
+
+# Run one continuation in a forked child. The child never returns.
+def fork_continuation(interpreter, idx, policy_name, sinks, explore_dir):
+    # Anything buffered before the fork would be written again by the child.
+    sys.stdout.flush()
+    sys.stderr.flush()
+    # Results left by an earlier exploration must not pass for this child's.
+    with contextlib.suppress(FileNotFoundError):
+        os.remove("{}/result_{:02d}.json".format(explore_dir, idx))
+    pid = os.fork()
+    if pid != 0:
+        return pid
+
+    result = {"policy": policy_name, "error": None}
+    status = 0
+    try:
+        with open("{}/output_{:02d}.txt".format(explore_dir, idx), 'w') as output, \
+                contextlib.redirect_stdout(output):
+            result.update(run_continuation(interpreter, policy_name, sinks))
+    except Exception as error:
+        result["error"] = "{}: {}".format(type(error).__name__, error)
+        status = 1
+    finally:
+        try:
+            with open("{}/result_{:02d}.json".format(explore_dir, idx), 'w') as file:
+                json.dump(result, file)
+        finally:
+            os._exit(status)
+
+
+def explore(pickle_path, policies, workers=None, sinks=SINK_FUNCTIONS, explore_dir=None):
+    """
+    Runs the continuation of the snapshot at 'pickle_path' under every policy in 'policies',
+    named as on the interpreter's command line, across at most 'workers' forked processes
+    (all cores by default). Returns the comparison: the step the snapshot was taken at and
+    every policy's results, in the order given.
+    """
+    if not hasattr(os, "fork"):
+        raise Exception("Exploring policies needs os.fork, which this platform lacks")
+    if not policies:
+        raise Exception("No policies to explore")
+    explore_dir = explore_dir or get_explore_dir(pickle_path)
+    os.makedirs(explore_dir, exist_ok=True)
+    workers = workers or os.cpu_count()
+
+    interpreter = load_snapshot(pickle_path)
+    # Keep the collector from touching the restored objects, so children keep sharing their pages.
+    gc.collect()
+    gc.freeze()
+
+    start = time.perf_counter()
+    pending = list(enumerate(policies))
+    running = {}
+    results = [None] * len(policies)
+    try:
+        while pending or running:
+            while pending and len(running) < workers:
+                idx, policy_name = pending.pop(0)
+                pid = fork_continuation(interpreter, idx, policy_name, sinks, explore_dir)
+                running[pid] = idx
+            pid, status = os.wait()
+            idx = running.pop(pid)
+            results[idx] = load_result(explore_dir, idx, policies[idx], status)
+            print("policy {} {}: {}".format(
+                idx, "FAILED" if results[idx]["error"] else "done", policies[idx]))
+    finally:
+        gc.unfreeze()
+
+    return {
+        "snapshot": pickle_path,
+        "step": interpreter.step_count,
+        "line": interpreter.state.get_register('pc'),
+        "wall_time": time.perf_counter() - start,
+        "results": results,
+    }
+
+
+def load_result(explore_dir, idx, policy_name, status):
+    # A child killed before it wrote its results still gets an entry.
+    try:
+        with open("{}/result_{:02d}.json".format(explore_dir, idx)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {"policy": policy_name,
+                "error": "Continuation exited with wait status {}".format(status)}
+
+
+def print_comparison(comparison):
+    results = comparison["results"]
+    # Wide enough for every policy name and taint.
+    width = max([12] + [len(result["policy"]) for result in results] + [
+        len(taint) for result in results for taint in result.get("register_taint", {}).values()
+    ]) + 2
+
+    def row(name, values):
+        print("{:<16}".format(name) + "".join("{:<{}}".format(str(val), width) for val in values))
+
+    print("\nFROM STEP {} (line {}) OF {}".format(
+        comparison["step"], comparison["line"], comparison["snapshot"]))
+    failed = [result for result in results if result["error"]]
+    results = [result for result in results if not result["error"]]
+    if results:
+        row("", [result["policy"] for result in results])
+        row("return value", [result["return_value"] for result in results])
+        row("steps run", [result["steps_run"] for result in results])
+        row("wall time", ["{:.3f}s".format(result["wall_time"]) for result in results])
+        row("tainted memory", [result["tainted_memory"] for result in results])
+        tainted = {reg for result in results for reg in result["register_taint"]}
+        for reg in ABI_TO_REGISTER_IDX:
+            if reg in tainted:
+                row("'{}' taint".format(reg),
+                    [result["register_taint"].get(reg, "CLEAN") for result in results])
+
+        print("\nHEAVY HITTERS")
+        lines = sorted({hitter["line"] for result in results for hitter in result["heavy_hitters"]})
+        for line in lines:
+            row("line {}".format(line),
+                ["yes" if any(hitter["line"] == line for hitter in result["heavy_hitters"])
+                 else "" for result in results])
+
+        print("\nTAINTED SINK EVENTS")
+        row("events", [len(result["sink_events"]) for result in results])
+        for result in results:
+            for event in result["sink_events"]:
+                print("{}: step {}, line {}, {}({})".format(
+                    result["policy"], event["step"], event["line"], event["function"],
+                    ", ".join("{}={}".format(reg, taint)
+                              for reg, taint in event["arguments"].items())))
+
+    for result in failed:
+        print("\n{} FAILED: {}".format(result["policy"], result["error"]))
+
+
+@click.command()
+@click.option('--pickle_path', required=True, help='Snapshot to continue from.')
+@click.option('--policy', 'policies', multiple=True, default=[DEFAULT_POLICY],
+              help="Policy to continue under, as 'module', 'module:attribute', or 'file.py'. "
+                   "Repeat for every policy to compare.")
+@click.option('--sink', 'sinks', multiple=True,
+              help='Also watch this function as a sink. Repeat for more.')
+@click.option('--workers', default=0, help='Continuations run at once. 0 uses every core.')
+@click.option('--report', default=None,
+              help='Where to write the JSON comparison. Defaults to <pickle_jar>/explore/.')
+def main(pickle_path, policies, sinks, workers, report):
+    explore_dir = get_explore_dir(pickle_path)
+    comparison = explore(pickle_path, list(policies), workers or None,
+                         SINK_FUNCTIONS + tuple(sinks), explore_dir)
+    print_comparison(comparison)
+
+    report = report or "{}/report.json".format(explore_dir)
+    with open(report, 'w') as file:
+        json.dump(comparison, file, indent=2)
+    print("\nComparison written to {}".format(report))
+    if any(result["error"] for result in comparison["results"]):
+        sys.exit(1)
+    return 0
+
+
+if __name__ == '__main__':
+    main()
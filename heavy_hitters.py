@@ -0,0 +1,125 @@
+"""
+heavy_hitters.py
+
+Streaming heavy hitter counters. For every line, counts how often it ran and how often it
+propagated taint, in constant memory per line, instead of keeping a history of every execution.
+
+* class HeavyHitters - Exact per-line counters.
+* class SketchHeavyHitters - Count-min sketch counters in constant total memory, for huge programs.
+
+Both record which counters changed since the last call to clear_changes(), so snapshots only
+save what changed.
+"""
+
+from array import array
+
+# Count-min sketch rows. Each estimate is the minimum over the rows.
+SKETCH_DEPTH = 4
+# Large prime for the sketch's hash functions.
+SKETCH_PRIME = 2147483647
+SKETCH_SEEDS = [(1103515245, 12345), (22695477, 1), (1664525, 1013904223), (214013, 2531011)]
+
+
+class HeavyHitters():
+    """
+    Exact counts of executions and taint propagations per line.
+    """
+    def __init__(self):
+        # Mappings of line to counts.
+        self.executions = {}
+        self.propagations = {}
+        # Lines whose counts changed since clear_changes().
+        self._changed = set()
+
+    def record(self, pc, taint):
+        self.executions[pc] = self.executions.get(pc, 0) + 1
+        if taint:
+            self.propagations[pc] = self.propagations.get(pc, 0) + 1
+        self._changed.add(pc)
+
+    def get_executions(self, pc):
+        return self.executions.get(pc, 0)
+
+    def get_propagations(self, pc):
+        return self.propagations.get(pc, 0)
+
+    # Fraction of the line's executions that propagated taint.
+    def get_propagation_rate(self, pc):
+        executions = self.get_executions(pc)
+        if executions == 0:
+            return 0
+        return self.get_propagations(pc) / executions
+
+    # Lines whose propagation rate exceeds 'threshold'.
+    # 'lines' defaults to every line that ran.
+    def get_heavy_hitters(self, threshold, lines=None):
+        lines = sorted(self.executions) if lines is None else lines
+        return [pc for pc in lines if self.get_propagation_rate(pc) > threshold]
+
+    ## CHANGE TRACKING
+
+    def get_changes(self):
+        return {pc: (self.get_executions(pc), self.get_propagations(pc)) for pc in self._changed}
+
+    def apply_changes(self, changes):
+        for pc, (executions, propagations) in changes.items():
+            self.executions[pc] = executions
+            if propagations:
+                self.propagations[pc] = propagations
+            else:
+                self.propagations.pop(pc, None)
+
+    def clear_changes(self):
+        self._changed.clear()
+
+
+class SketchHeavyHitters(HeavyHitters):
+    """
+    Count-min sketch of executions and taint propagations per line.
+    Memory is fixed at 2 * SKETCH_DEPTH * width counters, whatever the size of the program.
+    Estimates never undercount, and overcount by at most 2N/width with high probability
+    after N executions.
+    """
+    def __init__(self, width):
+        self.width = width
+        self.executions = array("Q", [0]) * (SKETCH_DEPTH * width)
+        self.propagations = array("Q", [0]) * (SKETCH_DEPTH * width)
+        # Sketch cells changed since clear_changes().
+        self._changed = set()
+
+    # Index of the line's counter in each row.
+    def _cells(self, pc):
+        return [
+            row * self.width + (a * pc + b) % SKETCH_PRIME % self.width
+            for row, (a, b) in enumerate(SKETCH_SEEDS[:SKETCH_DEPTH])
+        ]
+
+    def record(self, pc, taint):
+        cells = self._cells(pc)
+        for cell in cells:
+            self.executions[cell] += 1
+        if taint:
+            for cell in cells:
+                self.propagations[cell] += 1
+        self._changed.update(cells)
+
+    def get_executions(self, pc):
+        return min(self.executions[cell] for cell in self._cells(pc))
+
+    def get_propagations(self, pc):
+        return min(self.propagations[cell] for cell in self._cells(pc))
+
+    def get_heavy_hitters(self, threshold, lines=None):
+        # The sketch does not remember which lines ran.
+        if lines is None:
+            raise Exception("A sketch needs the lines to query")
+        return [pc for pc in lines
+                if self.get_executions(pc) and self.get_propagation_rate(pc) > threshold]
+
+    def get_changes(self):
+        return {cell: (self.executions[cell], self.propagations[cell]) for cell in self._changed}
+
+    def apply_changes(self, changes):
+        for cell, (executions, propagations) in changes.items():
+            self.executions[cell] = executions
+            self.propagations[cell] = propagations
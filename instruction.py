@@ -26,6 +26,16 @@ TAINT_FACE = 0x1000
 TAINT_PASSWORD = 0x10000
 TAINT_OTHER = 0x100000
 
+# Every taint flag with its name, in the order they are reported.
+TAINT_FLAGS = [
+    ("TAINT_LOC", TAINT_LOC),
+    ("TAINT_UID", TAINT_UID),
+    ("TAINT_NAME", TAINT_NAME),
+    ("TAINT_FACE", TAINT_FACE),
+    ("TAINT_PASSWORD", TAINT_PASSWORD),
+    ("TAINT_OTHER", TAINT_OTHER),
+]
+
 SUPPORTED_FUNCTIONS = {
     "get_user_location": TAINT_LOC,
     "get_uid": TAINT_UID,
@@ -291,6 +301,21 @@ class RiscvInstr:
         else:
             return 1  # no_jump
 
+    # bge    op0, op1, op2
+    # jump to op2 if op0 >= op1
+    def execute_bge(self, state):
+        if len(self.operands) < 3:
+            raise InsufficientOperands()
+        branch_val = (self.operands[2]).get_target_name()
+        pc = self.get_jump_target(branch_val)
+        if state.get_operand_val(self.operands[0]) >= state.get_operand_val(
+            self.operands[1]
+        ):
+            state.set_register("pc", pc)
+            return branch_val
+        else:
+            return 1  # no_jump
+
     ## MEMORY
 
     # mv    op0, op1
@@ -298,8 +323,10 @@ class RiscvInstr:
     def execute_mv(self, state):
         # mv is a pseudoinstruction for:
         # addi    arg1, arg2, 0
-        self.operands.append(RiscvOperand("0", self._block_labels))
-        self.execute_addi(state)
+        if len(self.operands) < 2:
+            raise InsufficientOperands()
+        val1 = state.get_operand_val(self.operands[1])
+        state.update_val(self.operands[0], val1)
 
     # lw    op0, op1(op2)
     # op0 = val(op2 + op1)
@@ -369,18 +396,20 @@ class RiscvInstr:
             raise InsufficientOperands()
         # ret is a pseudoinstruction for:
         # jalr    zero, ra, zero
-        self.opcode = "jalr"
-        self.operands = [
-            RiscvOperand("zero", self._block_labels),
-            RiscvOperand("ra", self._block_labels),
-            RiscvOperand("zero", self._block_labels),
-        ]
+        # The return address is read directly so the instruction itself is left unchanged,
+        # otherwise the next execution of this line would run (and be tainted) as a jalr.
+        jump_val = state.get_register("ra")
+        state.set_register("pc", jump_val)
         # If return address is -1 then final return was executed.
-        return -1 if self.execute_jalr(state) == -1 else 0
+        return -1 if jump_val == -1 else 0
 
-    def execute(self, state, tracker):
+    # With propagate=False the policy is skipped and the line is recorded as untainted.
+    def execute(self, state, tracker, propagate=True):
         result = 1
-        tracker.taint_by_operand(state, self.opcode, self.operands)
+        if propagate:
+            tracker.taint_by_operand(state, self.opcode, self.operands)
+        else:
+            tracker.record_propagation(state.get_register("pc"), 0)
 
         if self.opcode == "addi" or self.opcode == "add":
             self.execute_addi(state)
@@ -404,6 +433,8 @@ class RiscvInstr:
             return self.execute_bnez(state)
         elif self.opcode == "blt":
             return self.execute_blt(state)
+        elif self.opcode == "bge":
+            return self.execute_bge(state)
         elif self.opcode == "mv":
             self.execute_mv(state)
         elif self.opcode == "lw":
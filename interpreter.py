@@ -4,38 +4,121 @@ interpreter.py
 Interpreter parses a RISCV file.
 Executing the binary, tracking taint according to the dynamic policy (default policy is in policy.py)
 * main - handles arguments, sets up pickling, initializes interpreter, sets up policy
+* make_pickle_jar - Creates an empty pickle jar, clearing any old one.
+* run_with_snapshots - Runs an interpreter to completion, snapshotting every step into a jar.
 * class RiscvInterpreter - Runs the program instruction by instruction, taking snapshots regularly.
 """
 
 import sys
 import os
+import click
 from instruction import *
-from parser import RiscvParser
+from parser import RiscvParser, LabelIndex
+from program_cache import load_program, hash_file, PROGRAM_CACHE
+from decoder import decode_program, PC
+from blocks import BlockCompiler
+from snapshot import (
+    SnapshotStore,
+    KEYFRAME_INTERVAL,
+    SNAPSHOT_QUEUE_SIZE,
+    OVERFLOW_POLICIES,
+    OVERFLOW_BLOCK,
+    SNAPSHOT_FORMATS,
+    SNAPSHOT_PICKLE,
+)
+from page_store import COMPRESSIONS, DEFAULT_COMPRESSION
 import pickle
 from state import RiscvState
-from taint import TaintTracker
-from policy import policy as policy_from_disk
+from taint import TaintTracker, SHADOW_PAGED, SHADOW_BACKENDS
+from heavy_hitters import HeavyHitters, SketchHeavyHitters
+from labels import LabelTable
+from timeline import TimelineWriter
+from taint_log import TaintLogWriter
+from tracer import Tracer, TRACE_LEVELS, TRACE_BINARY, TRACE_OFF
+from profiler import OpcodeProfiler, BLOCK_OPCODE
+from time import perf_counter
+from policy_compiler import compile_policy, load_policy, uses_control_flow, DEFAULT_POLICY
+from control_flow import get_post_dominators
+from reachability import get_clean_lines, PRUNE_MODES, PRUNE_OFF, PRUNE_VERIFY
 import shutil
 
 MEM_SIZE = 4096
 STACK_SIZE = 128
 PICKLE_CABINET = "pickle_cabinet"
 
+# Execution engines.
+# 'classic' walks RiscvInstr.execute, 'decoded' runs the pre-decoded handlers from decoder.py,
+# 'block' runs whole basic blocks compiled by blocks.py.
+ENGINE_CLASSIC = "classic"
+ENGINE_DECODED = "decoded"
+ENGINE_BLOCK = "block"
+ENGINES = (ENGINE_CLASSIC, ENGINE_DECODED, ENGINE_BLOCK)
+
 
 class RiscvInterpreter():
     """
     Simulates execution of a RISC-V binary.
     """
-    def __init__(self, riscv_file, policy):
-        self.state = RiscvState(MEM_SIZE, STACK_SIZE)
-        self.tracker = TaintTracker(self.state, policy)
-
-        parser = RiscvParser(riscv_file)
-        self._instructions = parser.get_instructions()
-        self.block_labels = parser.get_labels()
+    def __init__(self, riscv_file, policy, engine=ENGINE_DECODED, mem_size=MEM_SIZE,
+                 idle_fast_path=True, hh_sketch_width=0, program_cache=None, profile=False,
+                 hooks=None, label_mode=False, shadow_memory=SHADOW_PAGED, taint_prune=PRUNE_OFF):
+        if engine not in ENGINES:
+            raise Exception("Unknown engine '{}'".format(engine))
+        self.engine = engine
+        self.state = RiscvState(mem_size, STACK_SIZE)
+        # Heavy hitters are counted exactly, or in a sketch of fixed size when a width is given.
+        if hh_sketch_width:
+            heavy_hitters = SketchHeavyHitters(hh_sketch_width)
+        else:
+            heavy_hitters = HeavyHitters()
+        # Label mode tracks a label per taint source call instead of a fixed set of flags.
+        labels = LabelTable() if label_mode else None
+        self.tracker = TaintTracker(self.state, policy, heavy_hitters, labels, shadow_memory)
+        # Policy hooks scoped to pc ranges or functions, compiled with the policy on decode.
+        self.hooks = list(hooks or [])
+
+        # Tracer of every step (see tracer.py), set by set_tracer.
+        self.tracer = None
+
+        # Per-opcode profiling, off unless asked for.
+        self.profiler = OpcodeProfiler() if profile else None
+        self.tracker.profiler = self.profiler
+
+        # Binary snapshots (see snapshot_format.py) name the program by its hash instead of
+        # holding the parsed program.
+        self.riscv_file = os.path.abspath(riscv_file)
+        self.program_hash = hash_file(riscv_file)
+        self.program_cache = None if program_cache is None else os.path.abspath(program_cache)
+
+        # Parse the file, or load it from the program cache directory when one is given.
+        if program_cache is None:
+            parser = RiscvParser(riscv_file)
+            self._instructions = parser.get_instructions()
+            self.block_labels = parser.get_labels()
+        else:
+            self._instructions, self.block_labels = load_program(
+                riscv_file, program_cache, self.program_hash)
+        # Block and function of every line, for call and return bookkeeping.
+        self.label_index = LabelIndex(self.block_labels, len(self._instructions))
+        # Skip the policy at lines proven clean by reachability.py.
+        self.taint_prune = taint_prune
+        self._decode()
+
+        # Lines that call a taint source. Taint-free mode ends when one is reached.
+        self._source_calls = {
+            pc for pc, instr in enumerate(self._instructions)
+            if instr.opcode == "call" and instr.operands
+            and instr.operands[0].to_string() in SUPPORTED_FUNCTIONS
+        }
+        # Run taint-free while nothing is tainted. Otherwise stay in taint mode throughout.
+        self.idle_fast_path = idle_fast_path
+        if not idle_fast_path:
+            self.tracker.set_taint_level(1)
 
         # Number of pickles created thus far.
         self.pickle_count = 0
+        # Number of steps run thus far. A step is one instruction, or one block with the block engine.
+        self.step_count = 0
 
         # Current block changes at every jump, call, and return.
         self.current_block = "main"
@@ -51,27 +134,147 @@ class RiscvInterpreter():
         # Heavy hitters threshold.
         self.hh_threshold = .75
 
+        # In verify mode an unpruned copy runs in lockstep, and every step is checked against it.
+        self._reference = None
+        if taint_prune == PRUNE_VERIFY:
+            self._reference = pickle.loads(pickle.dumps(self))
+            self._reference.taint_prune = PRUNE_OFF
+            self._reference._decode()
+
+    def __getstate__(self):
+        # Decoded handlers and compiled blocks cannot be pickled; rebuilt on load.
+        state = self.__dict__.copy()
+        state.pop('_decoded', None)
+        state.pop('_blocks', None)
+        state.pop('label_index', None)
+        state.pop('_clean', None)
+        state['_reference'] = None
+        state['tracer'] = None
+        return state
+
+    def __setstate__(self, state):
+        # Older jars snapshotted every step, so their step is their pickle count.
+        state.setdefault('step_count', state.get('pickle_count', 0))
+        state.setdefault('taint_prune', PRUNE_OFF)
+        state.setdefault('_reference', None)
+        for name in ('riscv_file', 'program_hash', 'program_cache'):
+            state.setdefault(name, None)
+        self.__dict__.update(state)
+        self.label_index = LabelIndex(self.block_labels, len(self._instructions))
+        self._decode()
+
+    def _decode(self):
+        self._decoded = None
+        self._blocks = None
+        # One taint handler per line, with hooks resolved, used by every engine.
+        handlers = compile_policy(self.tracker.policy, self.hooks,
+                                  self._instructions, self.label_index)
+        self.tracker.handlers = handlers
+        # Implicit flows close their scopes at post-dominators, computed once per program.
+        self.tracker.post_dominators = None
+        if uses_control_flow(self.tracker.policy):
+            self.tracker.post_dominators = get_post_dominators(
+                self._instructions, self.label_index)
+        self._clean = None
+        if self.taint_prune != PRUNE_OFF:
+            self._clean = get_clean_lines(self._instructions, self.label_index, self.block_labels,
+                                          self.tracker.policy, handlers)
+        if self.engine == ENGINE_DECODED or self.engine == ENGINE_BLOCK:
+            self._decoded = decode_program(self._instructions, handlers)
+        if self.engine == ENGINE_BLOCK:
+            # Logged and implicit-flow writes must go through the tracker, so are not inlined.
+            inline_taint = self.tracker.taint_log is None and self.tracker.post_dominators is None
+            self._blocks = BlockCompiler(self._decoded, self.block_labels,
+                                         inline_taint=inline_taint, clean=self._clean)
+
+    # Hooks are kept unless new ones are given.
+    def set_policy(self, policy, hooks=None):
+        self.tracker.policy = policy
+        if hooks is not None:
+            self.hooks = list(hooks)
+        self._decode()
+        if self._reference is not None:
+            self._reference.set_policy(policy, hooks)
+
+    # Trace every step to 'tracer' (see tracer.py), or stop with None.
+    def set_tracer(self, tracer):
+        self.tracer = tracer
+        self.tracker.tracer = tracer
+
+    # Record every change of taint to 'taint_log' (see taint_log.py), or stop with None.
+    def set_taint_log(self, taint_log):
+        self.tracker.taint_log = taint_log
+        if self.engine == ENGINE_BLOCK:
+            self._decode()
+
     def get_state(self):
         return self.state
 
     def get_tracker(self):
         return self.tracker
 
+    # Set the block and function containing the instruction pointer, after a return.
     def set_corresponding_block(self):
-        pc = self.state.get_register('pc')
-        prev_val = 0
-
-        # Find the block containing the instruction pointer.
-        for key, val in self.block_labels.items():
-            if prev_val <= pc and pc <= val:
-                block_name = key
-            prev_val = val
-        self.current_block = block_name
-        self.current_function = block_name
+        pc = self.state.registers[PC]
+        self.current_block = self.label_index.get_block(pc)
+        self.current_function = self.label_index.get_function(pc)
 
     def _run_one(self, instr):
-        # Run a single instruction.
-        result = instr.execute(self.state, self.tracker)
+        pc = self.state.registers[PC]
+        tracker = self.tracker
+
+        # Implicit flows: close the control scopes that end at this line.
+        if tracker.control_stack:
+            tracker.pop_control_scopes(pc)
+
+        # Taint-free mode skips the policy until a taint source is called.
+        propagate = tracker.taint_level != 0
+        if self._blocks is not None:
+            # Blocks end at calls, so only the last line of a block can call a source.
+            instr = self._instructions[self._blocks.get_block_end(pc)]
+            if not propagate and self._blocks.get_block_end(pc) in self._source_calls:
+                tracker.set_taint_level(1)
+                propagate = True
+            if self.profiler is None:
+                result = self._blocks.run(pc, self.state, tracker, propagate)
+            else:
+                start = perf_counter()
+                result = self._blocks.run(pc, self.state, tracker, propagate)
+                elapsed = perf_counter() - start
+                self.profiler.add(BLOCK_OPCODE, elapsed)
+                self.profiler.add_function(self.label_index.get_function(pc), elapsed)
+        else:
+            if not propagate and pc in self._source_calls:
+                tracker.set_taint_level(1)
+                propagate = True
+            tracker.num_total_instr_run += 1
+            if propagate:
+                tracker.num_tainted_instr_run += 1
+            # Lines proven clean skip the policy as in taint-free mode.
+            run_policy = propagate and (self._clean is None or not self._clean[pc])
+
+            if self.profiler is not None:
+                start = perf_counter()
+                if self._decoded is None:
+                    result = self.profiler.step_classic(instr, self.state, tracker, run_policy)
+                else:
+                    result = self.profiler.step_decoded(
+                        self._decoded[pc], self.state, tracker, run_policy)
+                self.profiler.add_function(self.label_index.get_function(pc),
+                                           perf_counter() - start)
+            elif self._decoded is None:
+                result = instr.execute(self.state, tracker, run_policy)
+            elif run_policy:
+                result = self._decoded[pc].step(self.state, tracker)
+            else:
+                result = self._decoded[pc].step_idle(self.state, tracker)
+
+        if propagate and self.idle_fast_path and tracker.is_taint_idle():
+            tracker.set_taint_level(0)
+
+        # Label sets are compacted between steps, once the table outgrows its bound.
+        if tracker.labels is not None and tracker.labels.needs_compaction:
+            tracker.compact_labels()
 
         if result != 0 and not result:
             raise Exception("unsupported instruction: {}".format(instr.opcode))
@@ -82,6 +285,7 @@ class RiscvInterpreter():
                 return False
             # Return.
             elif result == 0:
+                tracker.call_depth -= 1
                 self.set_corresponding_block()
                 return True
             # Non-jump instruction.
@@ -91,17 +295,49 @@ class RiscvInterpreter():
                 return True
             # Jump or call instruction.
             else:
-                self.current_block = result
+                pc = self.state.registers[PC]
+                self.current_block = self.label_index.get_block(pc)
                 if instr.opcode == "call":
-                    self.current_function = result
+                    tracker.call_depth += 1
+                    self.current_function = self.label_index.get_function(pc)
                 return True
 
+    # Run one step, tracing it when a tracer is set.
     def run(self):
-        pc = self.state.get_register('pc')
-        instr = self._instructions[pc]
-
-        print("\nRUN LINE {}: {}".format(pc, instr.to_string()))
-        return self._run_one(instr)
+        tracer = self.tracer
+        if tracer is None:
+            return self.step()
+        pc = self.state.registers[PC]
+        tracer.before_step(self)
+        running = self.step()
+        tracer.record(self, pc)
+        return running
+
+    # Run one step without printing. Returns False once the final return has run.
+    def step(self):
+        self.step_count += 1
+        if self._reference is not None:
+            return self._verify_step()
+        return self._run_one(self._instructions[self.state.registers[PC]])
+
+    # Run one step here and in the unpruned reference, and check that taint still matches.
+    def _verify_step(self):
+        pc = self.state.registers[PC]
+        running = self._run_one(self._instructions[pc])
+        reference = self._reference
+        reference.step()
+
+        tracker = self.tracker
+        expected = reference.tracker
+        # Pruning only skips writes, so every page it could have changed is dirty in the reference.
+        pages = [page for page in expected.dirty_pages
+                 if tracker.shadow_memory.get_page(page) != expected.shadow_memory.get_page(page)]
+        expected.dirty_pages.clear()
+        if (tracker.shadow_registers != expected.shadow_registers or pages
+                or tracker.taint_source != expected.taint_source):
+            raise Exception("Taint pruning changed the shadow state at step {}, line {}".format(
+                self.step_count, pc))
+        return running
 
     def pickle_current_state(self, fileheader, pickle_jar):
         pc = self.state.get_register('pc')
@@ -116,20 +352,112 @@ class RiscvInterpreter():
 
     def print_heavy_hitters(self):
         print("\nHEAVY HITTERS")
-        for line, history in self.tracker.propagation_history.items():
-            percentage = sum(history) / len(history)
-            if percentage > self.hh_threshold:
-                print("line {} : {}".format(line, self._instructions[line].to_string()))
+        lines = range(len(self._instructions))
+        for line in self.tracker.heavy_hitters.get_heavy_hitters(self.hh_threshold, lines):
+            print("line {} : {}".format(line, self._instructions[line].to_string()))
         return
 
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: {} <riscv_file> <program_args>"
-              .format(sys.argv[0]))
-        sys.exit(1)
+# Create an empty pickle jar, or clear the old one.
+def make_pickle_jar(pickle_jar):
+    if os.path.isdir(pickle_jar):
+        shutil.rmtree(pickle_jar)
+    os.makedirs(pickle_jar)
+    os.mkdir("{}/pickles".format(pickle_jar))
+    os.mkdir("{}/data".format(pickle_jar))
+
 
-    riscv_file = sys.argv[1]
+# Interpreter loop with taint tracking.
+# A snapshot is taken every 'snapshot_interval' steps; seek.py replays the steps in between.
+# Pending snapshots and timeline rows are flushed to the jar even if execution raises.
+def run_with_snapshots(interpreter, pickle_jar, keyframe_interval=KEYFRAME_INTERVAL,
+                       snapshot_queue=SNAPSHOT_QUEUE_SIZE, snapshot_overflow=OVERFLOW_BLOCK,
+                       timeline=True, snapshot_interval=1, taint_log=False,
+                       trace=TRACE_BINARY, trace_ring=0, snapshot_format=SNAPSHOT_PICKLE,
+                       page_compression=DEFAULT_COMPRESSION):
+    snapshots = SnapshotStore(pickle_jar, "state", keyframe_interval,
+                              snapshot_queue, snapshot_overflow, snapshot_format,
+                              page_compression)
+    timeline_writer = TimelineWriter(pickle_jar) if timeline else None
+    taint_log_writer = TaintLogWriter(pickle_jar, interpreter) if taint_log else None
+    if taint_log_writer is not None:
+        interpreter.set_taint_log(taint_log_writer)
+    tracer = Tracer(pickle_jar, interpreter, trace, trace_ring) if trace != TRACE_OFF else None
+    interpreter.set_tracer(tracer)
+    snapshot_interval = max(1, snapshot_interval)
+    try:
+        with snapshots:
+            snapshots.capture_origin(interpreter)
+            while(interpreter.run()):
+                start = perf_counter()
+                if interpreter.step_count % snapshot_interval == 0:
+                    snapshots.capture(interpreter)
+                if timeline_writer is not None:
+                    timeline_writer.append(interpreter)
+                if interpreter.profiler is not None:
+                    interpreter.profiler.add_snapshot(perf_counter() - start)
+    finally:
+        if timeline_writer is not None:
+            timeline_writer.close()
+        if taint_log_writer is not None:
+            interpreter.set_taint_log(None)
+            taint_log_writer.close()
+        if tracer is not None:
+            interpreter.set_tracer(None)
+            tracer.close()
+    return interpreter
+
+
+@click.command()
+@click.argument('riscv_file')
+@click.option('--engine', type=click.Choice(ENGINES), default=ENGINE_DECODED,
+              help='Execution engine. Every engine produces the same final state.')
+@click.option('--keyframe_interval', default=KEYFRAME_INTERVAL,
+              help='Write a full snapshot every N snapshots, and page deltas in between.')
+@click.option('--snapshot_queue', default=SNAPSHOT_QUEUE_SIZE,
+              help='Snapshots waiting for the background writer. 0 writes them inline.')
+@click.option('--snapshot_overflow', type=click.Choice(OVERFLOW_POLICIES), default=OVERFLOW_BLOCK,
+              help='When the snapshot queue is full, wait for the writer or drop the oldest.')
+@click.option('--snapshot_format', type=click.Choice(SNAPSHOT_FORMATS), default=SNAPSHOT_PICKLE,
+              help='pickle pickles the whole interpreter, binary writes fixed-width sections '
+                   'that can be read in place, dedup stores every distinct page once '
+                   'in <pickle_jar>/pages.')
+@click.option('--page_compression', type=click.Choice(sorted(COMPRESSIONS)),
+              default=DEFAULT_COMPRESSION, help='Compression of the pages of the dedup format.')
+@click.option('--snapshot_interval', default=1,
+              help='Snapshot every N steps. seek.py reaches the steps in between by replaying.')
+@click.option('--taint_log/--no-taint_log', default=False,
+              help='Log every change of taint to <pickle_jar>/taint_log for taint_log.py queries.')
+@click.option('--trace', type=click.Choice(TRACE_LEVELS), default=TRACE_BINARY,
+              help='binary records each step to <pickle_jar>/trace.bin for tracer.py, '
+                   'lines also prints each line, taint also lets hooks print register taint.')
+@click.option('--trace_ring', default=0,
+              help='Keep only the trace of the last N steps. 0 keeps every step.')
+@click.option('--mem_size', default=MEM_SIZE,
+              help='Memory size in cells. Pages are only allocated once written.')
+@click.option('--idle_fast_path/--no-idle_fast_path', default=True,
+              help='Skip the taint policy while nothing is tainted.')
+@click.option('--hh_sketch_width', default=0,
+              help='Count heavy hitters in a count-min sketch of this width. 0 counts exactly.')
+@click.option('--timeline/--no-timeline', default=True,
+              help='Record per-step taint counts to <pickle_jar>/timeline for analyze.py.')
+@click.option('--program_cache/--no-program_cache', default=True,
+              help='Reuse the parsed program from {}/ when the file is unchanged.'.format(PROGRAM_CACHE))
+@click.option('--policy', default=DEFAULT_POLICY,
+              help="Policy module or file, as 'module', 'module:attribute', or 'file.py'.")
+@click.option('--profile', default=None,
+              help='Profile time per opcode and phase, and write it as JSON to this path.')
+@click.option('--taint_labels/--no-taint_labels', default=False,
+              help='Give every taint source call its own label instead of a shared taint flag.')
+@click.option('--shadow_memory', type=click.Choice(sorted(SHADOW_BACKENDS)), default=SHADOW_PAGED,
+              help='Shadow memory backend. ranges compresses runs of equally tainted cells.')
+@click.option('--taint_prune', type=click.Choice(PRUNE_MODES), default=PRUNE_OFF,
+              help='Skip the policy at lines proven never to see taint. '
+                   'verify also checks every step against an unpruned run.')
+def main(riscv_file, engine, keyframe_interval, snapshot_queue, snapshot_overflow,
+         snapshot_format, page_compression, snapshot_interval, taint_log, trace, trace_ring,
+         mem_size, idle_fast_path, hh_sketch_width, timeline, program_cache,
+         policy, profile, taint_labels, shadow_memory, taint_prune):
     if not os.path.isfile(riscv_file) or riscv_file.split('.')[1] != 's':
         print("'{}' is not a RISC-V assembly file".format(riscv_file))
         sys.exit(1)
@@ -142,27 +470,29 @@ def main():
     # or clears old old pickle folder.
     filename = riscv_file.split('.')[0].replace("/", "_")
     pickle_jar = "{}/jar_{}".format(PICKLE_CABINET, filename)
-    if os.path.isdir(pickle_jar):
-        shutil.rmtree(pickle_jar)
-    os.mkdir(pickle_jar)
-    os.mkdir("{}/pickles".format(pickle_jar))
-    os.mkdir("{}/data".format(pickle_jar))
-
-    # TODO: handle arguments
-    # program_args = sys.argv[min_args:]
+    make_pickle_jar(pickle_jar)
 
     print("\nBEGINNING EXECUTION...")
-    interpreter = RiscvInterpreter(riscv_file, policy_from_disk)
-
-    # Interpreter loop with taint tracking.
-    while(interpreter.run()):
-        interpreter.pickle_current_state("state", pickle_jar)
+    policy, hooks = load_policy(policy)
+    interpreter = RiscvInterpreter(riscv_file, policy, engine=engine, mem_size=mem_size,
+                                   idle_fast_path=idle_fast_path, hh_sketch_width=hh_sketch_width,
+                                   program_cache=PROGRAM_CACHE if program_cache else None,
+                                   profile=profile is not None, hooks=hooks,
+                                   label_mode=taint_labels, shadow_memory=shadow_memory,
+                                   taint_prune=taint_prune)
+    run_with_snapshots(interpreter, pickle_jar, keyframe_interval, snapshot_queue,
+                       snapshot_overflow, timeline, snapshot_interval, taint_log, trace, trace_ring,
+                       snapshot_format, page_compression)
 
     # Return value is stored in 'a0'.
     print("\nRETURN VALUE: ", interpreter.state.get_register('a0'))
     print("\nEXECUTION FINISHED!\n\n####### FINAL RESULTS #############")
     interpreter.tracker.print_registers_taint()
     interpreter.print_heavy_hitters()
+    interpreter.tracker.print_mode_stats()
+    if interpreter.profiler is not None:
+        interpreter.profiler.print_stats()
+        interpreter.profiler.dump(profile)
 
     return 0
 
@@ -0,0 +1,165 @@
+"""
+labels.py
+
+Taint labels for label mode, in the style of DFSan.
+
+In label mode a shadow cell holds the ID of an interned set of labels instead of a bitmask of
+taint flags. Every call to a taint source creates a new label, like 'get_password#2', so taint
+from different calls stays distinguishable. ID 0 is the empty set, so a clean cell is 0 in
+either mode.
+
+The union of two sets is memoized, so after the first time it is a single dictionary hit.
+Memory stays bounded: the union memo is dropped whenever it outgrows MAX_UNIONS, and once more
+than 'max_sets' sets are interned the tracker compacts the table down to the sets still held by
+a register or memory cell, renumbering the shadow state to match.
+
+* class LabelTable - Interns label sets and memoizes their unions.
+* merge_label_changes - Folds the label changes of two consecutive snapshot records.
+"""
+
+# Union memo entries kept before the memo is dropped.
+MAX_UNIONS = 1 << 16
+# Interned sets kept before the table is compacted.
+MAX_SETS = 1 << 16
+
+
+class LabelTable():
+    """
+    Label names, interned label sets, and the union memo.
+    """
+    def __init__(self, max_sets=MAX_SETS):
+        self.max_sets = max_sets
+        # Label index to (name, taint flag mask).
+        self.labels = []
+        # Set ID to the sorted tuple of label indices in it, and to the OR of their masks.
+        self.sets = [()]
+        self.masks = [0]
+        # Sorted tuple of label indices to set ID.
+        self._set_ids = {(): 0}
+        # (smaller ID, larger ID) to the ID of their union.
+        self._unions = {}
+        # Number of labels created per source, for naming.
+        self._source_counts = {}
+
+        # Set when more than '_limit' sets are interned. Cleared by compaction.
+        # The limit is 'max_sets', raised when most sets survive a compaction so it cannot thrash.
+        self.needs_compaction = False
+        self._limit = max_sets
+        # Changes since clear_changes(), for snapshots.
+        self._reset = False
+        self._first_new_label = 0
+        self._first_new_set = 1
+
+    def __len__(self):
+        return len(self.sets)
+
+    def _intern(self, members):
+        set_id = self._set_ids.get(members)
+        if set_id is None:
+            set_id = len(self.sets)
+            mask = 0
+            for label in members:
+                mask |= self.labels[label][1]
+            self.sets.append(members)
+            self.masks.append(mask)
+            self._set_ids[members] = set_id
+            if set_id >= self._limit:
+                self.needs_compaction = True
+        return set_id
+
+    # A new label for a call to 'source', tainting with 'mask'. Returns its singleton set.
+    def new_label(self, source, mask):
+        count = self._source_counts.get(source, 0) + 1
+        self._source_counts[source] = count
+        self.labels.append(("{}#{}".format(source, count), mask))
+        return self._intern((len(self.labels) - 1,))
+
+    def union(self, set1, set2):
+        if set1 == set2 or set2 == 0:
+            return set1
+        if set1 == 0:
+            return set2
+        key = (set1, set2) if set1 < set2 else (set2, set1)
+        set_id = self._unions.get(key)
+        if set_id is None:
+            members = tuple(sorted(set(self.sets[set1]).union(self.sets[set2])))
+            set_id = self._intern(members)
+            if len(self._unions) >= MAX_UNIONS:
+                self._unions.clear()
+            self._unions[key] = set_id
+        return set_id
+
+    def get_mask(self, set_id):
+        return self.masks[set_id]
+
+    def get_names(self, set_id):
+        return [self.labels[label][0] for label in self.sets[set_id]]
+
+    ## COMPACTION
+
+    def compact(self, live):
+        """
+        Keeps only the sets in 'live' and the labels they use, renumbered densely.
+        Returns a mapping of old set ID to new set ID for every live set.
+        """
+        live = sorted(set(live) | {0})
+        old_sets = self.sets
+        used = sorted({label for set_id in live for label in old_sets[set_id]})
+        relabel = {old: new for new, old in enumerate(used)}
+
+        self.labels = [self.labels[old] for old in used]
+        self._reset_sets()
+        self._limit = max(self.max_sets, 2 * len(live))
+        remap = {}
+        for old in live:
+            remap[old] = self._intern(tuple(relabel[label] for label in old_sets[old]))
+        self.needs_compaction = False
+        self._reset = True
+        return remap
+
+    def _reset_sets(self):
+        self.sets = [()]
+        self.masks = [0]
+        self._set_ids = {(): 0}
+        self._unions = {}
+
+    ## CHANGE TRACKING
+
+    def get_changes(self):
+        if self._reset:
+            labels, sets = list(self.labels), self.sets[1:]
+        else:
+            labels, sets = self.labels[self._first_new_label:], self.sets[self._first_new_set:]
+        return {
+            "reset": self._reset,
+            "labels": labels,
+            "sets": sets,
+            "source_counts": dict(self._source_counts),
+        }
+
+    def apply_changes(self, changes):
+        if changes["reset"]:
+            self.labels = []
+            self._reset_sets()
+        self.labels.extend(changes["labels"])
+        for members in changes["sets"]:
+            self._intern(members)
+        self._source_counts = dict(changes["source_counts"])
+        self.needs_compaction = False
+
+    def clear_changes(self):
+        self._reset = False
+        self._first_new_label = len(self.labels)
+        self._first_new_set = len(self.sets)
+
+
+# Fold the label changes of an unwritten record into those of the record that follows it.
+def merge_label_changes(older, newer):
+    if older is None or newer["reset"]:
+        return newer
+    return {
+        "reset": older["reset"],
+        "labels": older["labels"] + newer["labels"],
+        "sets": older["sets"] + newer["sets"],
+        "source_counts": newer["source_counts"],
+    }
@@ -0,0 +1,377 @@
+"""
+memory.py
+
+Sparse paged memory, used for both interpreter memory and shadow memory.
+
+The address space is split into pages of PAGE_SIZE cells. Every page reads as the shared
+all-zero page until its first write, when a private copy is allocated. Memory use, snapshot
+size, and startup time therefore scale with the pages touched, not the size of memory.
+
+* PAGE_SIZE - Number of cells per page.
+* class PagedMemory - A fixed size array of cells backed by lazily allocated pages.
+* class CountingPagedMemory - PagedMemory that also counts how many cells hold each value.
+* class RangeMemory - Memory stored as runs of equal cells, for large uniformly tainted buffers.
+"""
+
+from bisect import bisect_right
+
+PAGE_SHIFT = 6
+PAGE_SIZE = 1 << PAGE_SHIFT
+PAGE_MASK = PAGE_SIZE - 1
+
+
+class PagedMemory():
+    """
+    Fixed size memory backed by pages allocated on first write.
+    'zero_page' is a PAGE_SIZE sequence of zeros, copied to allocate a page (a list or an array).
+    """
+    def __init__(self, size, zero_page):
+        self.size = size
+        self.zero_page = zero_page
+        # Mapping of page index to its allocated page.
+        self.pages = {}
+        # Live count of nonzero cells.
+        self.nonzero = 0
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for addr in range(self.size):
+            yield self.get(addr)
+
+    def __getitem__(self, addr):
+        return self.get(addr)
+
+    def __setitem__(self, addr, val):
+        self.set(addr, val)
+
+    def get(self, addr):
+        page = self.pages.get(addr >> PAGE_SHIFT)
+        if page is None:
+            return 0
+        return page[addr & PAGE_MASK]
+
+    def set(self, addr, val):
+        page = self.pages.get(addr >> PAGE_SHIFT)
+        if page is None:
+            # Writing zero to an untouched page does not need to allocate it.
+            if not val:
+                return
+            page = self.zero_page[:]
+            self.pages[addr >> PAGE_SHIFT] = page
+        idx = addr & PAGE_MASK
+        if page[idx]:
+            if not val:
+                self.nonzero -= 1
+        elif val:
+            self.nonzero += 1
+        page[idx] = val
+
+    ## PAGES
+
+    def num_pages(self):
+        return (self.size + PAGE_MASK) >> PAGE_SHIFT
+
+    def get_allocated_pages(self):
+        return sorted(self.pages)
+
+    # A copy of the page, or the shared zero page if it was never written.
+    def get_page(self, page):
+        if page in self.pages:
+            return self.pages[page][:]
+        return self.zero_page
+
+    # With copy=False the page keeps 'values' itself, which the caller must not change after.
+    # They must then be of the zero page's type.
+    def set_page(self, page, values, copy=True):
+        if page in self.pages:
+            self.nonzero -= PAGE_SIZE - self.pages[page].count(0)
+        self.pages[page] = values[:] if copy else values
+        self.nonzero += PAGE_SIZE - values.count(0)
+
+    # Page indices overlapping [start, end) with the bounds of the overlap within each page.
+    def page_ranges(self, start, end):
+        while start < end:
+            page = start >> PAGE_SHIFT
+            page_end = min(end, (page + 1) << PAGE_SHIFT)
+            yield page, start & PAGE_MASK, page_end - (page << PAGE_SHIFT)
+            start = page_end
+
+    ## BULK OPERATIONS
+
+    # Number of nonzero cells in [start, end).
+    def count_nonzero(self, start=0, end=None):
+        end = self.size if end is None else end
+        if start == 0 and end == self.size:
+            return self.nonzero
+        count = 0
+        for page, lo, hi in self.page_ranges(start, end):
+            cells = self.pages.get(page)
+            if cells is not None:
+                count += (hi - lo) - cells[lo:hi].count(0)
+        return count
+
+    # Set every cell in [start, end) to 'val'.
+    def set_range(self, start, end, val):
+        if val:
+            self.update_range(start, end, lambda cell: val)
+        else:
+            self.clear_range(start, end)
+
+    # (start, end, value) of every run of equal nonzero cells in [start, end).
+    def query_range(self, start, end):
+        runs = []
+        for page, lo, hi in self.page_ranges(start, end):
+            cells = self.pages.get(page)
+            if cells is None:
+                continue
+            base = page << PAGE_SHIFT
+            for idx in range(lo, hi):
+                val = cells[idx]
+                if not val:
+                    continue
+                if runs and runs[-1][1] == base + idx and runs[-1][2] == val:
+                    runs[-1][1] += 1
+                else:
+                    runs.append([base + idx, base + idx + 1, val])
+        return [tuple(run) for run in runs]
+
+    # Set every cell in [start, end) to fn(cell).
+    def update_range(self, start, end, fn):
+        for page, lo, hi in self.page_ranges(start, end):
+            cells = self.pages.get(page)
+            if cells is None:
+                cells = self.zero_page[:]
+                self.pages[page] = cells
+            before = (hi - lo) - cells[lo:hi].count(0)
+            for idx in range(lo, hi):
+                cells[idx] = fn(cells[idx])
+            self.nonzero += (hi - lo) - cells[lo:hi].count(0) - before
+
+    # Zero every cell in [start, end). Pages cleared in full are released.
+    def clear_range(self, start, end):
+        for page, lo, hi in self.page_ranges(start, end):
+            if page not in self.pages:
+                continue
+            self.nonzero -= (hi - lo) - self.pages[page][lo:hi].count(0)
+            if lo == 0 and hi == PAGE_SIZE:
+                del self.pages[page]
+            else:
+                self.pages[page][lo:hi] = self.zero_page[lo:hi]
+
+
+class CountingPagedMemory(PagedMemory):
+    """
+    PagedMemory that also keeps a live count of every nonzero value it holds.
+    Used for shadow memory, so a histogram of taint masks never needs a scan of memory.
+    """
+    def __init__(self, size, zero_page):
+        super().__init__(size, zero_page)
+        # Mapping of nonzero value to the number of cells holding it.
+        self.value_counts = {}
+
+    def _count(self, values, sign):
+        counts = self.value_counts
+        for val in values:
+            if val:
+                counts[val] = counts.get(val, 0) + sign
+                if not counts[val]:
+                    del counts[val]
+
+    def _range_values(self, start, end):
+        return [self.get(addr) for addr in range(start, end)]
+
+    def set(self, addr, val):
+        old = self.get(addr)
+        if old == val:
+            return
+        super().set(addr, val)
+        self._count((old,), -1)
+        self._count((val,), 1)
+
+    def set_page(self, page, values, copy=True):
+        if page in self.pages:
+            self._count(self.pages[page], -1)
+        super().set_page(page, values, copy)
+        self._count(values, 1)
+
+    def update_range(self, start, end, fn):
+        self._count(self._range_values(start, end), -1)
+        super().update_range(start, end, fn)
+        self._count(self._range_values(start, end), 1)
+
+    def clear_range(self, start, end):
+        self._count(self._range_values(start, end), -1)
+        super().clear_range(start, end)
+
+
+class RangeMemory():
+    """
+    Fixed size memory stored as maximal runs of equal cells, for shadow memory where large
+    buffers share one taint mask. Run i covers [starts[i], starts[i + 1]) and holds values[i].
+    Runs are found by binary search, so range operations cost O(log n) in the number of runs
+    plus the runs they cover, whatever the length of the range.
+    Has the interface of CountingPagedMemory, so snapshots and statistics work unchanged.
+    """
+    def __init__(self, size, zero_page):
+        self.size = size
+        self.zero_page = zero_page
+        self.starts = [0]
+        self.values = [0]
+        # Live count of nonzero cells, and mapping of nonzero value to the number of cells holding it.
+        self.nonzero = 0
+        self.value_counts = {}
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for start, end, val in self.iter_runs(0, self.size):
+            for _ in range(start, end):
+                yield val
+
+    def __getitem__(self, addr):
+        return self.get(addr)
+
+    def __setitem__(self, addr, val):
+        self.set(addr, val)
+
+    def _find(self, addr):
+        return bisect_right(self.starts, addr) - 1
+
+    def _run_end(self, idx):
+        return self.starts[idx + 1] if idx + 1 < len(self.starts) else self.size
+
+    # Make 'addr' the start of a run. Returns the index of that run.
+    def _split(self, addr):
+        if addr >= self.size:
+            return len(self.starts)
+        idx = self._find(addr)
+        if self.starts[idx] != addr:
+            idx += 1
+            self.starts.insert(idx, addr)
+            self.values.insert(idx, self.values[idx - 1])
+        return idx
+
+    def _count(self, val, cells):
+        if val:
+            self.nonzero += cells
+            count = self.value_counts.get(val, 0) + cells
+            if count:
+                self.value_counts[val] = count
+            else:
+                del self.value_counts[val]
+
+    # Merge runs [lo, hi) with their neighbours where values are equal.
+    def _coalesce(self, lo, hi):
+        idx = max(lo, 1)
+        hi = min(hi + 1, len(self.starts))
+        while idx < hi:
+            if self.values[idx] == self.values[idx - 1]:
+                del self.starts[idx]
+                del self.values[idx]
+                hi -= 1
+            else:
+                idx += 1
+
+    def get(self, addr):
+        return self.values[self._find(addr)]
+
+    def set(self, addr, val):
+        if self.get(addr) != val:
+            self.set_range(addr, addr + 1, val)
+
+    ## RANGES
+
+    # (start, end, value) of every run overlapping [start, end), clipped to it.
+    def iter_runs(self, start, end):
+        if start >= end:
+            return
+        idx = self._find(start)
+        while idx < len(self.starts) and self.starts[idx] < end:
+            yield max(start, self.starts[idx]), min(end, self._run_end(idx)), self.values[idx]
+            idx += 1
+
+    # (start, end, value) of every run of equal nonzero cells in [start, end).
+    def query_range(self, start, end):
+        return [run for run in self.iter_runs(start, end) if run[2]]
+
+    def set_range(self, start, end, val):
+        if start >= end:
+            return
+        lo = self._split(start)
+        hi = self._split(end)
+        for idx in range(lo, hi):
+            self._count(self.values[idx], self.starts[idx] - self._run_end(idx))
+        self.starts[lo:hi] = [start]
+        self.values[lo:hi] = [val]
+        self._count(val, end - start)
+        self._coalesce(lo, lo + 1)
+
+    # Set every cell in [start, end) to fn(cell), evaluated once per run.
+    def update_range(self, start, end, fn):
+        if start >= end:
+            return
+        lo = self._split(start)
+        hi = self._split(end)
+        for idx in range(lo, hi):
+            cells = self._run_end(idx) - self.starts[idx]
+            val = fn(self.values[idx])
+            self._count(self.values[idx], -cells)
+            self._count(val, cells)
+            self.values[idx] = val
+        self._coalesce(lo, hi)
+
+    def clear_range(self, start, end):
+        self.set_range(start, end, 0)
+
+    def count_nonzero(self, start=0, end=None):
+        end = self.size if end is None else end
+        if start == 0 and end == self.size:
+            return self.nonzero
+        return sum(run_end - run_start for run_start, run_end, val in self.iter_runs(start, end)
+                   if val)
+
+    # The runs as (starts, values), a compressed copy of the whole memory.
+    def get_runs(self):
+        return self.starts[:], self.values[:]
+
+    def set_runs(self, runs):
+        starts, values = runs
+        self.starts = list(starts)
+        self.values = list(values)
+        self.nonzero = 0
+        self.value_counts = {}
+        for idx in range(len(self.starts)):
+            self._count(self.values[idx], self._run_end(idx) - self.starts[idx])
+
+    ## PAGES
+    # Page views for callers written against PagedMemory.
+
+    def num_pages(self):
+        return (self.size + PAGE_MASK) >> PAGE_SHIFT
+
+    # Pages holding a nonzero cell.
+    def get_allocated_pages(self):
+        pages = set()
+        for start, end, val in self.iter_runs(0, self.size):
+            if val:
+                pages.update(range(start >> PAGE_SHIFT, ((end - 1) >> PAGE_SHIFT) + 1))
+        return sorted(pages)
+
+    def get_page(self, page):
+        start = page << PAGE_SHIFT
+        values = self.zero_page[:]
+        for run_start, run_end, val in self.iter_runs(start, min(self.size, start + PAGE_SIZE)):
+            for addr in range(run_start, run_end):
+                values[addr - start] = val
+        return values
+
+    def set_page(self, page, values, copy=True):
+        start = page << PAGE_SHIFT
+        run_start = 0
+        for idx in range(1, PAGE_SIZE + 1):
+            if idx == PAGE_SIZE or values[idx] != values[run_start]:
+                self.set_range(start + run_start, min(self.size, start + idx), values[run_start])
+                run_start = idx
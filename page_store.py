@@ -0,0 +1,194 @@
+"""
+page_store.py
+
+Content-addressed, compressed storage for the pages of snapshots.
+
+Consecutive snapshots share almost every page of memory and shadow memory. A PageStore keeps
+each distinct page (or any other blob) once: blobs are hashed, and a blob already stored is not
+written again. New blobs are compressed and appended to '<directory>/pack', and
+'<directory>/index' lists the digest, offset, and compressed size of every blob. Snapshots refer
+to blobs by id, their position in the index, so disk use grows with the number of distinct
+pages rather than the number of snapshots (see the 'dedup' format of snapshot.py).
+
+Readers memory map the pack and keep the blobs they decompressed in a bounded cache, so
+restoring many snapshots that share pages decompresses each page once.
+
+* COMPRESSIONS - Names of the compressors: zlib, lzma, and none.
+* class PageStore - Stores and fetches blobs by content.
+* open_page_store - Returns a shared read-only PageStore for a directory.
+* close_page_store - Closes the shared read-only PageStore of a directory.
+"""
+
+import os
+import zlib
+import lzma
+import mmap
+import json
+import struct
+import hashlib
+
+COMPRESSIONS = {
+    "zlib": (lambda data: zlib.compress(data, 6), zlib.decompress),
+    "lzma": (lzma.compress, lzma.decompress),
+    "none": (bytes, bytes),
+}
+DEFAULT_COMPRESSION = "zlib"
+
+PACK_FILE = "pack"
+INDEX_FILE = "index"
+METADATA_FILE = "metadata.json"
+
+DIGEST_SIZE = 16
+# Digest, offset in the pack, compressed size.
+INDEX_RECORD = struct.Struct("<{}sQI".format(DIGEST_SIZE))
+
+# Decompressed blobs a reader keeps.
+CACHE_SIZE = 4096
+
+# Read-only stores opened by open_page_store, with the files they were opened from.
+_stores = {}
+
+
+def get_digest(data):
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
+
+
+class PageStore():
+    """
+    Blobs of '<directory>', by content. Opened writable, blobs can be added with put.
+    A writable store must be flushed before readers can see what it added.
+    """
+    def __init__(self, directory, compression=DEFAULT_COMPRESSION, writable=False):
+        self.directory = directory
+        self.writable = writable
+        metadata_path = "{}/{}".format(directory, METADATA_FILE)
+        if writable and not os.path.isfile(metadata_path):
+            if compression not in COMPRESSIONS:
+                raise Exception("Unknown page compression '{}'".format(compression))
+            # A reader of a store that was deleted must not outlive it.
+            close_page_store(directory)
+            os.makedirs(directory, exist_ok=True)
+            with open(metadata_path, 'w') as file:
+                json.dump({"compression": compression, "digest": "blake2b-{}".format(
+                    DIGEST_SIZE)}, file)
+            open("{}/{}".format(directory, PACK_FILE), 'wb').close()
+            open("{}/{}".format(directory, INDEX_FILE), 'wb').close()
+        with open(metadata_path) as file:
+            self.compression = json.load(file)["compression"]
+        self._compress, self._decompress = COMPRESSIONS[self.compression]
+
+        # Offset and compressed size of every blob, by id, and the id of every digest.
+        self._locations = []
+        self._ids = {}
+        with open("{}/{}".format(directory, INDEX_FILE), 'rb') as file:
+            index = file.read()
+        # A record cut short by a crash is ignored.
+        for digest, offset, size in INDEX_RECORD.iter_unpack(
+                index[:len(index) - len(index) % INDEX_RECORD.size]):
+            self._ids[digest] = len(self._locations)
+            self._locations.append((offset, size))
+
+        self._cache = {}
+        self._map = None
+        if writable:
+            self._pack = open("{}/{}".format(directory, PACK_FILE), 'ab')
+            self._index = open("{}/{}".format(directory, INDEX_FILE), 'ab')
+            self._pack_size = self._pack.tell()
+
+    def __len__(self):
+        return len(self._locations)
+
+    def put(self, data):
+        """
+        Returns the id of 'data', storing it if no equal blob is stored yet.
+        """
+        digest = get_digest(data)
+        blob = self._ids.get(digest)
+        if blob is not None:
+            return blob
+        compressed = self._compress(data)
+        self._pack.write(compressed)
+        self._index.write(INDEX_RECORD.pack(digest, self._pack_size, len(compressed)))
+        blob = len(self._locations)
+        self._ids[digest] = blob
+        self._locations.append((self._pack_size, len(compressed)))
+        self._pack_size += len(compressed)
+        return blob
+
+    def get(self, blob):
+        """
+        Returns the blob with id 'blob' as bytes.
+        """
+        data = self._cache.get(blob)
+        if data is not None:
+            return data
+        offset, size = self._locations[blob]
+        if self.writable:
+            # Blobs added since opening are not in a map, so read them from the file.
+            self.flush()
+            with open("{}/{}".format(self.directory, PACK_FILE), 'rb') as file:
+                file.seek(offset)
+                data = self._decompress(file.read(size))
+        else:
+            if self._map is None:
+                with open("{}/{}".format(self.directory, PACK_FILE), 'rb') as file:
+                    self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            data = self._decompress(self._map[offset:offset + size])
+        if len(self._cache) >= CACHE_SIZE:
+            self._cache.clear()
+        self._cache[blob] = data
+        return data
+
+    def flush(self):
+        if self.writable:
+            self._pack.flush()
+            self._index.flush()
+
+    def close(self):
+        # Safe to call more than once.
+        if self.writable and not self._pack.closed:
+            self._pack.close()
+            self._index.close()
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._cache = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# Identity of the index and pack files. A jar rewritten in place gets new files, which may have
+# the same size as the old ones, so the inode and modification time are part of it.
+def get_file_identity(directory):
+    identity = []
+    for filename in (INDEX_FILE, PACK_FILE):
+        stat = os.stat("{}/{}".format(directory, filename))
+        identity.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+    return tuple(identity)
+
+
+# Close the shared read-only store of 'directory', if there is one.
+def close_page_store(directory):
+    store, _ = _stores.pop(os.path.abspath(directory), (None, None))
+    if store is not None:
+        store.close()
+
+
+def open_page_store(directory):
+    """
+    Returns a read-only PageStore of 'directory', shared by every caller in this process.
+    It is reopened when the store has grown or been rewritten since it was opened.
+    """
+    directory = os.path.abspath(directory)
+    identity = get_file_identity(directory)
+    store, opened = _stores.get(directory, (None, None))
+    if store is None or opened != identity:
+        if store is not None:
+            store.close()
+        store = PageStore(directory)
+        _stores[directory] = (store, identity)
+    return store
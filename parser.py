@@ -4,10 +4,81 @@ parser.py
 Parses RISC binary. Tokenizes instruction-bearing lines.
 Stores file lines in '_data'.
 Stores tokenized instructions in '_instructions'.
+Pseudoinstructions emitted by newer llc versions are expanded into the base instructions
+the interpreter executes (see PSEUDO_INSTRUCTIONS).
+Builds a LabelIndex over the labels, for the block and the function enclosing every line.
 """
 
+import bisect
 from instruction import RiscvInstr
 
+# Bump whenever the parser or RiscvInstr produce different output for the same file.
+# Cached programs parsed by another version are ignored (see program_cache.py).
+PARSER_VERSION = 2
+
+# Pseudoinstructions rewritten on parse. Maps the opcode to a function of its operand tokens
+# returning the tokens of the equivalent base instruction.
+PSEUDO_INSTRUCTIONS = {
+    # li    rd, imm  ->  addi    rd, zero, imm
+    "li": lambda ops: ["addi", ops[0], "zero"] + ops[1:],
+    # beqz    rs, label  ->  beq    rs, zero, label
+    "beqz": lambda ops: ["beq", ops[0], "zero"] + ops[1:],
+    # bltz    rs, label  ->  blt    rs, zero, label
+    "bltz": lambda ops: ["blt", ops[0], "zero"] + ops[1:],
+    # bgez    rs, label  ->  bge    rs, zero, label
+    "bgez": lambda ops: ["bge", ops[0], "zero"] + ops[1:],
+    # bgtz    rs, label  ->  blt    zero, rs, label
+    "bgtz": lambda ops: ["blt", "zero"] + ops,
+    # blez    rs, label  ->  bge    zero, rs, label
+    "blez": lambda ops: ["bge", "zero"] + ops,
+}
+
+# Function labels are the ones that do not start with '.', like 'main' but not '.LBB0_2'.
+def is_function_label(label):
+    return not label.startswith('.')
+
+
+class LabelIndex():
+    """
+    Labels of a program sorted by pc, with the block and the function enclosing every line
+    precomputed, so lookups for lines of the program are a list index.
+    Lines before the first function label belong to no function.
+    """
+    def __init__(self, labels, num_instructions):
+        # Labels in file order within a pc, so the last label at a pc starts the block there.
+        order = {label: idx for idx, label in enumerate(labels)}
+        ordered = sorted(labels, key=lambda label: (labels[label], order[label]))
+        self.pcs = [labels[label] for label in ordered]
+        self.names = ordered
+
+        self.blocks = []
+        self.functions = []
+        block = None
+        function = None
+        idx = 0
+        for pc in range(num_instructions):
+            while idx < len(self.pcs) and self.pcs[idx] <= pc:
+                block = self.names[idx]
+                if is_function_label(block):
+                    function = block
+                idx += 1
+            self.blocks.append(block)
+            self.functions.append(function)
+
+    # Label of the block containing 'pc', which may be past the last line.
+    def get_block(self, pc):
+        if 0 <= pc < len(self.blocks):
+            return self.blocks[pc]
+        idx = bisect.bisect_right(self.pcs, pc) - 1
+        return self.names[idx] if idx >= 0 and pc >= 0 else None
+
+    # Name of the function containing 'pc', or None outside every function.
+    def get_function(self, pc):
+        if 0 <= pc < len(self.functions):
+            return self.functions[pc]
+        return None
+
+
 class RiscvParser():
     """
     Defines a parser for raw RISC-V binary files.
@@ -25,17 +96,15 @@ class RiscvParser():
             instruction_lines = []
             for line in self.data:
                 # Need to keep \t in the middle of the line.
-                line = line.strip()
-                # Skip blank lines.
+                # Strip trailing comments like: sw ra, 12(sp)    # 4-byte Folded Spill
+                line = line.split('#')[0].strip()
+                # Skip blank lines and lines that are just comments like: # -- End function.
                 if not line:
                     continue
                 # Skip lines like: .file	"program.c" or .cfi_endproc.
                 # But not labels like: .Lfunc_end0:
                 if line[0] == '.'and ':' not in line:
                     continue
-                # Skip lines that are just comments like: # -- End function.
-                if line[0] == "#":
-                    continue
                 # Found a block label.
                 if ':' in line:
                     # Strip off the extra comments from labels
@@ -52,6 +121,11 @@ class RiscvParser():
 
     def _line_to_instruction(self, line):
         tokens = [token.strip(',') for token in line.split()]
+        if tokens[0] in PSEUDO_INSTRUCTIONS:
+            tokens = PSEUDO_INSTRUCTIONS[tokens[0]](tokens[1:])
+        # Calls through the PLT name the function as 'name@plt'.
+        if tokens[0] == "call":
+            tokens = [token.split('@')[0] for token in tokens]
         return RiscvInstr(tokens, self._labels)
 
     def print_content(self):
@@ -64,3 +138,6 @@ class RiscvParser():
 
     def get_labels(self):
         return self._labels
+
+    def get_label_index(self):
+        return LabelIndex(self._labels, len(self._instructions))
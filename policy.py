@@ -6,10 +6,19 @@ names as strings to a handler.
 
 A handler is a function of 3 arguments, the taint tracker (defined in taint.py), the state of
 the interpreter (defined in state.py), and the operands object (defined in instruction.py)
+
+'implicit_policy' also propagates implicit flows: every write a tainted branch decides whether
+to run is tainted with the branch's condition. Select it with --policy=policy:implicit_policy.
+
+'hooks' lists extra handlers scoped to pc ranges or functions. They are compiled into a
+per-line handler table when the program is loaded, so they cost nothing at other lines.
 """
 
 from instruction import SUPPORTED_FUNCTIONS
-from functools import partial
+from state import ABI_TO_REGISTER_IDX
+from policy_compiler import pc_hook, control_flow_handler
+
+PC = ABI_TO_REGISTER_IDX['pc']
 
 ## TAINT POLICY HANDLERS ##
 # A taint handler is function of arguments (tracker, state, operands).
@@ -43,22 +52,25 @@ def taint_subi(tracker, state, operands):
 
 # beq    op0, op1, op2
 # jump to op2 if op0 == op1
-def taint_beq(tracker, state, operands):
-    # TODO - Jump tainting
-    return
+# Same for bne, blt, bge, and bnez (op0, op1). A tainted condition opens a control scope,
+# so every write up to the branch's post-dominator is tainted with it.
+@control_flow_handler
+def taint_branch(tracker, state, operands):
+    taint = 0
+    for operand in operands[:-1]:
+        taint = tracker.OR(taint, tracker.get_operand_taint(operand))
+    if taint != 0:
+        tracker.push_control_scope(state.registers[PC], taint)
 
 
-# bne    op0, op1, op2
-# jump to op2 if op0 != op1
-def taint_bne(tracker, state, operands):
-    # TODO - Jump tainting
-    return
+taint_beq = taint_branch
+taint_bne = taint_branch
 
 
 # j    op0
 # jump to op0
+# An unconditional jump decides nothing, so it carries no implicit flow.
 def taint_j(tracker, state, operands):
-    # TODO - Jump tainting
     return
 
 
@@ -89,7 +101,7 @@ def taint_ret(tracker, state, operands):
 def taint_call(tracker, state, operands):
     function_name = operands[0].get_target_name()
     if function_name in SUPPORTED_FUNCTIONS:
-        tracker.taint_source = SUPPORTED_FUNCTIONS[function_name]
+        tracker.taint_source = tracker.get_source_taint(function_name)
     return
 
 
@@ -117,33 +129,38 @@ def taint_lw(tracker, state, operands):
     tracker.replace_operand_taint(operands[0], mem_taint)
     return
 
-def pc_wrapper(handler, tracker, state, operands):
-    pc = state.get_register('pc')
-    # Example of a custom wrapper, where the user wants to see taint at certain lines.
-    if  pc > 14 and pc < 18:
+## HOOKS ##
+# A hook is a handler of the same arguments, run before the policy handler,
+# but only at the lines it is scoped to (see policy_compiler.py).
+
+# Example of a custom hook, where the user wants to see taint at certain lines.
+# Prints only when the interpreter runs with --trace=taint.
+def print_taint_hook(tracker, state, operands):
+    if tracker.tracer is not None and tracker.tracer.print_taint:
         tracker.print_registers_taint()
-    handler(tracker, state,operands)
+
 
 # A policy is a mapping of instruction string labels to their handlers.
 policy = {
-    "addi": partial(pc_wrapper, handler=taint_arith),
-    "add": partial(pc_wrapper, handler=taint_arith),
-    "sub": partial(pc_wrapper, handler=taint_arith),
-    "subi": partial(pc_wrapper, handler=taint_arith),
-    "and": partial(pc_wrapper, handler=taint_arith),
-    "andi": partial(pc_wrapper, handler=taint_arith),
-    "xor": partial(pc_wrapper, handler=taint_arith),
-    "xori": partial(pc_wrapper, handler=taint_arith),
-    "srl": partial(pc_wrapper, handler=taint_arith),
-    "srli": partial(pc_wrapper, handler=taint_arith),
-    "sll": partial(pc_wrapper, handler=taint_arith),
-    "slli": partial(pc_wrapper, handler=taint_arith),
+    "addi": taint_arith,
+    "add": taint_arith,
+    "sub": taint_arith,
+    "subi": taint_arith,
+    "and": taint_arith,
+    "andi": taint_arith,
+    "xor": taint_arith,
+    "xori": taint_arith,
+    "srl": taint_arith,
+    "srli": taint_arith,
+    "sll": taint_arith,
+    "slli": taint_arith,
     "sw": taint_sw,
     "call": taint_call,
     "mv": taint_mv,
     "ret": taint_ret,
     "lw": taint_lw,
     "blt": thunk,
+    "bge": thunk,
     "bne": thunk,
     "bnez": thunk,
     "beq": thunk,
@@ -151,3 +168,23 @@ policy = {
     "jalr": thunk,
     "lui": taint_lui
 }
+
+# The default policy, plus implicit flows through conditional branches.
+implicit_policy = dict(policy)
+implicit_policy.update({
+    "beq": taint_beq,
+    "bne": taint_bne,
+    "blt": taint_branch,
+    "bge": taint_branch,
+    "bnez": taint_branch,
+})
+
+ARITH_OPCODES = [
+    "addi", "add", "sub", "subi", "and", "andi",
+    "xor", "xori", "srl", "srli", "sll", "slli",
+]
+
+# Hooks run before the policy handler at the lines they match.
+hooks = [
+    pc_hook(15, 18, print_taint_hook, opcodes=ARITH_OPCODES),
+]
@@ -0,0 +1,124 @@
+"""
+policy_compiler.py
+
+Compiles a taint policy and its hooks into a flat table of one handler per line.
+
+A policy maps opcodes to handlers (see policy.py). A hook is an extra handler that runs before
+the policy handler, but only at the lines it is scoped to: a range of pcs, or every line of a
+function, optionally narrowed to some opcodes. Hooks are resolved once, when the program is
+loaded, so lines outside every hook run the bare policy handler and pay nothing for hooks.
+
+A policy module defines 'policy', and may define 'hooks', a list of Hook objects.
+
+* class Hook - A handler scoped to a pc range or a function, and optionally to some opcodes.
+* pc_hook - Builds a Hook over the pcs in [start, end).
+* function_hook - Builds a Hook over every line of a function.
+* control_flow_handler - Marks a handler that needs the post-dominators of the program.
+* uses_control_flow - Whether a policy has a handler marked with control_flow_handler.
+* compile_policy - Returns the handler of every line of a program.
+* load_policy - Imports the policy and hooks of a module, by module path or file path.
+"""
+
+import os
+import sys
+import importlib
+
+DEFAULT_POLICY = "policy"
+HOOKS_ATTRIBUTE = "hooks"
+
+
+class Hook():
+    """
+    Runs 'handler(tracker, state, operands)' before the policy handler at matching lines.
+    Handlers should be module level functions so interpreters holding them can be pickled.
+    """
+    def __init__(self, handler, start=None, end=None, function=None, opcodes=None):
+        self.handler = handler
+        self.start = start
+        self.end = end
+        self.function = function
+        self.opcodes = None if opcodes is None else frozenset(opcodes)
+
+    def matches(self, pc, opcode, function):
+        if self.start is not None and pc < self.start:
+            return False
+        if self.end is not None and pc >= self.end:
+            return False
+        if self.function is not None and function != self.function:
+            return False
+        return self.opcodes is None or opcode in self.opcodes
+
+
+def pc_hook(start, end, handler, opcodes=None):
+    return Hook(handler, start=start, end=end, opcodes=opcodes)
+
+
+def function_hook(function, handler, opcodes=None):
+    return Hook(handler, function=function, opcodes=opcodes)
+
+
+# Handlers that open implicit-flow scopes (TaintTracker.push_control_scope) are marked, so the
+# interpreter computes post-dominators (see control_flow.py) only for policies that need them.
+def control_flow_handler(handler):
+    handler.control_flow = True
+    return handler
+
+
+def uses_control_flow(policy):
+    return any(getattr(handler, "control_flow", False) for handler in policy.values())
+
+
+# A handler running every hook in order, then the policy handler.
+def chain(hooks, handler):
+    def hooked(tracker, state, operands):
+        for hook in hooks:
+            hook(tracker, state, operands)
+        handler(tracker=tracker, state=state, operands=operands)
+    return hooked
+
+
+def compile_policy(policy, hooks, instructions, label_index):
+    """
+    Returns a list with the handler of each line: the policy handler of its opcode, chained
+    after the hooks that match the line. Lines whose opcode the policy lacks get None.
+    Functions are the ones 'label_index' (see parser.LabelIndex) assigns each line.
+    """
+    hooks = list(hooks or [])
+    functions = label_index.functions
+
+    handlers = []
+    for pc, instr in enumerate(instructions):
+        handler = policy.get(instr.opcode)
+        if handler is not None and hooks:
+            matched = [hook.handler for hook in hooks
+                       if hook.matches(pc, instr.opcode, functions[pc])]
+            if matched:
+                handler = chain(matched, handler)
+        handlers.append(handler)
+    return handlers
+
+
+def load_module(path):
+    # A file path like 'policies/strict.py', or a module path like 'policies.strict'
+    # relative to the working directory. Either way the module is imported by name,
+    # so interpreters holding its handlers can be pickled and restored.
+    if path.endswith(".py") or os.sep in path:
+        directory, filename = os.path.split(os.path.abspath(path))
+        path = os.path.splitext(filename)[0]
+    else:
+        directory = os.getcwd()
+    if directory not in sys.path:
+        sys.path.append(directory)
+    return importlib.import_module(path)
+
+
+def load_policy(name):
+    """
+    Returns (policy, hooks) for 'module', 'module:attribute', 'file.py', or 'file.py:attribute'.
+    The attribute names the policy mapping and defaults to 'policy'.
+    Hooks are read from the module's 'hooks' list, if it has one.
+    """
+    path, _, attribute = name.partition(":")
+    module = load_module(path)
+    policy = getattr(module, attribute or DEFAULT_POLICY)
+    return policy, list(getattr(module, HOOKS_ATTRIBUTE, []))
@@ -0,0 +1,122 @@
+"""
+profiler.py
+
+Opt-in per-opcode profiling of the interpreter.
+
+For every opcode the profiler counts the lines run and accumulates the time spent in three
+phases: executing the instruction, propagating taint through the policy handler, and heavy
+hitter bookkeeping. Snapshotting is timed separately, once per step. Steps are also counted
+and timed per enclosing function, as the parser's LabelIndex assigns them.
+
+Profiling is off unless a profiler is given to the interpreter. When it is off the only cost
+is one 'is None' check per step.
+
+* class OpcodeProfiler - Accumulates per-opcode counts and phase times, and dumps them as JSON.
+"""
+
+import json
+from time import perf_counter
+
+PHASES = ("execute", "taint", "bookkeeping")
+
+# The block engine runs a whole basic block as one call, so its phases cannot be split.
+# Its time is recorded under this name as execute time.
+BLOCK_OPCODE = "<block>"
+
+
+class OpcodeProfiler():
+    """
+    Per-opcode call counts and cumulative phase times, in seconds.
+    """
+    def __init__(self):
+        # Mapping of opcode to [count, execute time, taint time, bookkeeping time].
+        self.opcodes = {}
+        # Mapping of function name to [step count, total time].
+        self.functions = {}
+        self.snapshot_count = 0
+        self.snapshot_time = 0
+
+    def _get(self, opcode):
+        stats = self.opcodes.get(opcode)
+        if stats is None:
+            stats = self.opcodes[opcode] = [0, 0, 0, 0]
+        return stats
+
+    def add(self, opcode, execute=0, taint=0, bookkeeping=0, count=1):
+        stats = self._get(opcode)
+        stats[0] += count
+        stats[1] += execute
+        stats[2] += taint
+        stats[3] += bookkeeping
+
+    def add_function(self, function, elapsed):
+        stats = self.functions.get(function)
+        if stats is None:
+            stats = self.functions[function] = [0, 0]
+        stats[0] += 1
+        stats[1] += elapsed
+
+    def add_snapshot(self, elapsed):
+        self.snapshot_count += 1
+        self.snapshot_time += elapsed
+
+    # Same as DecodedInstr.step and DecodedInstr.step_idle, timing each phase.
+    def step_decoded(self, decoded, state, tracker, propagate):
+        start = perf_counter()
+        if propagate:
+            decoded.propagate(tracker=tracker, state=state, operands=decoded.operands)
+            taint = perf_counter()
+            tracker.record_propagation(decoded.pc, decoded.dest_taint(tracker, state))
+        else:
+            taint = perf_counter()
+            tracker.record_propagation(decoded.pc, 0)
+        bookkeeping = perf_counter()
+        result = decoded.execute(state)
+        end = perf_counter()
+        self.add(decoded.opcode, end - bookkeeping, taint - start, bookkeeping - taint)
+        return result
+
+    # Same as RiscvInstr.execute. TaintTracker.taint_by_operand reports the taint and
+    # bookkeeping phases itself, so only the remainder is counted as execute time.
+    def step_classic(self, instr, state, tracker, propagate):
+        stats = self._get(instr.opcode)
+        before = stats[2] + stats[3]
+        start = perf_counter()
+        result = instr.execute(state, tracker, propagate)
+        elapsed = perf_counter() - start
+        self.add(instr.opcode, elapsed - (stats[2] + stats[3] - before))
+        return result
+
+    def to_dict(self):
+        opcodes = {}
+        for opcode, (count, execute, taint, bookkeeping) in sorted(self.opcodes.items()):
+            opcodes[opcode] = {
+                "count": count,
+                "execute_time": execute,
+                "taint_time": taint,
+                "bookkeeping_time": bookkeeping,
+                "total_time": execute + taint + bookkeeping,
+            }
+        functions = {}
+        for function, (count, total) in self.functions.items():
+            functions[str(function)] = {"count": count, "total_time": total}
+        return {
+            "opcodes": opcodes,
+            "functions": functions,
+            "snapshot": {"count": self.snapshot_count, "time": self.snapshot_time},
+        }
+
+    def dump(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+    def print_stats(self):
+        print("\nPROFILE:")
+        print("{:<10}{:>10}{:>14}{:>14}{:>14}".format(
+            "opcode", "count", "execute (s)", "taint (s)", "bookkeep (s)"))
+        for opcode, stats in sorted(self.opcodes.items(), key=lambda item: -sum(item[1][1:])):
+            print("{:<10}{:>10}{:>14.6f}{:>14.6f}{:>14.6f}".format(opcode, *stats))
+        print("{:<20}{:>10}{:>14}".format("function", "steps", "total (s)"))
+        for function, stats in sorted(self.functions.items(), key=lambda item: -item[1][1]):
+            print("{:<20}{:>10}{:>14.6f}".format(str(function), *stats))
+        print("snapshots: {} in {:.6f}s".format(self.snapshot_count, self.snapshot_time))
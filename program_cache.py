@@ -0,0 +1,104 @@
+"""
+program_cache.py
+
+On-disk cache of parsed programs, so repeat runs of the same assembly skip the parser.
+
+An entry holds the parsed instruction list and the label table of one RISC-V file. Entries are
+keyed by the SHA-256 of the file's contents and PARSER_VERSION, and stored in PROGRAM_CACHE,
+next to the pickle cabinet. An entry whose recorded hash or parser version does not match, or
+that cannot be read, is stale: it is ignored and replaced by a fresh parse.
+
+Decoded handlers are closures and are rebuilt from the cached instructions on load. Decoding
+only reads the operand types resolved by the parser, so it does not tokenize anything again.
+
+Snapshots in the binary format (see snapshot_format.py) name their program by its hash and are
+restored with load_program_by_hash.
+
+* hash_file - Returns the SHA-256 of a file, the key of its cache entry.
+* load_program - Returns (instructions, labels) for a file, from the cache when possible.
+* load_program_by_hash - Returns (instructions, labels) for a hash, from the cache or the file.
+"""
+
+import os
+import pickle
+import hashlib
+import tempfile
+from parser import RiscvParser, PARSER_VERSION
+
+PROGRAM_CACHE = "program_cache"
+
+
+def hash_file(riscv_file):
+    digest = hashlib.sha256()
+    with open(riscv_file, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_entry_path(cache_dir, digest):
+    return "{}/{}-v{}.pickle".format(cache_dir, digest, PARSER_VERSION)
+
+
+def read_entry(path, digest):
+    # None when there is no usable entry.
+    try:
+        with open(path, 'rb') as file:
+            entry = pickle.load(file)
+    except Exception:
+        return None
+    if (not isinstance(entry, dict) or entry.get("hash") != digest
+            or entry.get("parser_version") != PARSER_VERSION):
+        return None
+    return entry
+
+
+def write_entry(path, entry):
+    # Write to a temporary file and rename it, so concurrent runs never read half an entry.
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            pickle.dump(entry, file)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def load_program(riscv_file, cache_dir=PROGRAM_CACHE, digest=None):
+    """
+    Returns (instructions, labels) of 'riscv_file', parsing it only on a cache miss.
+    'digest' is the file's hash, when the caller already has it.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    digest = digest or hash_file(riscv_file)
+    path = get_entry_path(cache_dir, digest)
+
+    entry = read_entry(path, digest)
+    if entry is None:
+        parser = RiscvParser(riscv_file)
+        entry = {
+            "hash": digest,
+            "parser_version": PARSER_VERSION,
+            "instructions": parser.get_instructions(),
+            "labels": parser.get_labels(),
+        }
+        write_entry(path, entry)
+    return entry["instructions"], entry["labels"]
+
+
+def load_program_by_hash(digest, cache_dir=PROGRAM_CACHE, riscv_file=None):
+    """
+    Returns (instructions, labels) of the program whose file hashes to 'digest'. Read from the
+    cache, or parsed from 'riscv_file' if it still has that hash.
+    """
+    if cache_dir is not None:
+        entry = read_entry(get_entry_path(cache_dir, digest), digest)
+        if entry is not None:
+            return entry["instructions"], entry["labels"]
+    if riscv_file is not None and os.path.isfile(riscv_file) and hash_file(riscv_file) == digest:
+        parser = RiscvParser(riscv_file)
+        return parser.get_instructions(), parser.get_labels()
+    raise Exception("Program {} is neither in the program cache nor at '{}'".format(
+        digest, riscv_file))
@@ -0,0 +1,333 @@
+"""
+reachability.py
+
+Static taint reachability. Finds the lines of a program that can never see taint, so the
+interpreter can skip their taint handlers even while it runs in taint mode.
+
+A forward dataflow analysis over the parsed program, from the start of 'main' with nothing
+tainted. Taint enters at calls to SUPPORTED_FUNCTIONS sources, whose return leaves it in a0, and
+flows as the default policy handlers propagate it: through registers, and through stack slots
+addressed from sp or s0 at a known offset from the stack pointer the function was entered with.
+Any other store of possible taint, through a pointer the analysis cannot follow, taints all of
+memory for the rest of the analysis. Calls are followed into the callee, and every return of a
+function flows back to every caller.
+
+A line is clean when, at every visit, neither its sources nor its destination can hold taint:
+its handler would write clean taint over clean taint. The analysis only knows the handlers of
+policy.py. It proves nothing (every line runs its handler) when the policy has other handlers,
+implicit flows, indirect jumps, or jumps out of a function. Lines with hooks always run.
+
+* PRUNE_MODES - Off, on, and verify, which checks every pruned step against an unpruned run.
+* get_clean_lines - Returns whether each line is proven clean.
+"""
+
+import policy as default_policy
+from blocks import INLINE_TAINT_FLOWS, INLINE_TAINT_NOOPS
+from instruction import SUPPORTED_FUNCTIONS
+from state import ABI_TO_REGISTER_IDX
+from parser import is_function_label
+from policy_compiler import uses_control_flow
+from control_flow import get_successors, EXIT
+
+PRUNE_OFF = "off"
+PRUNE_ON = "on"
+PRUNE_VERIFY = "verify"
+PRUNE_MODES = (PRUNE_OFF, PRUNE_ON, PRUNE_VERIFY)
+
+SP = ABI_TO_REGISTER_IDX['sp']
+S0 = ABI_TO_REGISTER_IDX['s0']
+A0 = ABI_TO_REGISTER_IDX['a0']
+
+# Offset from the entry stack pointer of a frame register whose value is not known.
+UNKNOWN = object()
+
+
+## FRAME OFFSETS
+
+# Offset of sp and s0 from the stack pointer the function was entered with, before each line.
+def get_frame_offsets(instructions, label_index, successors):
+    offsets = [None] * len(instructions)
+    work = []
+    for label, pc in zip(label_index.names, label_index.pcs):
+        if is_function_label(label) and pc < len(instructions):
+            offsets[pc] = (0, UNKNOWN)
+            work.append(pc)
+
+    while work:
+        pc = work.pop()
+        after = frame_transfer(instructions[pc], offsets[pc])
+        for succ in successors[pc]:
+            if succ == EXIT:
+                continue
+            old = offsets[succ]
+            new = after if old is None else tuple(
+                val if val == old_val else UNKNOWN for val, old_val in zip(after, old))
+            if new != old:
+                offsets[succ] = new
+                work.append(succ)
+    return offsets
+
+
+def frame_transfer(instr, frame):
+    operands = instr.operands
+    if not operands or not operands[0].is_register():
+        return frame
+    dest = operands[0].register_idx
+    if dest != SP and dest != S0 or instr.opcode == "call":
+        return frame
+
+    val = UNKNOWN
+    if instr.opcode in ("addi", "mv") and operands[1].is_register():
+        src = operands[1].register_idx
+        base = frame[0] if src == SP else frame[1] if src == S0 else UNKNOWN
+        if base is not UNKNOWN:
+            if instr.opcode == "mv":
+                val = base
+            elif len(operands) == 3 and operands[2].is_constant():
+                val = base + operands[2].constant
+    return (val, frame[1]) if dest == SP else (frame[0], val)
+
+
+## DATAFLOW
+
+class TaintFacts():
+    """
+    What may be tainted before a line.
+    * registers - Bitmask of registers.
+    * slots - Stack slots, as (function, offset from the stack pointer it was entered with).
+    * memory - Any memory, after a store of possible taint through an unknown pointer.
+    * source - Whether a source call may be waiting to return.
+    * stack - Whether a returned function may have left taint in the stack below the caller.
+    * stale - Functions entered while 'stack' was set. Their slots may hold stale taint
+      until written, and the slots written since entry are in 'cleared'.
+    """
+    __slots__ = ("registers", "slots", "memory", "source", "stack", "stale", "cleared")
+
+    def __init__(self, registers=0, slots=frozenset(), memory=False, source=False,
+                 stack=False, stale=frozenset(), cleared=frozenset()):
+        self.registers = registers
+        self.slots = slots
+        self.memory = memory
+        self.source = source
+        self.stack = stack
+        self.stale = stale
+        self.cleared = cleared
+
+    def key(self):
+        return (self.registers, self.slots, self.memory, self.source,
+                self.stack, self.stale, self.cleared)
+
+    def copy(self, **changes):
+        facts = TaintFacts(*self.key())
+        for name, val in changes.items():
+            setattr(facts, name, val)
+        return facts
+
+    # Everything that may hold on either path. 'cleared' must hold on both.
+    def join(self, other):
+        return TaintFacts(self.registers | other.registers, self.slots | other.slots,
+                          self.memory or other.memory, self.source or other.source,
+                          self.stack or other.stack, self.stale | other.stale,
+                          self.cleared & other.cleared)
+
+
+class ReachabilityAnalysis():
+    """
+    Runs the analysis over a parsed program. 'handlers' are the compiled handlers of its lines.
+    """
+    def __init__(self, instructions, label_index, labels, policy, handlers):
+        self.instructions = instructions
+        self.label_index = label_index
+        self.labels = labels
+        self.policy = policy
+        self.handlers = handlers
+        self.facts = [None] * len(instructions)
+
+    # Why nothing can be proven for this program and policy, or None.
+    def get_unsupported(self):
+        if uses_control_flow(self.policy):
+            return "the policy tracks implicit flows"
+        for pc, instr in enumerate(self.instructions):
+            handler = self.policy.get(instr.opcode)
+            if (handler is not None and handler not in INLINE_TAINT_FLOWS
+                    and handler not in INLINE_TAINT_NOOPS
+                    and handler is not default_policy.taint_call
+                    and handler is not default_policy.taint_ret):
+                return "line {} has a handler outside policy.py".format(pc)
+            if instr.opcode == "jalr":
+                return "line {} jumps indirectly".format(pc)
+        return None
+
+    def get_frame_key(self, pc, operand):
+        base = ABI_TO_REGISTER_IDX[operand.mem_reference.get_base()]
+        frame = self.frame_offsets[pc]
+        if frame is None or (base != SP and base != S0):
+            return None
+        offset = frame[0] if base == SP else frame[1]
+        if offset is UNKNOWN:
+            return None
+        offset += int(operand.mem_reference.get_offset())
+        # Cells at or above the entry stack pointer belong to the caller.
+        if offset >= 0:
+            return None
+        return (self.label_index.functions[pc], offset)
+
+    def may_be_tainted(self, pc, facts, operand):
+        if operand.is_register():
+            return bool(facts.registers >> operand.register_idx & 1)
+        elif operand.is_memory():
+            key = self.get_frame_key(pc, operand)
+            if key is None:
+                return facts.memory or facts.stack or bool(facts.slots)
+            return facts.memory or key in facts.slots or (
+                key[0] in facts.stale and key not in facts.cleared)
+        return False
+
+    # Facts on entry to 'function' from a call. Its frame may reuse cells of returned frames.
+    def enter(self, facts, function):
+        cleared = frozenset(key for key in facts.cleared if key[0] != function)
+        stale = facts.stale | {function} if facts.stack else facts.stale
+        return facts.copy(stale=stale, cleared=cleared)
+
+    # Facts on return from 'function'. Its frame is left in the stack as it was.
+    def leave(self, facts, function):
+        stack = facts.stack or function in facts.stale or any(
+            key[0] == function for key in facts.slots)
+        return facts.copy(source=False, stack=stack)
+
+    # Facts after the line at 'pc', and whether its handler can read or write taint.
+    def transfer(self, pc, facts):
+        instr = self.instructions[pc]
+        handler = self.policy.get(instr.opcode)
+        operands = instr.operands
+
+        # Calls and returns always run their handlers, which start and finish source calls.
+        if instr.opcode == "call":
+            source = facts.source or (handler is default_policy.taint_call
+                                      and operands[0].get_target_name() in SUPPORTED_FUNCTIONS)
+            target = self.label_index.functions[self.get_call_target(instr)]
+            return self.enter(facts.copy(source=source), target), True
+        elif instr.opcode == "ret":
+            registers = facts.registers
+            if handler is default_policy.taint_ret and facts.source:
+                registers |= 1 << A0
+            facts = self.leave(facts.copy(registers=registers), self.label_index.functions[pc])
+            return facts, True
+        elif handler not in INLINE_TAINT_FLOWS:
+            return facts, False
+
+        dest_idx, source_idxs = INLINE_TAINT_FLOWS[handler]
+        dest = operands[dest_idx]
+        tainted = any(self.may_be_tainted(pc, facts, operands[idx]) for idx in source_idxs)
+        touched = tainted or self.may_be_tainted(pc, facts, dest)
+
+        if dest.is_register():
+            bit = 1 << dest.register_idx
+            registers = facts.registers | bit if tainted else facts.registers & ~bit
+            return facts.copy(registers=registers), touched
+        key = self.get_frame_key(pc, dest)
+        if key is None:
+            return facts.copy(memory=facts.memory or tainted), touched
+        elif tainted:
+            return facts.copy(slots=facts.slots | {key}, cleared=facts.cleared - {key}), touched
+        elif key[0] in self.recursive:
+            # Frames of recursive functions share keys, so their slots are never cleared.
+            return facts, touched
+        return facts.copy(slots=facts.slots - {key}, cleared=facts.cleared | {key}), touched
+
+    def get_call_target(self, instr):
+        target = instr.get_jump_target(instr.operands[0].get_target_name())
+        return target if 0 <= target < len(self.instructions) else None
+
+    def get_recursive_functions(self):
+        callees = {}
+        for pc, instr in enumerate(self.instructions):
+            if instr.opcode == "call":
+                target = self.get_call_target(instr)
+                if target is not None:
+                    callees.setdefault(self.label_index.functions[pc], set()).add(
+                        self.label_index.functions[target])
+        recursive = set()
+        for function in callees:
+            seen = set()
+            work = list(callees[function])
+            while work:
+                callee = work.pop()
+                if callee == function:
+                    recursive.add(function)
+                    break
+                if callee not in seen:
+                    seen.add(callee)
+                    work.extend(callees.get(callee, ()))
+        return recursive
+
+    def get_edges(self, successors):
+        """
+        Successors of every line, following calls into callees and returns back to every caller.
+        None when control leaves a function other than by a call or a return.
+        """
+        functions = self.label_index.functions
+        return_sites = {}
+        edges = []
+        for pc, instr in enumerate(self.instructions):
+            if instr.opcode == "call":
+                target = self.get_call_target(instr)
+                if target is None:
+                    return None
+                edges.append([target])
+                if pc + 1 < len(self.instructions):
+                    return_sites.setdefault(functions[target], []).append(pc + 1)
+            elif instr.opcode == "ret":
+                edges.append(None)
+            elif EXIT in successors[pc]:
+                return None
+            else:
+                edges.append(successors[pc])
+        for pc in range(len(self.instructions)):
+            if edges[pc] is None:
+                edges[pc] = return_sites.get(functions[pc], [])
+        return edges
+
+    def run(self):
+        """
+        Returns whether each line is clean, or None when nothing can be proven.
+        """
+        if self.get_unsupported() is not None or "main" not in self.labels:
+            return None
+        successors = get_successors(self.instructions, self.label_index)
+        edges = self.get_edges(successors)
+        if edges is None:
+            return None
+        self.frame_offsets = get_frame_offsets(self.instructions, self.label_index, successors)
+        self.recursive = self.get_recursive_functions()
+
+        start = self.labels["main"]
+        self.facts[start] = TaintFacts()
+        work = [start]
+        while work:
+            pc = work.pop()
+            after, _ = self.transfer(pc, self.facts[pc])
+            for succ in edges[pc]:
+                old = self.facts[succ]
+                new = after if old is None else old.join(after)
+                if old is None or new.key() != old.key():
+                    self.facts[succ] = new
+                    work.append(succ)
+
+        clean = []
+        for pc, facts in enumerate(self.facts):
+            hooked = self.handlers[pc] is not self.policy.get(self.instructions[pc].opcode)
+            if facts is None or hooked or self.handlers[pc] is None:
+                clean.append(False)
+            else:
+                clean.append(not self.transfer(pc, facts)[1])
+        return clean
+
+
+def get_clean_lines(instructions, label_index, labels, policy, handlers):
+    """
+    Returns a list with whether each line is proven never to read or write taint.
+    Every line is unproven when the analysis does not support the program or policy.
+    """
+    clean = ReachabilityAnalysis(instructions, label_index, labels, policy, handlers).run()
+    return [False] * len(instructions) if clean is None else clean
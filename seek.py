@@ -0,0 +1,198 @@
+"""
+seek.py
+
+Time travel over a pickle jar. Restores the interpreter as it was after any step of the run.
+
+A seek restores the last snapshot at or before the target step (or the origin, the interpreter
+before its first step) and replays the program forward to the target. Replay is deterministic,
+so a jar snapshotted every K steps (--snapshot_interval) still reaches any step in at most K
+steps of replay. Reverse stepping is a seek to an earlier step.
+
+* seek - Restores the interpreter after a given step.
+* seek_pc - Restores the interpreter at the next step that reaches a given line.
+* reverse_step - Restores the interpreter one step before a given step.
+* reverse_continue - Restores the interpreter just before the last step that changed taint.
+
+# Example Execution.
+# python seek.py --pickle_jar=pickle_cabinet/jar_get_loc --step=120
+# python seek.py --pickle_jar=pickle_cabinet/jar_get_loc --step=120 --reverse_continue
+"""
+
+import bisect
+import click
+from interpreter import *
+from snapshot import load_index, load_snapshot
+from timeline import Timeline
+
+
+# Restore the last indexed interpreter at or before 'step'.
+def restore_before(index, step):
+    steps = [entry[0] for entry in index]
+    idx = bisect.bisect_right(steps, step) - 1
+    if idx < 0:
+        raise Exception("No snapshot at or before step {}".format(step))
+    return load_snapshot(index[idx][1])
+
+
+# Run 'interpreter' forward until it has run 'step' steps.
+def replay(interpreter, step):
+    while interpreter.step_count < step:
+        if not interpreter.step():
+            if interpreter.step_count < step:
+                raise Exception("The program ends at step {}, before step {}".format(
+                    interpreter.step_count, step))
+    return interpreter
+
+
+def seek(pickle_jar, step, index=None):
+    """
+    Returns the interpreter as it was after 'step' steps. Step 0 is the start of the program.
+    """
+    if step < 0:
+        raise Exception("Step {} is before the start of the program".format(step))
+    index = load_index(pickle_jar) if index is None else index
+    return replay(restore_before(index, step), step)
+
+
+# Run 'interpreter' one line at a time up to 'pc', inside the block its next step runs.
+# The step count stays at the last whole step, as the block's step has not finished.
+def run_into_block(interpreter, pc):
+    blocks, step_count = interpreter._blocks, interpreter.step_count
+    # Without its blocks the interpreter runs the decoded lines one at a time.
+    interpreter._blocks = None
+    try:
+        while interpreter.state.registers[PC] != pc:
+            interpreter.step()
+    finally:
+        interpreter._blocks = blocks
+        interpreter.step_count = step_count
+    return interpreter
+
+
+def seek_pc(pickle_jar, pc, start=0):
+    """
+    Returns the interpreter at the first step after 'start' where 'pc' is the next line to run.
+    The pc of every step is read from the jar's timeline when there is one, otherwise found by replay.
+    In a jar of the block engine, where a step runs a whole block, a line inside a block is reached
+    by running that block one line at a time from the step that starts it.
+    """
+    index = load_index(pickle_jar)
+    interpreter = seek(pickle_jar, start, index)
+    blocks = interpreter._blocks
+
+    # Whether 'pc' runs inside the block of the step that starts at 'step_pc'.
+    def inside(step_pc):
+        return blocks is not None and 0 <= step_pc < pc <= blocks.get_block_end(step_pc)
+
+    def reaches(step_pc):
+        return step_pc == pc or inside(step_pc)
+
+    # The step right after 'start' may run 'pc' inside its block.
+    if inside(interpreter.state.registers[PC]):
+        return run_into_block(interpreter, pc)
+
+    if Timeline.exists(pickle_jar):
+        timeline = Timeline(pickle_jar)
+        try:
+            pcs = timeline.get_column("pc")
+            # Row i holds the pc after step i + 1.
+            for row in range(start, len(pcs)):
+                if reaches(pcs[row]):
+                    return run_into_block(seek(pickle_jar, row + 1, index), pc)
+        finally:
+            timeline.close()
+        raise Exception("Line {} is not reached after step {}".format(pc, start))
+
+    while interpreter.step():
+        if reaches(interpreter.state.registers[PC]):
+            return run_into_block(interpreter, pc)
+    raise Exception("Line {} is not reached after step {}".format(pc, start))
+
+
+def reverse_step(pickle_jar, step):
+    return seek(pickle_jar, step - 1)
+
+
+# Steps in (start, end] that changed a shadow register or shadow memory cell.
+def find_taint_changes(interpreter, end):
+    tracker = interpreter.tracker
+    registers = tracker.shadow_registers[:]
+    pages = {page: tracker.shadow_memory.get_page(page)
+             for page in tracker.shadow_memory.get_allocated_pages()}
+    zero_page = tracker.shadow_memory.zero_page
+
+    changes = []
+    tracker.dirty_pages.clear()
+    while interpreter.step_count < end:
+        running = interpreter.step()
+        changed = tracker.shadow_registers != registers
+        if changed:
+            registers = tracker.shadow_registers[:]
+        for page in tracker.dirty_pages:
+            values = tracker.shadow_memory.get_page(page)
+            if values != pages.get(page, zero_page):
+                pages[page] = values
+                changed = True
+        tracker.dirty_pages.clear()
+        if changed:
+            changes.append(interpreter.step_count)
+        if not running:
+            break
+    return changes
+
+
+def reverse_continue(pickle_jar, step):
+    """
+    Returns the interpreter just before the last step at or before 'step' that changed taint,
+    so that step is the next one to run. Searches back one snapshot interval at a time.
+    """
+    index = load_index(pickle_jar)
+    end = step
+    for base_step, path in reversed(index):
+        if base_step >= end:
+            continue
+        changes = find_taint_changes(load_snapshot(path), end)
+        if changes:
+            return seek(pickle_jar, changes[-1] - 1, index)
+        end = base_step
+    raise Exception("Taint does not change before step {}".format(step))
+
+
+def print_position(interpreter):
+    pc = interpreter.state.get_register('pc')
+    instructions = interpreter._instructions
+    line = instructions[pc].to_string() if 0 <= pc < len(instructions) else "<end>"
+    print("STEP {}, LINE {}: {}".format(interpreter.step_count, pc, line))
+    interpreter.tracker.print_only_tainted_registers()
+
+
+@click.command()
+@click.option('--pickle_jar', required=True, help='Path to the pickle jar of a run.')
+@click.option('--step', default=0, help='Step to seek to, or to start from.')
+@click.option('--until_pc', default=None, type=int,
+              help='Seek to the next step after --step where this line runs.')
+@click.option('--reverse_step', 'reverse', flag_value='step', help='Seek one step back from --step.')
+@click.option('--reverse_continue', 'reverse', flag_value='continue',
+              help='Seek back from --step to just before the last step that changed taint.')
+@click.option('--resume/--no-resume', default=False,
+              help='Run the program to completion from the restored step.')
+def main(pickle_jar, step, until_pc, reverse, resume):
+    if until_pc is not None:
+        interpreter = seek_pc(pickle_jar, until_pc, step)
+    elif reverse == 'step':
+        interpreter = reverse_step(pickle_jar, step)
+    elif reverse == 'continue':
+        interpreter = reverse_continue(pickle_jar, step)
+    else:
+        interpreter = seek(pickle_jar, step)
+    print_position(interpreter)
+
+    if resume:
+        while(interpreter.run()):
+            pass
+        print("\nRETURN VALUE: ", interpreter.state.get_register('a0'))
+    return 0
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,592 @@
+"""
+snapshot.py
+
+Incremental snapshots of a running interpreter.
+
+A full pickle of the interpreter (a keyframe) is written only every 'keyframe_interval'
+snapshots. Snapshots in between are deltas holding the registers, shadow registers, and only
+the memory and shadow memory pages written since the previous snapshot, plus the labels and
+label sets created since then in label mode. Range-compressed shadow memory is saved as its
+runs whenever it changed.
+
+Capturing a snapshot only copies the changed state into a record. Records are encoded and
+written by a SnapshotWriter, either inline or from a background thread with a bounded queue.
+The writer keeps its own replica of the interpreter, brought up to date by each record, and
+saves the replica whenever a keyframe is due.
+
+Snapshots are pickled by default, or written in the binary format of snapshot_format.py with
+the 'binary' format, which restores long delta chains about half as fast (see README.md).
+A snapshot holding a value too large for the binary format is pickled instead. Loading tells the
+formats apart by file, so jars of either format, or both, restore the same way.
+
+The 'dedup' format writes every snapshot as a manifest instead (see snapshot_format.py). Pages
+of memory and shadow memory, heavy hitter counts, and the configuration are put in a
+content-addressed PageStore at '<pickle_jar>/pages', compressed, so a page equal to one already
+stored, in any earlier snapshot, costs nothing but its id. Only the pages a record changed are
+hashed. Every manifest restores on its own, without replaying deltas, so keyframe_interval
+does not apply.
+
+The interpreter as it was before its first step is saved to '<pickle_jar>/origin.pickle' (or
+'origin.snap' in the binary and dedup formats), and the step of every snapshot written is listed
+in '<pickle_jar>/snapshot_index.json', so any step can be found without unpickling (see seek.py).
+
+* class SnapshotStore - Captures snapshot records of an interpreter.
+* class SnapshotWriter - Encodes and writes records into a pickle jar.
+* get_keyframe_record - Returns a record of the whole state of an interpreter.
+* save_manifest - Puts the pages a record changed in a page store and writes its manifest.
+* load_snapshot - Restores the interpreter saved at any snapshot path, keyframe or delta.
+* get_snapshot_paths - Returns the path of every snapshot of a jar in execution order.
+* iter_snapshots - Restores every snapshot of a jar in execution order.
+* load_index - Returns the step and path of the origin and every snapshot of a jar.
+"""
+
+import os
+import sys
+import json
+import pickle
+import threading
+from collections import deque
+from labels import merge_label_changes
+from heavy_hitters import SketchHeavyHitters
+from memory import RangeMemory, PAGE_SIZE
+from page_store import PageStore, DEFAULT_COMPRESSION
+from snapshot_format import (
+    SnapshotFile,
+    write_snapshot,
+    read_record,
+    build_interpreter,
+    is_binary_snapshot,
+    encode_configuration,
+    MAGIC,
+    encode_manifest_objects,
+    encode_page,
+    encode_columns,
+    encode_table,
+    encode_runs,
+    PAGE_TYPECODES,
+)
+
+# A keyframe is written every KEYFRAME_INTERVAL snapshots.
+KEYFRAME_INTERVAL = 64
+DELTA_SUFFIX = ".delta"
+
+# Number of records the background writer may hold. 0 writes inline.
+SNAPSHOT_QUEUE_SIZE = 256
+
+# What capture does when the writer queue is full.
+# 'block' waits for the writer, 'drop_oldest' folds the oldest pending record into the next.
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST)
+
+# Snapshot file formats.
+SNAPSHOT_BINARY = "binary"
+SNAPSHOT_PICKLE = "pickle"
+SNAPSHOT_DEDUP = "dedup"
+SNAPSHOT_FORMATS = (SNAPSHOT_BINARY, SNAPSHOT_PICKLE, SNAPSHOT_DEDUP)
+
+ORIGIN_FILES = {SNAPSHOT_BINARY: "origin.snap", SNAPSHOT_PICKLE: "origin.pickle",
+                SNAPSHOT_DEDUP: "origin.snap"}
+PAGE_STORE_DIR = "pages"
+INDEX_FILE = "snapshot_index.json"
+
+# Record keys of the small attributes of the interpreter, its state, and its tracker.
+SCALAR_KEYS = ("interpreter_scalars", "state_scalars", "tracker_scalars")
+
+
+# Small attributes restored from a delta as they are.
+def get_scalars(obj):
+    return {
+        name: val for name, val in obj.__dict__.items()
+        if val is None or isinstance(val, (int, float, str))
+    }
+
+
+def get_pages(memory, pages):
+    return {page: memory.get_page(page) for page in pages}
+
+
+def set_pages(memory, pages, copy=True):
+    for page, values in pages.items():
+        memory.set_page(page, values, copy)
+
+
+def get_snapshot_number(filename):
+    # Filenames look like 'state-instr008-line009' or 'state-instr009-line010.delta'.
+    return int(filename.split("-instr")[1].split("-")[0])
+
+
+# Fold an unwritten record into the record that follows it.
+def merge_records(older, newer):
+    for key in ("memory_pages", "shadow_memory_pages"):
+        pages = dict(older[key])
+        pages.update(newer[key])
+        newer[key] = pages
+    if newer.get("shadow_memory_runs") is None:
+        newer["shadow_memory_runs"] = older.get("shadow_memory_runs")
+
+    # Heavy hitter changes hold absolute counts, so the newer ones win.
+    changes = dict(older["heavy_hitters"])
+    changes.update(newer["heavy_hitters"])
+    newer["heavy_hitters"] = changes
+
+    if newer["labels"] is not None:
+        newer["labels"] = merge_label_changes(older["labels"], newer["labels"])
+    return newer
+
+
+class SnapshotStore():
+    """
+    Captures snapshot records of an interpreter and hands them to a SnapshotWriter.
+    """
+    def __init__(self, pickle_jar, fileheader="state", keyframe_interval=KEYFRAME_INTERVAL,
+                 queue_size=0, overflow=OVERFLOW_BLOCK, snapshot_format=SNAPSHOT_PICKLE,
+                 page_compression=DEFAULT_COMPRESSION):
+        if snapshot_format not in SNAPSHOT_FORMATS:
+            raise Exception("Unknown snapshot format '{}'".format(snapshot_format))
+        self.pickle_jar = pickle_jar
+        self.snapshot_format = snapshot_format
+        self.fileheader = fileheader
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.queue_size = queue_size
+        self.overflow = overflow
+
+        # Where the dedup format puts pages. A store reopened later keeps its compression.
+        self.page_store = None
+        if snapshot_format == SNAPSHOT_DEDUP:
+            self.page_store = PageStore("{}/{}".format(pickle_jar, PAGE_STORE_DIR),
+                                        page_compression, writable=True)
+
+        # Started on the first capture, from a copy of the interpreter.
+        self.writer = None
+
+    def capture(self, interpreter):
+        state = interpreter.state
+        tracker = interpreter.tracker
+        pc = state.get_register('pc')
+        filename = "{}-instr{:03d}-line{:03d}".format(
+            self.fileheader, interpreter.pickle_count, pc)
+
+        # A new store always starts from a keyframe, even when resuming a restored run.
+        is_keyframe = (self.writer is None
+                       or interpreter.pickle_count % self.keyframe_interval == 0)
+        interpreter.pickle_count += 1
+
+        if self.writer is None:
+            self._start_writer(interpreter)
+
+        record = {
+            "filename": filename if is_keyframe else filename + DELTA_SUFFIX,
+            "keyframe": is_keyframe,
+            "registers": list(state.registers),
+            "shadow_registers": tracker.shadow_registers[:],
+            "memory_pages": get_pages(state.memory, state.dirty_pages),
+            "shadow_memory_pages": {},
+            "shadow_memory_runs": None,
+            "heavy_hitters": tracker.heavy_hitters.get_changes(),
+            "labels": None if tracker.labels is None else tracker.labels.get_changes(),
+            "control_stack": list(tracker.control_stack),
+            "interpreter_scalars": get_scalars(interpreter),
+            "state_scalars": get_scalars(state),
+            "tracker_scalars": get_scalars(tracker),
+        }
+        # Range-compressed shadow memory is small, so it is saved whole rather than by page.
+        if isinstance(tracker.shadow_memory, RangeMemory):
+            if tracker.dirty_pages:
+                record["shadow_memory_runs"] = tracker.shadow_memory.get_runs()
+        else:
+            record["shadow_memory_pages"] = get_pages(tracker.shadow_memory, tracker.dirty_pages)
+        state.dirty_pages.clear()
+        tracker.dirty_pages.clear()
+        tracker.heavy_hitters.clear_changes()
+        if tracker.labels is not None:
+            tracker.labels.clear_changes()
+
+        self.writer.put(record)
+        return record["filename"]
+
+    # Save the interpreter before its first step, so seeking can reach steps before any snapshot.
+    def capture_origin(self, interpreter):
+        path = "{}/{}".format(self.pickle_jar, ORIGIN_FILES[self.snapshot_format])
+        if self.page_store is not None:
+            save_manifest(path, interpreter, None, self.page_store)
+        else:
+            save_keyframe(path, interpreter, self.snapshot_format)
+
+    def _start_writer(self, interpreter):
+        interpreter.state.dirty_pages.clear()
+        interpreter.tracker.dirty_pages.clear()
+        interpreter.tracker.heavy_hitters.clear_changes()
+        if interpreter.tracker.labels is not None:
+            interpreter.tracker.labels.clear_changes()
+        replica = pickle.loads(pickle.dumps(interpreter))
+        self.writer = SnapshotWriter(self.pickle_jar, replica, self.queue_size, self.overflow,
+                                     self.snapshot_format, self.page_store)
+
+    def close(self):
+        # Write out every pending record, then the index. Safe to call more than once.
+        try:
+            if self.writer is not None:
+                self.writer.close()
+                with open("{}/{}".format(self.pickle_jar, INDEX_FILE), 'w') as file:
+                    json.dump({"snapshots": self.writer.index}, file)
+        finally:
+            if self.page_store is not None:
+                self.page_store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+            return
+        # A writer error must not replace the error already propagating, so it is only reported.
+        try:
+            self.close()
+        except Exception as error:
+            print("Snapshot writer failed: {!r}".format(error), file=sys.stderr)
+
+
+class SnapshotWriter():
+    """
+    Applies snapshot records to a replica interpreter and writes them to '<pickle_jar>/pickles'.
+    With a queue_size of 0 records are written as they are put, otherwise by a background thread.
+    In the dedup format, pages go to 'page_store' and every snapshot is a manifest.
+    """
+    def __init__(self, pickle_jar, replica, queue_size=0, overflow=OVERFLOW_BLOCK,
+                 snapshot_format=SNAPSHOT_PICKLE, page_store=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise Exception("Unknown snapshot overflow policy '{}'".format(overflow))
+        self.pickle_jar = pickle_jar
+        self.snapshot_format = snapshot_format
+        self.replica = replica
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.page_store = page_store
+        if snapshot_format == SNAPSHOT_DEDUP and page_store is None:
+            raise Exception("The dedup snapshot format needs a page store")
+
+        # Filename of the last snapshot written. A delta is applied on top of it.
+        self._previous = None
+        # Filename of the last binary keyframe, and the scalars of the last snapshot written.
+        self._base = None
+        self._scalars = None
+        # Blob ids of the replica's pages as of the last manifest, in the dedup format.
+        self._pages = None
+        # Number of records folded into a later one because the queue was full.
+        self.num_dropped = 0
+        # [step, filename] of every snapshot written, in order.
+        self.index = []
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._error = None
+        self._thread = None
+        if queue_size > 0:
+            self._thread = threading.Thread(target=self._drain, name="snapshot-writer", daemon=True)
+            self._thread.start()
+
+    def put(self, record):
+        if self._thread is None:
+            self.write(record)
+            return
+
+        with self._cond:
+            self._raise_error()
+            while len(self._queue) >= self.queue_size:
+                if self.overflow == OVERFLOW_DROP_OLDEST:
+                    oldest = self._queue.popleft()
+                    following = self._queue[0] if self._queue else record
+                    merge_records(oldest, following)
+                    self.num_dropped += 1
+                else:
+                    self._cond.wait()
+                    self._raise_error()
+            self._queue.append(record)
+            self._cond.notify_all()
+
+    def close(self):
+        if self._thread is not None:
+            with self._cond:
+                self._closed = True
+                self._cond.notify_all()
+            self._thread.join()
+            self._thread = None
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _drain(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                record = self._queue.popleft()
+                self._cond.notify_all()
+            try:
+                self.write(record)
+            except Exception as error:
+                with self._cond:
+                    self._error = error
+                    self._queue.clear()
+                    self._cond.notify_all()
+                return
+
+    def write(self, record):
+        apply_delta(self.replica, record)
+        filename = record["filename"]
+
+        # The first snapshot written is always a keyframe, even if the one planned was dropped.
+        # Manifests stand alone, like keyframes.
+        is_keyframe = record["keyframe"] or self._previous is None or self.page_store is not None
+        if is_keyframe and filename.endswith(DELTA_SUFFIX):
+            filename = filename[:-len(DELTA_SUFFIX)]
+        path = "{}/pickles/{}".format(self.pickle_jar, filename)
+
+        if self.page_store is not None:
+            self._pages = save_manifest(path, self.replica, record, self.page_store, self._pages)
+        elif is_keyframe:
+            save_keyframe(path, self.replica, self.snapshot_format)
+            # Binary deltas read the run's metadata from their keyframe, when it has any.
+            self._base = filename if is_binary_snapshot(path) else None
+        else:
+            delta = dict(record, previous=self._previous, base=self._base)
+            del delta["filename"]
+            del delta["keyframe"]
+            # Scalars that did not change since the previous snapshot are left out.
+            for key in SCALAR_KEYS:
+                written = self._scalars[key]
+                delta[key] = {name: val for name, val in record[key].items()
+                              if name not in written or written[name] != val}
+            save_delta(path, self.replica, delta, self.snapshot_format)
+        self._previous = filename
+        self._scalars = {key: record[key] for key in SCALAR_KEYS}
+        self.index.append([self.replica.step_count, filename])
+
+
+# A record of the whole state of 'interpreter', as a delta from an empty interpreter.
+def get_keyframe_record(interpreter):
+    state = interpreter.state
+    tracker = interpreter.tracker
+    heavy_hitters = tracker.heavy_hitters
+    if isinstance(heavy_hitters, SketchHeavyHitters):
+        counts = {cell: (heavy_hitters.executions[cell], heavy_hitters.propagations[cell])
+                  for cell in range(len(heavy_hitters.executions))}
+    else:
+        counts = {pc: (heavy_hitters.get_executions(pc), heavy_hitters.get_propagations(pc))
+                  for pc in heavy_hitters.executions}
+    record = {
+        "registers": list(state.registers),
+        "shadow_registers": tracker.shadow_registers[:],
+        "memory_pages": get_pages(state.memory, state.memory.get_allocated_pages()),
+        "shadow_memory_pages": {},
+        "shadow_memory_runs": None,
+        "heavy_hitters": counts,
+        # The label table is saved whole with the tracker.
+        "labels": None,
+        "control_stack": list(tracker.control_stack),
+        "interpreter_scalars": get_scalars(interpreter),
+        "state_scalars": get_scalars(state),
+        "tracker_scalars": get_scalars(tracker),
+    }
+    if isinstance(tracker.shadow_memory, RangeMemory):
+        record["shadow_memory_runs"] = tracker.shadow_memory.get_runs()
+    else:
+        record["shadow_memory_pages"] = get_pages(
+            tracker.shadow_memory, tracker.shadow_memory.get_allocated_pages())
+    return record
+
+
+# Executions, then propagations, of the PAGE_SIZE heavy hitter keys of 'chunk'.
+def get_heavy_hitter_chunk(heavy_hitters, chunk):
+    start, stop = chunk * PAGE_SIZE, (chunk + 1) * PAGE_SIZE
+    if isinstance(heavy_hitters, SketchHeavyHitters):
+        return heavy_hitters.executions[start:stop], heavy_hitters.propagations[start:stop]
+    executions, propagations = heavy_hitters.executions, heavy_hitters.propagations
+    return ([executions.get(pc, 0) for pc in range(start, stop)],
+            [propagations.get(pc, 0) for pc in range(start, stop)])
+
+
+# Put what 'record' changed in 'store', update the blob ids of the pages of 'interpreter' in
+# 'pages', and return the blob ids of a manifest.
+def put_blobs(store, interpreter, record, pages):
+    for key, typecode in PAGE_TYPECODES.items():
+        for page, cells in record[key + "_pages"].items():
+            pages[key][page] = store.put(encode_page(cells, typecode))
+    if record.get("shadow_memory_runs") is not None:
+        pages["shadow_memory_runs"] = store.put(encode_runs(record["shadow_memory_runs"]))
+    heavy_hitters = interpreter.tracker.heavy_hitters
+    for chunk in {key // PAGE_SIZE for key in record["heavy_hitters"]}:
+        pages["heavy_hitters"][chunk] = store.put(encode_columns(
+            *get_heavy_hitter_chunk(heavy_hitters, chunk)))
+
+    blobs = {key: store.put(encode_table(pages[key]))
+             for key in ("memory", "shadow_memory", "heavy_hitters")}
+    blobs["shadow_memory_runs"] = pages["shadow_memory_runs"]
+    blobs["configuration"] = store.put(encode_configuration(interpreter, record))
+    # The label table is saved whole with the configuration.
+    blobs["objects"] = store.put(encode_manifest_objects(record))
+    return blobs
+
+
+def save_manifest(path, interpreter, record, store, pages=None):
+    """
+    Puts the pages 'record' changed in 'store' and writes the manifest of 'interpreter' to
+    'path'. Without the blob ids of the 'pages' of the previous manifest every page is put, and
+    'record' is not needed. Returns the pages to pass with the next record, or None if a value
+    too large for the binary format pickled the interpreter instead.
+    """
+    if pages is None:
+        record = get_keyframe_record(interpreter)
+        pages = {"memory": {}, "shadow_memory": {}, "heavy_hitters": {},
+                 "shadow_memory_runs": None}
+    try:
+        blobs = put_blobs(store, interpreter, record, pages)
+        blobs["page_store"] = os.path.relpath(store.directory, os.path.dirname(path))
+        store.flush()
+        write_snapshot(path, interpreter, record, blobs=blobs)
+        return pages
+    except OverflowError:
+        with open(path, 'wb') as file:
+            pickle.dump(interpreter, file)
+        return None
+
+
+# A value too large for the binary format falls back to a pickle, for that snapshot only.
+def save_keyframe(path, interpreter, snapshot_format):
+    if snapshot_format == SNAPSHOT_BINARY:
+        try:
+            write_snapshot(path, interpreter, get_keyframe_record(interpreter))
+            return
+        except OverflowError:
+            pass
+    with open(path, 'wb') as file:
+        pickle.dump(interpreter, file)
+
+
+def save_delta(path, interpreter, delta, snapshot_format):
+    if snapshot_format == SNAPSHOT_BINARY:
+        try:
+            write_snapshot(path, interpreter, delta, delta["previous"], base=delta["base"])
+            return
+        except OverflowError:
+            pass
+    with open(path, 'wb') as file:
+        pickle.dump(delta, file)
+
+
+# With copy=False the interpreter takes the pages of 'delta', so a delta just loaded is applied
+# without copying each page again.
+def apply_delta(interpreter, delta, copy=True):
+    state = interpreter.state
+    tracker = interpreter.tracker
+
+    state.registers[:] = delta["registers"]
+    tracker.shadow_registers[:] = delta["shadow_registers"]
+    set_pages(state.memory, delta["memory_pages"], copy)
+    set_pages(tracker.shadow_memory, delta["shadow_memory_pages"], copy)
+    if delta.get("shadow_memory_runs") is not None:
+        tracker.shadow_memory.set_runs(delta["shadow_memory_runs"])
+    tracker.heavy_hitters.apply_changes(delta["heavy_hitters"])
+    if delta.get("labels") is not None:
+        tracker.labels.apply_changes(delta["labels"])
+    if "control_stack" in delta:
+        tracker.control_stack[:] = delta["control_stack"]
+
+    for obj, key in ((interpreter, "interpreter_scalars"),
+                     (state, "state_scalars"),
+                     (tracker, "tracker_scalars")):
+        for name, val in delta[key].items():
+            setattr(obj, name, val)
+
+
+# Snapshots are restored whole, so each file is read once, and told apart by its contents.
+def read_file(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def load_keyframe(path):
+    data = read_file(path)
+    if not data.startswith(MAGIC):
+        return pickle.loads(data)
+    with SnapshotFile(path, data) as snapshot:
+        objects = snapshot.get_objects()
+        interpreter = build_interpreter(snapshot, objects)
+        apply_delta(interpreter, read_record(snapshot, objects), copy=False)
+    return interpreter
+
+
+def load_delta(path):
+    data = read_file(path)
+    if not data.startswith(MAGIC):
+        return pickle.loads(data)
+    with SnapshotFile(path, data) as snapshot:
+        return read_record(snapshot)
+
+
+def load_snapshot(pickle_path):
+    # Walk back to the keyframe, then replay the deltas forward.
+    directory = os.path.dirname(pickle_path)
+    chain = []
+    while pickle_path.endswith(DELTA_SUFFIX):
+        delta = load_delta(pickle_path)
+        chain.append(delta)
+        pickle_path = os.path.join(directory, delta["previous"])
+
+    interpreter = load_keyframe(pickle_path)
+    for delta in reversed(chain):
+        apply_delta(interpreter, delta, copy=False)
+    return interpreter
+
+
+# Path of every snapshot of a jar, in execution order.
+def get_snapshot_paths(pickle_jar):
+    path = "{}/pickles".format(pickle_jar)
+    return [os.path.join(path, filename)
+            for filename in sorted(os.listdir(path), key=get_snapshot_number)]
+
+
+def iter_snapshots(pickle_jar):
+    """
+    Yields (filename, interpreter) for every snapshot in execution order.
+    Deltas are applied to the same interpreter object, so use each one before advancing.
+    """
+    interpreter = None
+    for path in get_snapshot_paths(pickle_jar):
+        if path.endswith(DELTA_SUFFIX):
+            apply_delta(interpreter, load_delta(path), copy=False)
+        else:
+            interpreter = load_keyframe(path)
+        yield os.path.basename(path), interpreter
+
+
+def load_index(pickle_jar):
+    """
+    Returns [step, path] for the origin, when there is one, and every snapshot of a jar,
+    in step order. Jars without an index are indexed by restoring every snapshot.
+    """
+    index = []
+    for filename in ORIGIN_FILES.values():
+        origin = "{}/{}".format(pickle_jar, filename)
+        if os.path.isfile(origin):
+            index.append([0, origin])
+            break
+
+    path = "{}/{}".format(pickle_jar, INDEX_FILE)
+    if os.path.isfile(path):
+        with open(path) as file:
+            snapshots = json.load(file)["snapshots"]
+    else:
+        snapshots = [[interpreter.step_count, filename]
+                     for filename, interpreter in iter_snapshots(pickle_jar)]
+    for step, filename in snapshots:
+        index.append([step, "{}/pickles/{}".format(pickle_jar, filename)])
+    return index
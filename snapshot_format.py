@@ -0,0 +1,578 @@
+"""
+snapshot_format.py
+
+Compact, versioned binary snapshot format, in place of pickling the whole interpreter.
+
+A snapshot file is a preamble (magic string, format version, header length), a JSON header, and
+then sections. Each section is a raw array of fixed-width values starting on an 8-byte boundary,
+and the header gives the offset, typecode, and length of every section. Any section can
+therefore be memory mapped and read in place without reading or unpickling the rest. Values are
+stored in the narrowest integer type that holds every value of their section.
+
+* registers, shadow_registers - The register file and its taint.
+* counters - Step and taint counters, named by COUNTERS.
+* memory_pages, memory - Indices of the memory pages held, and their cells, page after page.
+* shadow_memory_pages, shadow_memory - The same for paged shadow memory.
+* shadow_memory_starts, shadow_memory_values - The runs of range-compressed shadow memory.
+* heavy_hitter_keys, heavy_hitter_executions, heavy_hitter_propagations - Heavy hitter counts.
+* objects - A pickle of what has no fixed width: scalar attributes other than the counters, the
+  control stack, labels, and in keyframes the rest of the interpreter's configuration, like its
+  policy and hooks.
+
+A keyframe holds every allocated page and heavy hitter count. A delta holds only what changed
+since the snapshot named 'previous' in its header, as the pickled deltas of snapshot.py do.
+What is the same for the whole run, like the program and the memory size, is only in the
+keyframe's header, and a delta names its keyframe as its 'base' (see SnapshotFile.get_metadata).
+
+A manifest is a keyframe that only holds the registers, shadow registers, and counters. Every
+page, and everything else, is a blob in a PageStore (see page_store.py), and the header's
+'blobs' give where the store is and the ids of: a page table of memory, of shadow memory, and
+of heavy hitter counts in chunks of PAGE_SIZE keys, each listing the blob of every page held;
+the shadow memory runs; the configuration; and the objects. Tables and blobs that did not
+change since an earlier manifest are shared with it. SnapshotFile fetches the blobs, so
+manifests read like keyframes.
+
+The parsed program is not stored. The header names it by the SHA-256 of its file and the parser
+version, and restoring loads it from the program cache, or parses the file again if it is
+unchanged (see program_cache.load_program_by_hash).
+
+* FORMAT_VERSION - Version written into every file. Newer versions are refused.
+* is_binary_snapshot - Whether a file is in this format rather than a pickle.
+* class SnapshotFile - Memory maps a snapshot and reads its sections in place.
+* write_snapshot - Writes a snapshot record of an interpreter, or its manifest.
+* encode_configuration, encode_manifest_objects, encode_page, encode_columns, encode_table,
+  encode_runs - The blobs of a manifest.
+* read_record - Returns the snapshot record held by a file, for snapshot.apply_delta.
+* build_interpreter - Returns the interpreter of a keyframe, before its record is applied.
+"""
+
+import os
+import sys
+import json
+import mmap
+import pickle
+import struct
+from array import array
+from parser import PARSER_VERSION
+from program_cache import load_program_by_hash, PROGRAM_CACHE
+from state import RiscvState, ABI_TO_REGISTER_IDX
+from memory import PagedMemory, PAGE_SIZE
+from taint import TaintTracker, SHADOW_BACKENDS, TAINT_TYPECODE, clean_taint_array
+from heavy_hitters import HeavyHitters, SketchHeavyHitters
+from page_store import open_page_store
+
+MAGIC = b"RVSNAPSH"
+# 2 added manifests. 3 moved run metadata out of deltas and narrowed values.
+FORMAT_VERSION = 3
+# Magic string, format version, length of the JSON header.
+PREAMBLE = struct.Struct("<8sII")
+ALIGNMENT = 8
+
+VALUE_TYPECODE = "q"
+OBJECTS_TYPECODE = "B"
+# Typecodes tried for a section, narrowest first, for signed and for unsigned values.
+SIGNED_TYPECODES = ("b", "h", "i", "q")
+UNSIGNED_TYPECODES = ("B", "H", "I", "Q")
+ITEMSIZES = {typecode: array(typecode).itemsize
+             for typecode in SIGNED_TYPECODES + UNSIGNED_TYPECODES}
+
+# Sections left out of the file when empty, and read back as empty.
+OPTIONAL_SECTIONS = ("memory", "memory_pages", "shadow_memory", "shadow_memory_pages",
+                     "heavy_hitter_keys", "heavy_hitter_executions", "heavy_hitter_propagations")
+
+PC = ABI_TO_REGISTER_IDX['pc']
+
+# Typecode of the cells of each paged memory.
+PAGE_TYPECODES = {"memory": VALUE_TYPECODE, "shadow_memory": TAINT_TYPECODE}
+
+# Scalar attributes also kept in the counters section, as (record key, attribute).
+COUNTERS = [
+    ("interpreter_scalars", "step_count"),
+    ("interpreter_scalars", "pickle_count"),
+    ("tracker_scalars", "num_total_instr_run"),
+    ("tracker_scalars", "num_tainted_instr_run"),
+    ("tracker_scalars", "taint_level"),
+    ("tracker_scalars", "taint_source"),
+    ("tracker_scalars", "control_taint"),
+    ("tracker_scalars", "call_depth"),
+]
+
+# Attributes held in sections or rebuilt on restore, left out of the pickled configuration.
+INTERPRETER_SECTIONS = ("_instructions", "block_labels", "state", "tracker")
+STATE_SECTIONS = ("registers", "memory", "dirty_pages")
+TRACKER_SECTIONS = ("state", "shadow_registers", "shadow_memory", "heavy_hitters", "dirty_pages")
+
+# Programs loaded by hash, shared by every interpreter restored in this process.
+_programs = {}
+
+
+def align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+# The values as an array of the narrowest type that holds them. Raises OverflowError if none does.
+def pack_values(values, typecodes=SIGNED_TYPECODES):
+    values = values if isinstance(values, list) else list(values)
+    low, high = (min(values), max(values)) if values else (0, 0)
+    for typecode in typecodes:
+        bits = array(typecode).itemsize * 8
+        if typecode.isupper():
+            fits = low >= 0 and high < 1 << bits
+        else:
+            fits = low >= -(1 << bits - 1) and high < 1 << bits - 1
+        if fits:
+            return array(typecode, values)
+    raise OverflowError("A snapshot value does not fit in 64 bits")
+
+
+# The counter values of 'interpreter', in the order of COUNTERS.
+def get_counters(interpreter):
+    owners = {"interpreter_scalars": interpreter, "state_scalars": interpreter.state,
+              "tracker_scalars": interpreter.tracker}
+    return [getattr(owners[key], name, 0) for key, name in COUNTERS]
+
+
+def is_binary_snapshot(path):
+    with open(path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def get_shadow_backend(shadow_memory):
+    for name, backend in SHADOW_BACKENDS.items():
+        if type(shadow_memory) is backend:
+            return name
+    raise Exception("Unknown shadow memory type '{}'".format(type(shadow_memory).__name__))
+
+
+# The interpreter without its program, memory, and shadow state, which are saved in sections,
+# and without the scalars and control stack of 'record', which change at every step.
+def get_configuration(interpreter, record):
+    configuration = interpreter.__getstate__()
+    state = dict(interpreter.state.__dict__)
+    tracker = interpreter.tracker.__getstate__()
+    for attributes, sections, scalars in ((configuration, INTERPRETER_SECTIONS,
+                                           "interpreter_scalars"),
+                                          (state, STATE_SECTIONS, "state_scalars"),
+                                          (tracker, TRACKER_SECTIONS, "tracker_scalars")):
+        for name in list(sections) + list(record[scalars]):
+            attributes.pop(name, None)
+    tracker.pop("control_stack", None)
+    return {"interpreter": configuration, "state": state, "tracker": tracker}
+
+
+def encode_configuration(interpreter, record):
+    return pickle.dumps(get_configuration(interpreter, record))
+
+
+# What has no fixed width, pickled. Keyframes also hold the configuration. The counters are
+# left out, since the counters section holds them.
+def encode_objects(record, configuration=None):
+    objects = {key: record.get(key) for key in ("labels", "control_stack")}
+    for key in ("interpreter_scalars", "state_scalars", "tracker_scalars"):
+        objects[key] = {name: val for name, val in record[key].items()
+                        if (key, name) not in COUNTERS}
+    if configuration is not None:
+        objects["configuration"] = configuration
+    return pickle.dumps(objects)
+
+
+# A manifest's objects without the counters only take a new blob when another scalar changes.
+def encode_manifest_objects(record):
+    return encode_objects(dict(record, labels=None))
+
+
+def encode_page(cells, typecode):
+    return array(typecode, cells).tobytes()
+
+
+# Two columns of 64-bit values of the same length, one after the other. Heavy hitter chunks are
+# the executions and propagations of PAGE_SIZE consecutive keys, and the page tables of a
+# manifest are the indices of the pages held and the ids of their blobs.
+def encode_columns(first, second):
+    return array(VALUE_TYPECODE, list(first) + list(second)).tobytes()
+
+
+def decode_columns(data):
+    values = memoryview(data).cast(VALUE_TYPECODE)
+    half = len(values) // 2
+    return values[:half], values[half:]
+
+
+# The page table of a mapping of page index, or chunk, to blob id.
+def encode_table(blobs):
+    indices = sorted(blobs)
+    return encode_columns(indices, [blobs[idx] for idx in indices])
+
+
+# Starts, then values, of the runs of range-compressed shadow memory.
+def encode_runs(runs):
+    starts, values = runs
+    return array(VALUE_TYPECODE, starts).tobytes() + array(TAINT_TYPECODE, values).tobytes()
+
+
+def decode_runs(data):
+    num_runs = len(data) // (array(VALUE_TYPECODE).itemsize + array(TAINT_TYPECODE).itemsize)
+    split = num_runs * array(VALUE_TYPECODE).itemsize
+    return (list(memoryview(data[:split]).cast(VALUE_TYPECODE)),
+            list(memoryview(data[split:]).cast(TAINT_TYPECODE)))
+
+
+def get_page_sections(name, pages, typecodes):
+    indices = sorted(pages)
+    cells = []
+    for page in indices:
+        cells.extend(pages[page])
+    return [(name + "_pages", pack_values(indices)), (name, pack_values(cells, typecodes))]
+
+
+def write_snapshot(path, interpreter, record, previous=None, blobs=None, base=None):
+    """
+    Writes 'record' (see snapshot.SnapshotStore.capture) of 'interpreter' to 'path'. Without a
+    'previous' snapshot to apply it to, the record must hold the whole state, and the file is a
+    keyframe. A delta names the keyframe its chain starts from as its 'base'. Raises
+    OverflowError, before anything is written, if a value does not fit in 64 bits.
+
+    With 'blobs', the file is a manifest holding only the registers and counters, and the rest
+    is already in a page store. 'blobs' gives the store's path relative to the file
+    ('page_store'), and the blob ids of the page tables ('memory', 'shadow_memory',
+    'heavy_hitters'), the 'shadow_memory_runs' (or None), the 'configuration', and the 'objects'.
+    """
+    if interpreter.program_hash is None:
+        raise Exception("The interpreter does not know the hash of its program")
+    tracker = interpreter.tracker
+    heavy_hitters = tracker.heavy_hitters
+
+    sections = [
+        ("registers", pack_values(record["registers"])),
+        ("shadow_registers", pack_values(record["shadow_registers"], UNSIGNED_TYPECODES)),
+        ("counters", pack_values(get_counters(interpreter))),
+    ]
+    if blobs is None:
+        changes = record["heavy_hitters"]
+        keys = sorted(changes)
+        sections += get_page_sections("memory", record["memory_pages"], SIGNED_TYPECODES)
+        sections += get_page_sections("shadow_memory", record["shadow_memory_pages"],
+                                      UNSIGNED_TYPECODES)
+        if record.get("shadow_memory_runs") is not None:
+            starts, values = record["shadow_memory_runs"]
+            sections += [("shadow_memory_starts", pack_values(starts)),
+                         ("shadow_memory_values", pack_values(values, UNSIGNED_TYPECODES))]
+        sections += [
+            ("heavy_hitter_keys", pack_values(keys)),
+            ("heavy_hitter_executions", pack_values([changes[key][0] for key in keys])),
+            ("heavy_hitter_propagations", pack_values([changes[key][1] for key in keys])),
+        ]
+        configuration = None
+        if previous is None:
+            configuration = get_configuration(interpreter, record)
+        sections.append(("objects", array(OBJECTS_TYPECODE,
+                                          encode_objects(record, configuration))))
+
+    header = {
+        "version": FORMAT_VERSION,
+        "byteorder": sys.byteorder,
+        "keyframe": previous is None,
+        "previous": previous,
+        "base": base,
+        "step": interpreter.step_count,
+        "pc": record["registers"][PC],
+        "blobs": blobs,
+        "sections": {},
+    }
+    # A delta without a binary keyframe to refer to holds the run's metadata itself.
+    if previous is None or base is None:
+        header.update({
+            "program": {
+                "hash": interpreter.program_hash,
+                "parser_version": PARSER_VERSION,
+                "riscv_file": interpreter.riscv_file,
+                "program_cache": interpreter.program_cache,
+            },
+            "mem_size": interpreter.state.MEM_SIZE,
+            "page_size": PAGE_SIZE,
+            "shadow_memory": get_shadow_backend(tracker.shadow_memory),
+            "label_mode": tracker.labels is not None,
+            "hh_sketch_width": getattr(heavy_hitters, "width", 0),
+            "counters": [name for _, name in COUNTERS],
+        })
+    # Empty page and heavy hitter sections, the usual case in a delta, are left out.
+    sections = [(name, values) for name, values in sections
+                if len(values) or name not in OPTIONAL_SECTIONS]
+    offset = 0
+    for name, values in sections:
+        header["sections"][name] = [offset, values.typecode, len(values)]
+        offset = align(offset + len(values) * values.itemsize)
+    encoded = json.dumps(header, separators=(",", ":")).encode()
+
+    with open(path, 'wb') as file:
+        file.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(encoded)))
+        file.write(encoded)
+        file.write(bytes(align(file.tell()) - file.tell()))
+        for name, values in sections:
+            values.tofile(file)
+            file.write(bytes(align(file.tell()) - file.tell()))
+
+
+class SnapshotFile():
+    """
+    Read access to a binary snapshot. The file is memory mapped, and each section is read in
+    place, as a sequence of its values, only when asked for. With 'data', the contents of a
+    file already read whole, sections are read from it instead.
+    """
+    def __init__(self, path, data=None):
+        self.path = path
+        if data is None:
+            with open(path, 'rb') as file:
+                self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._map = data
+        # The whole file, sliced for each section.
+        self._memory = memoryview(self._map)
+        self._views = [self._memory]
+        magic, version, length = PREAMBLE.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise Exception("'{}' is not a binary snapshot".format(path))
+        if version > FORMAT_VERSION:
+            self.close()
+            raise Exception("'{}' has format version {}, newer than {}".format(
+                path, version, FORMAT_VERSION))
+        self.header = json.loads(self._map[PREAMBLE.size:PREAMBLE.size + length])
+        if self.header["byteorder"] != sys.byteorder:
+            self.close()
+            raise Exception("'{}' was written on a {}-endian machine".format(
+                path, self.header["byteorder"]))
+        self._base = align(PREAMBLE.size + length)
+        # Opened on first use, for manifests.
+        self._page_store = None
+        # Header of the base keyframe of a delta, read on first use.
+        self._base_header = None
+
+    def has_section(self, name):
+        return name in self.header["sections"]
+
+    def get_section(self, name):
+        """
+        Returns the section as a read-only sequence of its values, backed by the mapped file.
+        """
+        if not self.has_section(name):
+            raise Exception("'{}' has no section '{}'".format(self.path, name))
+        offset, typecode, length = self.header["sections"][name]
+        start = self._base + offset
+        view = self._memory[start:start + length * ITEMSIZES[typecode]]
+        values = view.cast(typecode)
+        self._views += [view, values]
+        return values
+
+    def get_metadata(self, name):
+        """
+        Returns a field of the header that is the same for the whole run, like 'mem_size'.
+        A delta reads it from the header of its base keyframe.
+        """
+        if name in self.header or not self.header.get("base"):
+            return self.header[name]
+        if self._base_header is None:
+            self._base_header = read_header(
+                os.path.join(os.path.dirname(self.path), self.header["base"]))
+        return self._base_header[name]
+
+    def get_counter(self, name):
+        return self.get_section("counters")[self.get_metadata("counters").index(name)]
+
+    def is_manifest(self):
+        return bool(self.header.get("blobs"))
+
+    # Blobs of a manifest, held by the page store next to it.
+    def get_blob(self, blob):
+        if self._page_store is None:
+            if not self.is_manifest():
+                raise Exception("'{}' is not a manifest".format(self.path))
+            self._page_store = open_page_store(
+                os.path.join(os.path.dirname(self.path), self.header["blobs"]["page_store"]))
+        return self._page_store.get(blob)
+
+    # (page or chunk, blob id) of every entry of one of a manifest's page tables.
+    def get_table(self, name):
+        return zip(*decode_columns(self.get_blob(self.header["blobs"][name])))
+
+    # Memory or shadow memory as a mapping of page index to that page's cells.
+    def get_pages(self, name):
+        if self.is_manifest():
+            return {page: memoryview(self.get_blob(blob)).cast(PAGE_TYPECODES[name])
+                    for page, blob in self.get_table(name)}
+        if not self.has_section(name + "_pages"):
+            return {}
+        cells = self.get_section(name)
+        return {
+            page: cells[idx * PAGE_SIZE:(idx + 1) * PAGE_SIZE]
+            for idx, page in enumerate(self.get_section(name + "_pages"))
+        }
+
+    def count_tainted_registers(self):
+        shadow_registers = self.get_section("shadow_registers")
+        return len(shadow_registers) - array(TAINT_TYPECODE, shadow_registers).count(0)
+
+    # Tainted cells of each paged shadow memory page held. A delta only holds the pages changed.
+    def count_tainted_pages(self):
+        return {page: PAGE_SIZE - array(TAINT_TYPECODE, cells).count(0)
+                for page, cells in self.get_pages("shadow_memory").items()}
+
+    # Starts and values of range-compressed shadow memory, or None if its runs are not held.
+    def get_runs(self):
+        if self.is_manifest():
+            blob = self.header["blobs"]["shadow_memory_runs"]
+            return None if blob is None else decode_runs(self.get_blob(blob))
+        if not self.has_section("shadow_memory_starts"):
+            return None
+        return (list(self.get_section("shadow_memory_starts")),
+                list(self.get_section("shadow_memory_values")))
+
+    # Tainted cells of range-compressed shadow memory, or None if its runs are not held.
+    def count_tainted_runs(self):
+        runs = self.get_runs()
+        if runs is None:
+            return None
+        starts, values = runs
+        ends = list(starts[1:]) + [self.get_metadata("mem_size")]
+        return sum(end - start for start, end, val in zip(starts, ends, values) if val)
+
+    # Heavy hitter counts held, as (key, executions, propagations).
+    def get_heavy_hitters(self):
+        if not self.is_manifest():
+            if not self.has_section("heavy_hitter_keys"):
+                return []
+            return list(zip(self.get_section("heavy_hitter_keys"),
+                            self.get_section("heavy_hitter_executions"),
+                            self.get_section("heavy_hitter_propagations")))
+        counts = []
+        # Sketch cells are all kept, counters only for the lines that ran.
+        sketch = bool(self.get_metadata("hh_sketch_width"))
+        for chunk, blob in self.get_table("heavy_hitters"):
+            executions, propagations = decode_columns(self.get_blob(blob))
+            counts += [(chunk * PAGE_SIZE + idx, executions[idx], propagations[idx])
+                       for idx in range(len(executions)) if sketch or executions[idx]]
+        return counts
+
+    # The interpreter's configuration, saved with a keyframe or as a manifest's blob.
+    def get_configuration(self, objects):
+        if "configuration" in objects:
+            return objects["configuration"]
+        if not self.is_manifest():
+            raise Exception("'{}' has no configuration".format(self.path))
+        return pickle.loads(self.get_blob(self.header["blobs"]["configuration"]))
+
+    # The objects, with the counters put back among the scalars.
+    def get_objects(self):
+        if self.is_manifest():
+            objects = pickle.loads(self.get_blob(self.header["blobs"]["objects"]))
+        else:
+            objects = pickle.loads(self.get_section("objects"))
+        for (key, name), val in zip(COUNTERS, self.get_section("counters")):
+            objects[key][name] = val
+        return objects
+
+    def close(self):
+        # Views must be released before the map can close.
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# The JSON header of a snapshot, without mapping the file.
+def read_header(path):
+    with open(path, 'rb') as file:
+        magic, version, length = PREAMBLE.unpack(file.read(PREAMBLE.size))
+        if magic != MAGIC:
+            raise Exception("'{}' is not a binary snapshot".format(path))
+        return json.loads(file.read(length))
+
+
+def read_record(snapshot, objects=None):
+    """
+    Returns the snapshot record held by 'snapshot', with the name of its 'previous' snapshot.
+    """
+    objects = snapshot.get_objects() if objects is None else objects
+    return {
+        "previous": snapshot.header["previous"],
+        "registers": list(snapshot.get_section("registers")),
+        "shadow_registers": array(TAINT_TYPECODE, snapshot.get_section("shadow_registers")),
+        "memory_pages": {page: list(cells)
+                         for page, cells in snapshot.get_pages("memory").items()},
+        "shadow_memory_pages": {page: array(TAINT_TYPECODE, cells)
+                                for page, cells in snapshot.get_pages("shadow_memory").items()},
+        "shadow_memory_runs": snapshot.get_runs(),
+        "heavy_hitters": {key: (executions, propagations)
+                          for key, executions, propagations in snapshot.get_heavy_hitters()},
+        "labels": objects["labels"],
+        "control_stack": objects["control_stack"],
+        "interpreter_scalars": objects["interpreter_scalars"],
+        "state_scalars": objects["state_scalars"],
+        "tracker_scalars": objects["tracker_scalars"],
+    }
+
+
+def load_program(program):
+    if program["parser_version"] != PARSER_VERSION:
+        raise Exception("The snapshot was taken with parser version {}, not {}".format(
+            program["parser_version"], PARSER_VERSION))
+    digest = program["hash"]
+    if digest not in _programs:
+        _programs[digest] = load_program_by_hash(
+            digest, program["program_cache"] or PROGRAM_CACHE, program["riscv_file"])
+    return _programs[digest]
+
+
+def build_interpreter(snapshot, objects=None):
+    """
+    Returns the interpreter of the keyframe 'snapshot', with its configuration and program,
+    but empty memory and shadow state until its record is applied (see snapshot.apply_delta).
+    """
+    # Imported here, since the interpreter imports the snapshot modules.
+    from interpreter import RiscvInterpreter
+
+    header = snapshot.header
+    if not header["keyframe"]:
+        raise Exception("'{}' is a delta, not a keyframe".format(snapshot.path))
+    objects = snapshot.get_objects() if objects is None else objects
+    configuration = snapshot.get_configuration(objects)
+    mem_size = header["mem_size"]
+
+    state = RiscvState.__new__(RiscvState)
+    state.__dict__.update(configuration["state"])
+    state.__dict__.update(objects["state_scalars"])
+    state.registers = [0] * len(snapshot.get_section("registers"))
+    state.memory = PagedMemory(mem_size, [0] * PAGE_SIZE)
+    state.dirty_pages = set()
+
+    width = header["hh_sketch_width"]
+    tracker = TaintTracker.__new__(TaintTracker)
+    tracker.__setstate__(dict(
+        configuration["tracker"],
+        **objects["tracker_scalars"],
+        state=state,
+        shadow_registers=clean_taint_array(len(state.registers)),
+        shadow_memory=SHADOW_BACKENDS[header["shadow_memory"]](
+            mem_size, clean_taint_array(PAGE_SIZE)),
+        heavy_hitters=SketchHeavyHitters(width) if width else HeavyHitters(),
+        dirty_pages=set(),
+    ))
+
+    instructions, labels = load_program(header["program"])
+    interpreter = RiscvInterpreter.__new__(RiscvInterpreter)
+    interpreter.__setstate__(dict(
+        configuration["interpreter"],
+        **objects["interpreter_scalars"],
+        _instructions=instructions,
+        block_labels=labels,
+        state=state,
+        tracker=tracker,
+    ))
+    return interpreter
@@ -8,6 +8,8 @@ Holds registers and memory. Converts instructions in blocks dictionary into inst
 * class RiscvState - State metadata, an array for memory, and a dictionary for register state.
 """
 
+from memory import PagedMemory, PAGE_SIZE
+
 ABI_TO_REGISTER_IDX = {
         'zero': 0,
         'ra': 1,
@@ -56,8 +58,11 @@ class RiscvState():
         self.STACK_SIZE = stack_size
         self.MEM_SIZE = mem_size
 
-        # Initialize the list of memory.
-        self.memory = [0 for i in range(mem_size)]
+        # Initialize memory. Pages are only allocated once written.
+        self.memory = PagedMemory(mem_size, [0] * PAGE_SIZE)
+
+        # Pages written since the last snapshot.
+        self.dirty_pages = set()
 
         # Initialize the stack pointer to the end of memory.
         self.set_register('sp', mem_size)
@@ -125,11 +130,12 @@ class RiscvState():
             raise Exception("Attempt to write to invalid register")
 
     def get_memory(self, location):
-        if location < 0 or location > self.MEM_SIZE:
+        if location < 0 or location >= self.MEM_SIZE:
             raise Exception("Memory read out of bounds")
-        return self.memory[location]
+        return self.memory.get(location)
 
     def set_memory(self, location, val):
-        if location < 0 or location > self.MEM_SIZE:
+        if location < 0 or location >= self.MEM_SIZE:
             raise Exception("Memory write out of bounds")
-        self.memory[location] = val
+        self.memory.set(location, val)
+        self.dirty_pages.add(location // PAGE_SIZE)
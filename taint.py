@@ -6,11 +6,21 @@ Defines object representations necessary to track and propagate taint.
 * class TaintTracker - provides taint tracking abstractions for instruction-level tracking.
 For each instruction encountered, propagates taint based on the user provided taint policy.
 Maintains shadow memory and shadow registers, which correspond to regs/mem in interpreter state.
+
+Shadow cells hold a bitmask of taint flags, or in label mode the ID of a set of labels
+interned in a LabelTable (see labels.py).
+
+Shadow memory is paged (CountingPagedMemory), or range-compressed (RangeMemory) for programs
+that taint large buffers at once.
 """
 
-from collections import defaultdict
-from state import ABI_TO_REGISTER_IDX
-from instruction import SUPPORTED_FUNCTIONS
+from time import perf_counter
+from array import array
+from state import ABI_TO_REGISTER_IDX, PAGE_SIZE
+from memory import CountingPagedMemory, RangeMemory
+from heavy_hitters import HeavyHitters
+from taint_log import MIXED
+from instruction import SUPPORTED_FUNCTIONS, TAINT_FLAGS
 
 from instruction import (
     TAINT_LOC,
@@ -21,6 +31,24 @@ from instruction import (
     TAINT_OTHER,
 )
 
+# Shadow state holds one unsigned 32-bit taint mask per register or memory cell.
+TAINT_TYPECODE = "I"
+
+
+# Shadow memory backends.
+SHADOW_PAGED = "paged"
+SHADOW_RANGES = "ranges"
+SHADOW_BACKENDS = {
+    SHADOW_PAGED: CountingPagedMemory,
+    SHADOW_RANGES: RangeMemory,
+}
+
+
+# A clean shadow array of 'size' cells.
+def clean_taint_array(size):
+    return array(TAINT_TYPECODE, [0]) * size
+
+
 # For heavy hitter tracking. Flags to know where taint destination is by opcode.
 TAINT_DEST = {
     "addi": 0,
@@ -41,6 +69,7 @@ TAINT_DEST = {
     "ret": "ret",
     "lw": 0,
     "blt": "jump",
+    "bge": "jump",
     "bne": "jump",
     "bnez": "jump",
     "beq": "jump",
@@ -50,31 +79,102 @@ TAINT_DEST = {
 }
 
 class TaintTracker:
-    def __init__(self, state, policy):
+    def __init__(self, state, policy, heavy_hitters=None, labels=None, shadow_memory=SHADOW_PAGED):
         # Physical limits.
         self.STACK_SIZE = state.STACK_SIZE
         self.MEM_SIZE = state.MEM_SIZE
         self.state = state
 
         # Taint stats.
+        # taint_level is 1 while taint is tracked and 0 while running taint-free.
         self.taint_level = 0
         self.num_total_instr_run = 0
         self.num_tainted_instr_run = 0
         self.time_in_taint_mode = 0
+        self.time_in_idle_mode = 0
+        self._mode_started = perf_counter()
 
         # Add to taint source when supported function is called.
         # Clear when function returns.
         self.taint_source = 0
 
         self.policy = policy
+        # Taint handler of each line, compiled from the policy and its hooks.
+        # Set by the interpreter; without it handlers are looked up by opcode.
+        self.handlers = None
 
         # Shadow state for taint tracking.
-        self.shadow_registers = [0 for i in range(33)]
-        self.shadow_memory = [0 for i in range(self.MEM_SIZE)]
+        self.shadow_registers = clean_taint_array(33)
+        if shadow_memory not in SHADOW_BACKENDS:
+            raise Exception("Unknown shadow memory backend '{}'".format(shadow_memory))
+        self.shadow_memory = SHADOW_BACKENDS[shadow_memory](
+            self.MEM_SIZE, clean_taint_array(PAGE_SIZE))
+
+        # Shadow memory pages written since the last snapshot.
+        # Snapshots of RangeMemory hold every run, so for it only emptiness matters.
+        self.dirty_pages = set()
 
         # For Heavy Hitter tracking.
-        # For each instruction line, stores whether taint was propogated.
-        self.propagation_history = defaultdict(list)
+        # For each instruction line, counts executions and how many propagated taint.
+        self.heavy_hitters = HeavyHitters() if heavy_hitters is None else heavy_hitters
+
+        # Opt-in OpcodeProfiler (see profiler.py), set by the interpreter.
+        self.profiler = None
+
+        # Tracer (see tracer.py) of the running interpreter, set by the interpreter.
+        self.tracer = None
+
+        # Opt-in TaintLogWriter (see taint_log.py) recording every change of taint.
+        # Set by the interpreter.
+        self.taint_log = None
+
+        # Implicit flows (see control_flow.py). Immediate post-dominator of every line, set by
+        # the interpreter when the policy has control flow handlers.
+        self.post_dominators = None
+        # Open scopes of tainted branches, as (post-dominator, call depth, enclosing control taint).
+        # Every write while a scope is open is also tainted with 'control_taint'.
+        self.control_stack = []
+        self.control_taint = 0
+        # Calls not yet returned from, kept by the interpreter.
+        # Scopes opened by a recursive call are kept apart from those of its caller.
+        self.call_depth = 0
+
+        # Label mode: shadow cells hold label set IDs from this LabelTable instead of masks.
+        self.labels = labels
+        self._bind_labels()
+
+    def __getstate__(self):
+        # Compiled handlers may chain closures; the interpreter recompiles them on load.
+        state = self.__dict__.copy()
+        state['handlers'] = None
+        state['taint_log'] = None
+        state['tracer'] = None
+        state['post_dominators'] = None
+        state.pop('OR', None)
+        return state
+
+    def __setstate__(self, state):
+        state.setdefault('control_stack', [])
+        state.setdefault('control_taint', 0)
+        state.setdefault('call_depth', 0)
+        self.__dict__.update(state)
+        self.labels = state.get('labels')
+        self._bind_labels()
+
+    # In label mode, combining taint is a memoized union of label sets.
+    def _bind_labels(self):
+        if self.labels is not None:
+            self.OR = self.labels.union
+
+    # The taint handler of the line at 'pc'.
+    def get_handler(self, pc, opcode):
+        if self.handlers is not None:
+            handler = self.handlers[pc]
+        else:
+            handler = self.policy.get(opcode)
+        if handler is None:
+            raise Exception("Taint opcode '{}' not handled.".format(opcode))
+        return handler
 
     def get_reg_idx(self, reg):
         if type(reg).__name__ == "str" and reg in ABI_TO_REGISTER_IDX:
@@ -84,10 +184,12 @@ class TaintTracker:
         else:
             raise Exception("Invalid reg {}".format(reg))
 
-    # Pretty print the taint mask.
+    # Pretty print the taint mask, or the names of the labels in label mode.
     def print_taint(self, taint):
         if taint == 0:
             return "CLEAN"
+        if self.labels is not None:
+            return "|".join(self.labels.get_names(taint))
 
         taint_string = ""
         if taint & TAINT_LOC:
@@ -108,22 +210,113 @@ class TaintTracker:
     def OR(self, taint1, taint2):
         return taint1 | taint2
 
+    # Taint of a call to the source 'function_name': its mask, or a fresh label in label mode.
+    def get_source_taint(self, function_name):
+        mask = SUPPORTED_FUNCTIONS[function_name]
+        if self.labels is None:
+            return mask
+        return self.labels.new_label(function_name, mask)
+
+    # The taint flags of a shadow cell.
+    def get_taint_mask(self, taint):
+        if self.labels is None:
+            return taint
+        return self.labels.get_mask(taint)
+
     def get_memory_taint(self, location):
-        if location < 0 or location > self.MEM_SIZE:
+        if location < 0 or location >= self.MEM_SIZE:
             raise Exception("Memory read out of bounds")
-        return self.shadow_memory[location]
+        return self.shadow_memory.get(location)
+
+    # Every memory cell write ends here, so the taint log sees each change.
+    def _set_memory_taint(self, location, taint):
+        if self.control_taint:
+            taint = self.OR(taint, self.control_taint)
+        if self.taint_log is not None:
+            old = self.shadow_memory.get(location)
+            if old != taint:
+                self.taint_log.record_memory(location, location + 1, old, taint)
+        self.shadow_memory.set(location, taint)
+        self.dirty_pages.add(location // PAGE_SIZE)
 
     def replace_memory_taint(self, location, taint):
-        if location < 0 or location > self.MEM_SIZE:
+        if location < 0 or location >= self.MEM_SIZE:
             raise Exception("Memory write out of bounds")
-        self.shadow_memory[location] = taint
+        self._set_memory_taint(location, taint)
 
     def add_memory_taint(self, location, taint):
-        if location < 0 or location > self.MEM_SIZE:
+        if location < 0 or location >= self.MEM_SIZE:
             raise Exception("Memory write out of bounds")
-        self.shadow_memory[location] = self.OR(
-            taint, self.shadow_memory[location]
-        )
+        self._set_memory_taint(location, self.OR(
+            taint, self.shadow_memory.get(location)
+        ))
+
+    def _check_memory_range(self, start, end):
+        if start < 0 or end > self.MEM_SIZE or start > end:
+            raise Exception("Memory range [{}, {}) out of bounds".format(start, end))
+
+    # Number of tainted memory cells in [start, end).
+    def count_tainted_memory(self, start=0, end=None):
+        end = self.MEM_SIZE if end is None else end
+        self._check_memory_range(start, end)
+        return self.shadow_memory.count_nonzero(start, end)
+
+    def _mark_dirty_range(self, start, end):
+        if start >= end:
+            return
+        if isinstance(self.shadow_memory, RangeMemory):
+            self.dirty_pages.add(start // PAGE_SIZE)
+        else:
+            self.dirty_pages.update(range(start // PAGE_SIZE, (end - 1) // PAGE_SIZE + 1))
+
+    # The taint shared by every cell in [start, end), or MIXED.
+    def _get_range_taint(self, start, end):
+        runs = self.shadow_memory.query_range(start, end)
+        if not runs:
+            return 0
+        if len(runs) == 1 and runs[0][:2] == (start, end):
+            return runs[0][2]
+        return MIXED
+
+    # Apply 'write' to the shadow memory in [start, end), logging it as one event.
+    def _write_memory_range(self, start, end, write):
+        self._check_memory_range(start, end)
+        if self.taint_log is None:
+            write()
+        else:
+            old = self._get_range_taint(start, end)
+            write()
+            new = self._get_range_taint(start, end)
+            if old != new or old == MIXED:
+                self.taint_log.record_memory(start, end, old, new)
+        self._mark_dirty_range(start, end)
+
+    # Clear the taint of every memory cell in [start, end).
+    def clear_memory_taint_range(self, start, end):
+        if self.control_taint:
+            self.replace_memory_taint_range(start, end, 0)
+            return
+        self._write_memory_range(
+            start, end, lambda: self.shadow_memory.clear_range(start, end))
+
+    # Replace the taint of every memory cell in [start, end) with 'taint'.
+    def replace_memory_taint_range(self, start, end, taint):
+        if self.control_taint:
+            taint = self.OR(taint, self.control_taint)
+        self._write_memory_range(
+            start, end, lambda: self.shadow_memory.set_range(start, end, taint))
+
+    # OR 'taint' into every memory cell in [start, end).
+    def add_memory_taint_range(self, start, end, taint):
+        if self.control_taint:
+            taint = self.OR(taint, self.control_taint)
+        self._write_memory_range(start, end, lambda: self.shadow_memory.update_range(
+            start, end, lambda cell: self.OR(taint, cell)))
+
+    # (start, end, taint) of every run of equally tainted memory cells in [start, end).
+    def query_memory_taint_range(self, start, end):
+        self._check_memory_range(start, end)
+        return self.shadow_memory.query_range(start, end)
 
     def get_register_taint(self, reg):
         idx = self.get_reg_idx(reg)
@@ -132,19 +325,27 @@ class TaintTracker:
         else:
             raise Exception("Attempt to read invalid register")
 
+    # Every register write ends here, so the taint log sees each change.
+    def _set_register_taint(self, idx, taint):
+        if self.control_taint:
+            taint = self.OR(taint, self.control_taint)
+        if self.taint_log is not None and self.shadow_registers[idx] != taint:
+            self.taint_log.record_register(idx, self.shadow_registers[idx], taint)
+        self.shadow_registers[idx] = taint
+
     def replace_register_taint(self, reg, taint):
         idx = self.get_reg_idx(reg)
         if idx >= 0 and idx <= 32:
-            self.shadow_registers[idx] = taint
+            self._set_register_taint(idx, taint)
         else:
             raise Exception("Attempt to write to invalid register")
 
     def add_register_taint(self, reg, taint):
         idx = self.get_reg_idx(reg)
         if idx >= 0 and idx <= 32:
-            self.shadow_registers[idx] = self.OR(
+            self._set_register_taint(idx, self.OR(
                 taint, self.shadow_registers[idx]
-            )
+            ))
         else:
             raise Exception("Attempt to write to invalid register")
 
@@ -193,15 +394,25 @@ class TaintTracker:
             raise Exception("Instruction operand not register or memory")
 
     def taint_by_operand(self, state, opcode, operands):
-        if opcode not in self.policy:
-            raise Exception("Taint opcode '{}' not handled.".format(opcode))
-        self.policy[opcode](tracker=self, state=state, operands=operands)
+        handler = self.get_handler(state.get_register('pc'), opcode)
+        if self.profiler is not None:
+            self._taint_by_operand_profiled(handler, state, opcode, operands)
+            return
+        handler(tracker=self, state=state, operands=operands)
 
         # For Heavy Hitter data
         self.propagation_history_track(opcode, operands)
 
+    def _taint_by_operand_profiled(self, handler, state, opcode, operands):
+        start = perf_counter()
+        handler(tracker=self, state=state, operands=operands)
+        taint = perf_counter()
+        self.propagation_history_track(opcode, operands)
+        # The line itself is counted by the interpreter.
+        self.profiler.add(opcode, taint=taint - start, bookkeeping=perf_counter() - taint, count=0)
+
     # Determines whether taint was propagated.
-    # Updates internal propagation_history dictionary.
+    # Updates the heavy hitter counters.
     def propagation_history_track(self, opcode, operands):
         strategy = TAINT_DEST[opcode]
         is_tainted_line = 0
@@ -215,7 +426,11 @@ class TaintTracker:
             raise Exception("Strategy {} not handled.".format(strategy))
 
         pc = self.state.get_register('pc')
-        self.propagation_history[pc].append(is_tainted_line)
+        self.record_propagation(pc, is_tainted_line)
+
+    # Record whether the line at 'pc' propagated taint.
+    def record_propagation(self, pc, is_tainted_line):
+        self.heavy_hitters.record(pc, is_tainted_line)
 
     def print_registers_taint(self):
         print("\nREGISTER TAINT:")
@@ -252,10 +467,103 @@ class TaintTracker:
             )
         return
 
+    def count_tainted_registers(self):
+        return len(self.shadow_registers) - self.shadow_registers.count(0)
+
+    # Number of registers and memory cells carrying taint.
+    def count_tainted(self):
+        return self.count_tainted_registers() + self.shadow_memory.nonzero
+
+    # For each flag in TAINT_FLAGS, the number of registers and memory cells carrying it.
+    def get_taint_histogram(self):
+        taints = dict(self.shadow_memory.value_counts)
+        for taint in self.shadow_registers:
+            if taint:
+                taints[taint] = taints.get(taint, 0) + 1
+        masks = {}
+        for taint, count in taints.items():
+            mask = self.get_taint_mask(taint)
+            masks[mask] = masks.get(mask, 0) + count
+        return [
+            sum(count for mask, count in masks.items() if mask & flag)
+            for _, flag in TAINT_FLAGS
+        ]
+
+    # Drop the label sets no register or memory cell holds, and renumber the shadow state.
+    # Only safe between steps, while no handler holds a label set ID.
+    def compact_labels(self):
+        live = set(self.shadow_memory.value_counts)
+        live.update(self.shadow_registers)
+        live.add(self.taint_source)
+        live.add(self.control_taint)
+        live.update(taint for _, _, taint in self.control_stack)
+        remap = self.labels.compact(live)
+
+        self.control_taint = remap[self.control_taint]
+        self.control_stack = [
+            (pdom, depth, remap[taint]) for pdom, depth, taint in self.control_stack]
+
+        self.shadow_registers[:] = array(
+            TAINT_TYPECODE, [remap[taint] for taint in self.shadow_registers])
+        self.taint_source = remap[self.taint_source]
+        if isinstance(self.shadow_memory, RangeMemory):
+            self.shadow_memory.update_range(0, self.MEM_SIZE, remap.__getitem__)
+            self._mark_dirty_range(0, self.MEM_SIZE)
+            return
+        for page in self.shadow_memory.get_allocated_pages():
+            cells = self.shadow_memory.get_page(page)
+            self.shadow_memory.set_page(
+                page, array(TAINT_TYPECODE, [remap[taint] for taint in cells]))
+            self.dirty_pages.add(page)
+
+    # Nothing is tainted, no source call is waiting to return, and no control scope is open.
+    def is_taint_idle(self):
+        return self.taint_source == 0 and not self.control_stack and self.count_tainted() == 0
+
+    ## IMPLICIT FLOWS
+
+    # Open the scope of the tainted branch at 'pc'.
+    # Lines up to its post-dominator run under 'taint'.
+    def push_control_scope(self, pc, taint):
+        if self.post_dominators is None:
+            raise Exception("Implicit flows need the post-dominators of the program")
+        pdom = self.post_dominators[pc]
+        enclosing = self.control_taint
+        # A loop branch taken again before its scope closed widens the open scope.
+        if self.control_stack and self.control_stack[-1][:2] == (pdom, self.call_depth):
+            enclosing = self.control_stack.pop()[2]
+        self.control_stack.append((pdom, self.call_depth, enclosing))
+        self.control_taint = self.OR(self.control_taint, taint)
+
+    # Close the scopes that end before the line at 'pc' runs: those whose post-dominator it is,
+    # and those of calls that returned. Called by the interpreter while the stack is not empty.
+    def pop_control_scopes(self, pc):
+        stack = self.control_stack
+        depth = self.call_depth
+        while stack and (stack[-1][1] > depth or (stack[-1][1] == depth and stack[-1][0] == pc)):
+            self.control_taint = stack.pop()[2]
+
+    # Switch between taint mode (1) and taint-free mode (0), timing each.
+    def set_taint_level(self, level):
+        now = perf_counter()
+        if self.taint_level:
+            self.time_in_taint_mode += now - self._mode_started
+        else:
+            self.time_in_idle_mode += now - self._mode_started
+        self._mode_started = now
+        self.taint_level = level
+
+    def print_mode_stats(self):
+        # Account for the time spent in the current mode.
+        self.set_taint_level(self.taint_level)
+        print("\nTAINT MODES:")
+        print("taint mode: {} instructions, {:.6f}s".format(
+            self.num_tainted_instr_run, self.time_in_taint_mode))
+        print("taint-free mode: {} instructions, {:.6f}s".format(
+            self.num_total_instr_run - self.num_tainted_instr_run, self.time_in_idle_mode))
+
     def percentage_tainted_registers(self):
-        num_tainted = sum([min(1, taint) for taint in self.shadow_registers])
-        return num_tainted / len(self.shadow_registers)
+        return self.count_tainted_registers() / len(self.shadow_registers)
 
     def percentage_tainted_memory(self):
-        num_tainted = sum([min(1, taint) for taint in self.shadow_memory])
-        return num_tainted / len(self.shadow_memory)
+        return self.count_tainted_memory() / len(self.shadow_memory)
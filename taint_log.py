@@ -0,0 +1,329 @@
+"""
+taint_log.py
+
+Append-only log of every change of taint, with on-disk indexes for provenance queries.
+
+While the log is attached, every write through the TaintTracker that changes a shadow register
+or shadow memory cell appends one event: the step, the pc, the kind of destination (register or
+memory), the destination [start, end), and the old and new taint. Bulk writes over a memory
+range are one event; their old and new taint is MIXED when the cells did not all agree. In label
+mode the taint logged is the flag mask of each label set, as compaction renumbers the set IDs.
+
+Events are stored column by column, like the timeline, in '<pickle_jar>/taint_log'. When the log
+is closed it is indexed by memory address, register, and pc: each index is a sorted column of
+keys, a column of offsets, and a column of event numbers grouped by key. A query is a binary
+search over the memory mapped keys, then one contiguous slice of event numbers, so it does not
+read the rest of the log. Range writes are kept sorted by start address, and a memory query
+searches them from its start less the longest range written.
+
+* class TaintLogWriter - Records the events of a running interpreter and indexes them on close.
+* class TaintLog - Memory maps a jar's log and answers queries.
+* first_taint - The first event of a list that taints its destination.
+* last_writer - The last event of a list at or before a step.
+"""
+
+import os
+import sys
+import json
+import bisect
+import click
+from array import array
+from collections import namedtuple
+from state import ABI_TO_REGISTER_IDX
+from timeline import map_column, COLUMN_TYPECODE, COLUMN_SUFFIX, METADATA_FILE
+
+TAINT_LOG_DIR = "taint_log"
+PC = ABI_TO_REGISTER_IDX['pc']
+
+KIND_REGISTER = 0
+KIND_MEMORY = 1
+
+# Old or new taint of a range write whose cells held different taint.
+MIXED = -1
+
+COLUMNS = ["step", "pc", "kind", "start", "end", "old", "new"]
+TaintEvent = namedtuple("TaintEvent", ["event"] + COLUMNS)
+
+# Indexes, by the column they are keyed on.
+INDEXES = {"memory": "start", "register": "start", "pc": "pc"}
+# Memory range writes by start address, searched by memory queries alongside the memory index.
+RANGES = "memory_ranges"
+
+# Events buffered before they are appended to the column files.
+FLUSH_EVERY = 4096
+
+
+def get_taint_log_path(pickle_jar):
+    return "{}/{}".format(pickle_jar, TAINT_LOG_DIR)
+
+
+def get_file_path(pickle_jar, name):
+    return "{}/{}{}".format(get_taint_log_path(pickle_jar), name, COLUMN_SUFFIX)
+
+
+def read_column(pickle_jar, name):
+    values = array(COLUMN_TYPECODE)
+    with open(get_file_path(pickle_jar, name), 'rb') as file:
+        values.frombytes(file.read())
+    return values
+
+
+def write_column(pickle_jar, name, values):
+    with open(get_file_path(pickle_jar, name), 'wb') as file:
+        array(COLUMN_TYPECODE, values).tofile(file)
+
+
+class TaintLogWriter():
+    """
+    Appends the taint events of 'interpreter' to '<pickle_jar>/taint_log'.
+    Attach it with RiscvInterpreter.set_taint_log.
+    """
+    def __init__(self, pickle_jar, interpreter, flush_every=FLUSH_EVERY):
+        self.pickle_jar = pickle_jar
+        self.interpreter = interpreter
+        self.flush_every = max(1, flush_every)
+        self.num_events = 0
+
+        os.makedirs(get_taint_log_path(pickle_jar), exist_ok=True)
+        self._buffers = [array(COLUMN_TYPECODE) for _ in COLUMNS]
+        self._files = [open(get_file_path(pickle_jar, column), 'wb') for column in COLUMNS]
+
+    # Label set IDs are only valid until the next compaction, so they are logged as their masks.
+    def _resolve(self, taint):
+        labels = self.interpreter.tracker.labels
+        if labels is None or taint == MIXED:
+            return taint
+        return labels.get_mask(taint)
+
+    def _record(self, kind, start, end, old, new):
+        row = (self.interpreter.step_count, self.interpreter.state.registers[PC],
+               kind, start, end, self._resolve(old), self._resolve(new))
+        for buffer, val in zip(self._buffers, row):
+            buffer.append(val)
+        self.num_events += 1
+        if len(self._buffers[0]) >= self.flush_every:
+            self.flush()
+
+    def record_register(self, idx, old, new):
+        self._record(KIND_REGISTER, idx, idx + 1, old, new)
+
+    def record_memory(self, start, end, old, new):
+        self._record(KIND_MEMORY, start, end, old, new)
+
+    def flush(self):
+        for buffer, file in zip(self._buffers, self._files):
+            buffer.tofile(file)
+            file.flush()
+            del buffer[:]
+
+    def close(self):
+        # Safe to call more than once.
+        if not self._files:
+            return
+        self.flush()
+        for file in self._files:
+            file.close()
+        self._files = []
+        max_range = self.write_indexes()
+
+        metadata = {
+            "columns": COLUMNS,
+            "typecode": COLUMN_TYPECODE,
+            "byteorder": sys.byteorder,
+            "num_events": self.num_events,
+            "indexes": sorted(INDEXES),
+            "max_range": max_range,
+        }
+        with open("{}/{}".format(get_taint_log_path(self.pickle_jar), METADATA_FILE), 'w') as file:
+            json.dump(metadata, file)
+
+    # Returns the length of the longest memory range write.
+    def write_indexes(self):
+        kinds = read_column(self.pickle_jar, "kind")
+        starts = read_column(self.pickle_jar, "start")
+        ends = read_column(self.pickle_jar, "end")
+        events = {
+            "memory": [idx for idx in range(len(kinds))
+                       if kinds[idx] == KIND_MEMORY and ends[idx] - starts[idx] == 1],
+            "register": [idx for idx in range(len(kinds)) if kinds[idx] == KIND_REGISTER],
+            "pc": range(len(kinds)),
+        }
+        for name, column in INDEXES.items():
+            keys = starts if column == "start" else read_column(self.pickle_jar, column)
+            self.write_index(name, keys, events[name])
+        ranges = sorted((idx for idx in range(len(kinds))
+                         if kinds[idx] == KIND_MEMORY and ends[idx] - starts[idx] != 1),
+                        key=starts.__getitem__)
+        write_column(self.pickle_jar, RANGES, ranges)
+        write_column(self.pickle_jar, RANGES + "_starts", [starts[idx] for idx in ranges])
+        return max((ends[idx] - starts[idx] for idx in ranges), default=0)
+
+    def write_index(self, name, keys, events):
+        # A stable sort keeps the events of each key in step order.
+        ordered = sorted(events, key=keys.__getitem__)
+        unique = []
+        offsets = []
+        for offset, event in enumerate(ordered):
+            if not unique or keys[event] != unique[-1]:
+                unique.append(keys[event])
+                offsets.append(offset)
+        offsets.append(len(ordered))
+        write_column(self.pickle_jar, name + "_keys", unique)
+        write_column(self.pickle_jar, name + "_offsets", offsets)
+        write_column(self.pickle_jar, name + "_events", ordered)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class TaintLog():
+    """
+    Read access to the taint log of a pickle jar. Files are memory mapped on first use.
+    Queries return TaintEvents in step order.
+    """
+    def __init__(self, pickle_jar):
+        self.pickle_jar = pickle_jar
+        self._files = {}
+        self._maps = []
+        self._metadata = None
+
+    @staticmethod
+    def exists(pickle_jar):
+        return os.path.isfile("{}/{}".format(get_taint_log_path(pickle_jar), METADATA_FILE))
+
+    def _get(self, name):
+        if name not in self._files:
+            values, mapped = map_column(get_file_path(self.pickle_jar, name))
+            if mapped is not None:
+                self._maps.append(mapped)
+            self._files[name] = values
+        return self._files[name]
+
+    def get_metadata(self):
+        if self._metadata is None:
+            with open("{}/{}".format(get_taint_log_path(self.pickle_jar), METADATA_FILE)) as file:
+                self._metadata = json.load(file)
+        return self._metadata
+
+    def __len__(self):
+        return len(self._get(COLUMNS[0]))
+
+    def get_event(self, event):
+        return TaintEvent(event, *(self._get(column)[event] for column in COLUMNS))
+
+    # Event numbers of the index 'name' with keys in [lo, hi).
+    def _lookup(self, name, lo, hi):
+        keys = self._get(name + "_keys")
+        offsets = self._get(name + "_offsets")
+        first = bisect.bisect_left(keys, lo)
+        last = bisect.bisect_left(keys, hi)
+        if first == last:
+            return []
+        return list(self._get(name + "_events")[offsets[first]:offsets[last]])
+
+    def _events(self, numbers):
+        return [self.get_event(event) for event in sorted(numbers)]
+
+    def memory_writes(self, start, end=None):
+        """
+        Every change of taint to a memory cell in [start, end), or at 'start' alone.
+        """
+        end = start + 1 if end is None else end
+        numbers = self._lookup("memory", start, end)
+        # Only ranges starting within the longest range length of 'start' can reach it.
+        range_starts = self._get(RANGES + "_starts")
+        first = bisect.bisect_right(range_starts, start - self.get_metadata()["max_range"])
+        last = bisect.bisect_left(range_starts, end)
+        ends = self._get("end")
+        numbers += [event for event in self._get(RANGES)[first:last] if ends[event] > start]
+        return self._events(numbers)
+
+    def register_writes(self, reg):
+        idx = ABI_TO_REGISTER_IDX[reg] if isinstance(reg, str) else reg
+        return self._events(self._lookup("register", idx, idx + 1))
+
+    def pc_writes(self, pc):
+        return self._events(self._lookup("pc", pc, pc + 1))
+
+    def close(self):
+        for values in list(self._files.values()):
+            if isinstance(values, memoryview):
+                values.release()
+        self._files = {}
+        for mapped in self._maps:
+            mapped.close()
+        self._maps = []
+
+
+def first_taint(events):
+    for event in events:
+        if event.new != 0:
+            return event
+    return None
+
+
+def last_writer(events, step=None):
+    found = None
+    for event in events:
+        if step is not None and event.step > step:
+            break
+        found = event
+    return found
+
+
+def print_event(event):
+    if event is None:
+        print("No such event.")
+        return
+    if event.kind == KIND_REGISTER:
+        dest = [reg for reg, idx in ABI_TO_REGISTER_IDX.items() if idx == event.start][0]
+    elif event.end - event.start == 1:
+        dest = "mem {}".format(event.start)
+    else:
+        dest = "mem [{}, {})".format(event.start, event.end)
+    print("step {} line {}: {} taint {} -> {}".format(
+        event.step, event.pc, dest, event.old, event.new))
+
+
+# Example Execution.
+# python taint_log.py --pickle_jar=pickle_cabinet/jar_get_loc --address=120 --first_taint
+@click.command()
+@click.option('--pickle_jar', required=True, help='Path to the pickle jar of a run.')
+@click.option('--address', default=None, type=int, help='Query writes to this memory cell.')
+@click.option('--end', default=None, type=int, help='Query every memory cell in [address, end).')
+@click.option('--register', default=None, help='Query writes to this register.')
+@click.option('--pc', default=None, type=int, help='Query writes made by this line.')
+@click.option('--first_taint', 'select', flag_value='first', help='Only the first tainting write.')
+@click.option('--last_writer', 'select', flag_value='last',
+              help='Only the last write, at or before --step.')
+@click.option('--step', default=None, type=int, help='Last step considered by --last_writer.')
+def main(pickle_jar, address, end, register, pc, select, step):
+    if not TaintLog.exists(pickle_jar):
+        print("'{}' has no taint log. Run the interpreter with --taint_log.".format(pickle_jar))
+        sys.exit(1)
+
+    log = TaintLog(pickle_jar)
+    if address is not None:
+        events = log.memory_writes(address, end)
+    elif register is not None:
+        events = log.register_writes(register)
+    elif pc is not None:
+        events = log.pc_writes(pc)
+    else:
+        events = [log.get_event(event) for event in range(len(log))]
+
+    if select == 'first':
+        print_event(first_taint(events))
+    elif select == 'last':
+        print_event(last_writer(events, step))
+    else:
+        for event in events:
+            print_event(event)
+    log.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+test_page_store.py
+
+Restoring from a jar that was rewritten in the same process must read the new page store, not
+the one cached for the old jar.
+
+# Example Execution.
+# python -m pytest -q test_page_store.py
+"""
+
+import os
+from interpreter import RiscvInterpreter, make_pickle_jar, run_with_snapshots
+from page_store import PageStore, open_page_store
+from policy import policy
+from snapshot import SNAPSHOT_DEDUP, load_snapshot, get_snapshot_paths
+
+TESTFILES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "testfiles")
+
+
+def write_blobs(directory, blobs):
+    with PageStore(directory, "none", writable=True) as store:
+        return [store.put(blob) for blob in blobs]
+
+
+def test_rewritten_store_is_reopened(tmp_path):
+    directory = str(tmp_path / "pages")
+    ids = write_blobs(directory, [b"old page"])
+    assert open_page_store(directory).get(ids[0]) == b"old page"
+
+    # Same number of blobs of the same size, so the index and pack keep their sizes.
+    for filename in os.listdir(directory):
+        os.remove(os.path.join(directory, filename))
+    ids = write_blobs(directory, [b"new page"])
+    assert open_page_store(directory).get(ids[0]) == b"new page"
+
+
+def get_state(interpreter):
+    return (list(interpreter.state.registers), list(interpreter.tracker.shadow_registers),
+            [interpreter.state.get_memory(addr) for addr in range(interpreter.state.MEM_SIZE)])
+
+
+def run_into(pickle_jar, program):
+    make_pickle_jar(pickle_jar)
+    interpreter = RiscvInterpreter(os.path.join(TESTFILES, program), policy, program_cache=None)
+    run_with_snapshots(interpreter, pickle_jar, snapshot_queue=0, snapshot_format=SNAPSHOT_DEDUP)
+
+
+def test_restore_from_rewritten_jar(tmp_path):
+    pickle_jar = str(tmp_path / "jar")
+    run_into(pickle_jar, "hash.s")
+    for path in get_snapshot_paths(pickle_jar):
+        load_snapshot(path)
+
+    run_into(pickle_jar, "multiplefuns.s")
+    # Snapshots are taken after every step.
+    expected = []
+    interpreter = RiscvInterpreter(os.path.join(TESTFILES, "multiplefuns.s"), policy,
+                                   program_cache=None)
+    while interpreter.run():
+        expected.append(get_state(interpreter))
+    restored = [get_state(load_snapshot(path)) for path in get_snapshot_paths(pickle_jar)]
+    assert restored == expected
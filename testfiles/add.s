@@ -0,0 +1,29 @@
+	.text
+	.attribute	4, 16
+	.attribute	5, "rv32i2p0"
+	.file	"add.ll"
+	.globl	main                            # -- Begin function main
+	.p2align	2
+	.type	main,@function
+main:                                   # @main
+# %bb.0:
+	addi	sp, sp, -32
+	sw	zero, 28(sp)
+	li	a0, 42
+	sw	a0, 24(sp)
+	sw	zero, 20(sp)
+	li	a0, 1
+	sw	a0, 16(sp)
+	lw	a1, 24(sp)
+	lw	a0, 20(sp)
+	add	a1, a1, a0
+	lw	a0, 16(sp)
+	add	a0, a1, a0
+	sw	a0, 12(sp)
+	lw	a0, 12(sp)
+	addi	sp, sp, 32
+	ret
+.Lfunc_end0:
+	.size	main, .Lfunc_end0-main
+                                        # -- End function
+	.section	".note.GNU-stack","",@progbits
@@ -0,0 +1,81 @@
+	.text
+	.attribute	4, 16
+	.attribute	5, "rv32i2p0"
+	.file	"cmpxchg.ll"
+	.globl	cmpxchg                         # -- Begin function cmpxchg
+	.p2align	2
+	.type	cmpxchg,@function
+cmpxchg:                                # @cmpxchg
+# %bb.0:
+	addi	sp, sp, -16
+	sw	a0, 8(sp)
+	sw	a1, 4(sp)
+	sw	a2, 0(sp)
+	lw	a0, 8(sp)
+	lw	a1, 0(a0)
+	lw	a0, 4(sp)
+	lw	a0, 0(a0)
+	bne	a1, a0, .LBB0_2
+	j	.LBB0_1
+.LBB0_1:
+	lw	a0, 0(sp)
+	lw	a1, 0(a0)
+	lw	a0, 4(sp)
+	sw	a1, 0(a0)
+	j	.LBB0_3
+.LBB0_2:
+	lw	a0, 4(sp)
+	lw	a1, 0(a0)
+	lw	a0, 8(sp)
+	sw	a1, 0(a0)
+	j	.LBB0_3
+.LBB0_3:
+	lw	a0, 12(sp)
+	addi	sp, sp, 16
+	ret
+.Lfunc_end0:
+	.size	cmpxchg, .Lfunc_end0-cmpxchg
+                                        # -- End function
+	.globl	main                            # -- Begin function main
+	.p2align	2
+	.type	main,@function
+main:                                   # @main
+# %bb.0:
+	addi	sp, sp, -32
+	sw	ra, 28(sp)                      # 4-byte Folded Spill
+	sw	zero, 24(sp)
+	sw	a0, 20(sp)
+	sw	a1, 16(sp)
+	lw	a1, 20(sp)
+	li	a0, 3
+	beq	a1, a0, .LBB1_2
+	j	.LBB1_1
+.LBB1_1:
+	li	a0, 1
+	sw	a0, 24(sp)
+	j	.LBB1_3
+.LBB1_2:
+	lw	a0, 16(sp)
+	lw	a0, 0(a0)
+	sw	a0, 12(sp)
+	lw	a0, 16(sp)
+	lw	a0, 4(a0)
+	sw	a0, 8(sp)
+	lw	a0, 16(sp)
+	lw	a0, 8(a0)
+	sw	a0, 4(sp)
+	addi	a0, sp, 12
+	addi	a1, sp, 8
+	addi	a2, sp, 4
+	call	cmpxchg
+	sw	zero, 24(sp)
+	j	.LBB1_3
+.LBB1_3:
+	lw	a0, 24(sp)
+	lw	ra, 28(sp)                      # 4-byte Folded Reload
+	addi	sp, sp, 32
+	ret
+.Lfunc_end1:
+	.size	main, .Lfunc_end1-main
+                                        # -- End function
+	.section	".note.GNU-stack","",@progbits
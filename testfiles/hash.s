@@ -0,0 +1,59 @@
+	.text
+	.attribute	4, 16
+	.attribute	5, "rv32i2p0"
+	.file	"hash.ll"
+	.globl	get_password                    # -- Begin function get_password
+	.p2align	2
+	.type	get_password,@function
+get_password:                           # @get_password
+# %bb.0:
+	lui	a0, 241127
+	addi	a0, a0, -1871
+	ret
+.Lfunc_end0:
+	.size	get_password, .Lfunc_end0-get_password
+                                        # -- End function
+	.globl	hash                            # -- Begin function hash
+	.p2align	2
+	.type	hash,@function
+hash:                                   # @hash
+# %bb.0:
+	addi	sp, sp, -16
+	sw	a0, 12(sp)
+	lui	a0, 241127
+	addi	a0, a0, -1871
+	sw	a0, 8(sp)
+	lw	a1, 12(sp)
+	lw	a0, 8(sp)
+	add	a1, a1, a0
+	srli	a0, a1, 31
+	add	a0, a1, a0
+	andi	a0, a0, -2
+	sub	a0, a1, a0
+	xori	a0, a0, 32
+	addi	sp, sp, 16
+	ret
+.Lfunc_end1:
+	.size	hash, .Lfunc_end1-hash
+                                        # -- End function
+	.globl	main                            # -- Begin function main
+	.p2align	2
+	.type	main,@function
+main:                                   # @main
+# %bb.0:
+	addi	sp, sp, -32
+	sw	ra, 28(sp)                      # 4-byte Folded Spill
+	sw	zero, 24(sp)
+	sw	a0, 20(sp)
+	sw	a1, 16(sp)
+	call	get_password
+	sw	a0, 12(sp)
+	lw	a0, 12(sp)
+	call	hash
+	lw	ra, 28(sp)                      # 4-byte Folded Reload
+	addi	sp, sp, 32
+	ret
+.Lfunc_end2:
+	.size	main, .Lfunc_end2-main
+                                        # -- End function
+	.section	".note.GNU-stack","",@progbits
@@ -0,0 +1,93 @@
+	.text
+	.attribute	4, 16
+	.attribute	5, "rv32i2p0"
+	.file	"multiplefuns.ll"
+	.globl	doSomething                     # -- Begin function doSomething
+	.p2align	2
+	.type	doSomething,@function
+doSomething:                            # @doSomething
+# %bb.0:
+	addi	sp, sp, -16
+	sw	a0, 8(sp)
+	lw	a1, 8(sp)
+	li	a0, 6
+	blt	a1, a0, .LBB0_2
+	j	.LBB0_1
+.LBB0_1:
+	lw	a0, 8(sp)
+	sw	a0, 12(sp)
+	j	.LBB0_3
+.LBB0_2:
+	lw	a0, 8(sp)
+	addi	a0, a0, 1
+	sw	a0, 12(sp)
+	j	.LBB0_3
+.LBB0_3:
+	lw	a0, 12(sp)
+	addi	sp, sp, 16
+	ret
+.Lfunc_end0:
+	.size	doSomething, .Lfunc_end0-doSomething
+                                        # -- End function
+	.globl	get_user_location               # -- Begin function get_user_location
+	.p2align	2
+	.type	get_user_location,@function
+get_user_location:                      # @get_user_location
+# %bb.0:
+	lui	a0, 319453
+	addi	a0, a0, 1742
+	ret
+.Lfunc_end1:
+	.size	get_user_location, .Lfunc_end1-get_user_location
+                                        # -- End function
+	.globl	main                            # -- Begin function main
+	.p2align	2
+	.type	main,@function
+main:                                   # @main
+# %bb.0:
+	addi	sp, sp, -32
+	sw	ra, 28(sp)                      # 4-byte Folded Spill
+	sw	s0, 24(sp)                      # 4-byte Folded Spill
+	sw	zero, 20(sp)
+	sw	a0, 16(sp)
+	sw	a1, 12(sp)
+	call	get_user_location
+	sw	a0, 8(sp)
+	lw	a1, 16(sp)
+	li	a0, 4
+	blt	a1, a0, .LBB2_2
+	j	.LBB2_1
+.LBB2_1:
+	lw	a0, 8(sp)
+	call	doSomething
+	sw	a0, 20(sp)
+	j	.LBB2_7
+.LBB2_2:
+	lw	a0, 16(sp)
+	sw	a0, 4(sp)
+	j	.LBB2_3
+.LBB2_3:                                # =>This Inner Loop Header: Depth=1
+	lw	s0, 4(sp)
+	blez	s0, .LBB2_6
+	j	.LBB2_4
+.LBB2_4:                                #   in Loop: Header=BB2_3 Depth=1
+	lw	a0, 4(sp)
+	call	doSomething
+	j	.LBB2_5
+.LBB2_5:                                #   in Loop: Header=BB2_3 Depth=1
+	addi	a0, s0, -1
+	sw	a0, 4(sp)
+	j	.LBB2_3
+.LBB2_6:
+	sw	zero, 20(sp)
+	j	.LBB2_7
+.LBB2_7:
+	lw	a0, 20(sp)
+	lw	ra, 28(sp)                      # 4-byte Folded Reload
+	lw	s0, 24(sp)                      # 4-byte Folded Reload
+	addi	sp, sp, 32
+	ret
+.Lfunc_end2:
+	.size	main, .Lfunc_end2-main
+                                        # -- End function
+	.section	".note.GNU-stack","",@progbits
@@ -0,0 +1,18 @@
+	.text
+	.attribute	4, 16
+	.attribute	5, "rv32i2p0"
+	.file	"tinyprogram.ll"
+	.globl	main                            # -- Begin function main
+	.p2align	2
+	.type	main,@function
+main:                                   # @main
+# %bb.0:
+	addi	sp, sp, -16
+	sw	zero, 12(sp)
+	li	a0, 0
+	addi	sp, sp, 16
+	ret
+.Lfunc_end0:
+	.size	main, .Lfunc_end0-main
+                                        # -- End function
+	.section	".note.GNU-stack","",@progbits
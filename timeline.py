@@ -0,0 +1,196 @@
+"""
+timeline.py
+
+Columnar taint timeline, written while the interpreter runs.
+
+After every step the interpreter appends one row: the step number, the number of instructions
+run so far, the pc, the number of tainted registers, the number of tainted memory cells, and for
+each flag in TAINT_FLAGS the number of registers and memory cells carrying it. Steps count as
+seek.py and the snapshot index do; with the block engine a step runs a whole block, so it can be
+many instructions. Each column is a raw file of signed 64-bit
+integers in '<pickle_jar>/timeline', so a column can be memory mapped and read without loading
+the rest, and without unpickling any snapshot.
+
+* COLUMNS - Names of the timeline columns, in row order.
+* map_column - Memory maps a column file as a sequence of ints.
+* class TimelineWriter - Buffers rows and appends them to the column files in bulk.
+* class Timeline - Memory maps the column files of a jar for reading.
+"""
+
+import os
+import sys
+import json
+import mmap
+from array import array
+from instruction import TAINT_FLAGS
+
+TIMELINE_DIR = "timeline"
+METADATA_FILE = "metadata.json"
+COLUMN_TYPECODE = "q"
+COLUMN_SUFFIX = ".col"
+
+COLUMNS = ["step", "instructions", "pc", "tainted_registers", "tainted_memory"] + [
+    name.lower() for name, _ in TAINT_FLAGS
+]
+
+# Rows buffered before they are appended to the column files.
+FLUSH_EVERY = 4096
+
+
+def get_timeline_path(pickle_jar):
+    return "{}/{}".format(pickle_jar, TIMELINE_DIR)
+
+
+def get_column_path(pickle_jar, column):
+    return "{}/{}{}".format(get_timeline_path(pickle_jar), column, COLUMN_SUFFIX)
+
+
+# Memory map a column file. Returns (a read-only sequence of its ints, the map or None).
+# A trailing partial value, from a write cut short, is ignored.
+def map_column(path):
+    with open(path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        size -= size % array(COLUMN_TYPECODE).itemsize
+        if size == 0:
+            return array(COLUMN_TYPECODE), None
+        mapped = mmap.mmap(file.fileno(), size, access=mmap.ACCESS_READ)
+        return memoryview(mapped).cast(COLUMN_TYPECODE), mapped
+
+
+class TimelineWriter():
+    """
+    Appends a row per step to the timeline of '<pickle_jar>/timeline'.
+    """
+    def __init__(self, pickle_jar, flush_every=FLUSH_EVERY):
+        self.pickle_jar = pickle_jar
+        self.flush_every = max(1, flush_every)
+        self.num_rows = 0
+        # Sizes of the shadow state, so counts can be read as percentages.
+        self.num_registers = None
+        self.mem_size = None
+
+        os.makedirs(get_timeline_path(pickle_jar), exist_ok=True)
+        self._buffers = [array(COLUMN_TYPECODE) for _ in COLUMNS]
+        self._files = [open(get_column_path(pickle_jar, column), 'wb') for column in COLUMNS]
+
+    def append(self, interpreter):
+        tracker = interpreter.tracker
+        if self.mem_size is None:
+            self.num_registers = len(tracker.shadow_registers)
+            self.mem_size = tracker.MEM_SIZE
+        num_registers = tracker.count_tainted_registers()
+        row = [
+            interpreter.step_count,
+            tracker.num_total_instr_run,
+            interpreter.state.get_register('pc'),
+            num_registers,
+            tracker.shadow_memory.nonzero,
+        ]
+        # The histogram is all zeros while nothing is tainted.
+        if num_registers or tracker.shadow_memory.nonzero:
+            row += tracker.get_taint_histogram()
+        else:
+            row += [0] * len(TAINT_FLAGS)
+
+        for buffer, val in zip(self._buffers, row):
+            buffer.append(val)
+        self.num_rows += 1
+        if len(self._buffers[0]) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        for buffer, file in zip(self._buffers, self._files):
+            buffer.tofile(file)
+            file.flush()
+            del buffer[:]
+
+    def close(self):
+        # Safe to call more than once.
+        if not self._files:
+            return
+        self.flush()
+        for file in self._files:
+            file.close()
+        self._files = []
+
+        metadata = {
+            "columns": COLUMNS,
+            "typecode": COLUMN_TYPECODE,
+            "byteorder": sys.byteorder,
+            "num_rows": self.num_rows,
+            "num_registers": self.num_registers,
+            "mem_size": self.mem_size,
+        }
+        with open("{}/{}".format(get_timeline_path(self.pickle_jar), METADATA_FILE), 'w') as file:
+            json.dump(metadata, file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class Timeline():
+    """
+    Read access to the timeline of a pickle jar. Columns are memory mapped on first use,
+    so reading touches only the pages of the columns asked for.
+    """
+    def __init__(self, pickle_jar):
+        self.pickle_jar = pickle_jar
+        self._columns = {}
+        self._maps = []
+
+        # A timeline cut short by a crash has no metadata; its columns are still readable.
+        path = "{}/{}".format(get_timeline_path(pickle_jar), METADATA_FILE)
+        self.metadata = {}
+        if os.path.isfile(path):
+            with open(path) as file:
+                self.metadata = json.load(file)
+
+    @staticmethod
+    def exists(pickle_jar):
+        return os.path.isfile(get_column_path(pickle_jar, COLUMNS[0]))
+
+    def get_column(self, column):
+        """
+        Returns the column as a read-only sequence of ints backed by the mapped file.
+        """
+        if column not in COLUMNS:
+            raise Exception("Unknown timeline column '{}'".format(column))
+        if column not in self._columns:
+            values, mapped = map_column(get_column_path(self.pickle_jar, column))
+            if mapped is not None:
+                self._maps.append(mapped)
+            self._columns[column] = values
+        return self._columns[column]
+
+    def __len__(self):
+        return len(self.get_column(COLUMNS[0]))
+
+    def iter_rows(self, columns=COLUMNS):
+        """
+        Yields one tuple of the requested columns per step.
+        """
+        data = [self.get_column(column) for column in columns]
+        for idx in range(len(data[0])):
+            yield tuple(col[idx] for col in data)
+
+    def downsample(self, column, max_points, x_column="step"):
+        """
+        Returns (x, values) with at most 'max_points' evenly spaced rows of 'x_column' and 'column'.
+        Memory is bounded by 'max_points', however long the run.
+        """
+        x = self.get_column(x_column)
+        values = self.get_column(column)
+        stride = max(1, -(-len(values) // max(1, max_points)))
+        return list(x[::stride]), list(values[::stride])
+
+    def close(self):
+        for column in list(self._columns.values()):
+            if isinstance(column, memoryview):
+                column.release()
+        self._columns = {}
+        for mapped in self._maps:
+            mapped.close()
+        self._maps = []
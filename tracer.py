@@ -0,0 +1,175 @@
+"""
+tracer.py
+
+Execution tracing with verbosity levels, in place of printing every step.
+
+By default every step is recorded as a fixed-size binary record (the step, the pc, an opcode id,
+the taint mode, and the number of tainted registers and memory cells) in a preallocated ring
+buffer. The buffer is written to '<pickle_jar>/trace.bin' in bulk whenever it fills. With a ring
+size, only the last records are kept, and they are written once, when the run ends.
+Higher levels also print each step as it runs, as the interpreter used to.
+
+The trace file is a magic string, the length of a JSON header, the header (record format,
+opcode names, and the text of every line), and then the records.
+
+* TRACE_LEVELS - Names of the verbosity levels, from quietest.
+* class Tracer - Records steps of a running interpreter into a ring buffer.
+* read_trace - Returns the header and the records of a trace file.
+
+# Example Execution.
+# python tracer.py --pickle_jar=pickle_cabinet/jar_get_loc --start=100 --end=200
+"""
+
+import os
+import sys
+import json
+import click
+import struct
+from state import ABI_TO_REGISTER_IDX
+
+# Nothing is traced.
+TRACE_OFF = "off"
+# Binary records only.
+TRACE_BINARY = "binary"
+# Binary records, and each line printed as it runs.
+TRACE_LINES = "lines"
+# As 'lines', and print hooks (like policy.print_taint_hook) print the register taint.
+TRACE_TAINT = "taint"
+TRACE_LEVELS = (TRACE_OFF, TRACE_BINARY, TRACE_LINES, TRACE_TAINT)
+
+TRACE_FILE = "trace.bin"
+MAGIC = b"RVTRACE1"
+HEADER_LENGTH = struct.Struct("<I")
+
+# step, pc, opcode id, taint level, tainted registers, tainted memory cells.
+RECORD = struct.Struct("<qiHBBI")
+FIELDS = ("step", "pc", "opcode", "taint_level", "tainted_registers", "tainted_memory")
+
+# Records buffered before they are written.
+BUFFER_RECORDS = 4096
+
+PC = ABI_TO_REGISTER_IDX['pc']
+
+
+def get_trace_path(pickle_jar):
+    return "{}/{}".format(pickle_jar, TRACE_FILE)
+
+
+class Tracer():
+    """
+    Traces the steps of 'interpreter' at 'level' into '<pickle_jar>/trace.bin'.
+    Attach it with RiscvInterpreter.set_tracer. At level 'off' no tracer is attached at all.
+    With a 'ring' size only the last 'ring' steps are kept. Otherwise every step is kept.
+    """
+    def __init__(self, pickle_jar, interpreter, level=TRACE_BINARY, ring=0):
+        if level not in TRACE_LEVELS or level == TRACE_OFF:
+            raise Exception("Cannot trace at level '{}'".format(level))
+        self.level = level
+        self.ring = ring
+        self.print_lines = TRACE_LEVELS.index(level) >= TRACE_LEVELS.index(TRACE_LINES)
+        self.print_taint = level == TRACE_TAINT
+        self.num_records = 0
+
+        instructions = interpreter._instructions
+        opcodes = sorted({instr.opcode for instr in instructions})
+        self._opcode_ids = [opcodes.index(instr.opcode) for instr in instructions]
+        self._lines = [instr.to_string() for instr in instructions]
+
+        self._capacity = ring if ring > 0 else BUFFER_RECORDS
+        self._buffer = bytearray(self._capacity * RECORD.size)
+        # Next slot of the buffer, and whether the ring has wrapped around.
+        self._slot = 0
+        self._wrapped = False
+
+        self._file = open(get_trace_path(pickle_jar), 'wb')
+        header = json.dumps({
+            "record_format": RECORD.format,
+            "fields": FIELDS,
+            "opcodes": opcodes,
+            "lines": self._lines,
+            "ring": ring,
+        }).encode()
+        self._file.write(MAGIC + HEADER_LENGTH.pack(len(header)) + header)
+
+    # Called before a step runs.
+    def before_step(self, interpreter):
+        if self.print_lines:
+            pc = interpreter.state.registers[PC]
+            print("\nRUN LINE {}: {}".format(pc, self._lines[pc]))
+
+    # Called after the step that started at 'pc' ran.
+    def record(self, interpreter, pc):
+        tracker = interpreter.tracker
+        if tracker.taint_level:
+            tainted_registers = tracker.count_tainted_registers()
+            tainted_memory = tracker.shadow_memory.nonzero
+        else:
+            tainted_registers = tainted_memory = 0
+        RECORD.pack_into(self._buffer, self._slot * RECORD.size,
+                         interpreter.step_count, pc, self._opcode_ids[pc], tracker.taint_level,
+                         tainted_registers, tainted_memory)
+        self.num_records += 1
+        self._slot += 1
+        if self._slot == self._capacity:
+            self._slot = 0
+            if self.ring > 0:
+                self._wrapped = True
+            else:
+                self._file.write(self._buffer)
+
+    def close(self):
+        # Safe to call more than once.
+        if self._file is None:
+            return
+        used = memoryview(self._buffer)[:self._slot * RECORD.size]
+        if self._wrapped:
+            self._file.write(memoryview(self._buffer)[self._slot * RECORD.size:])
+        self._file.write(used)
+        self._file.close()
+        self._file = None
+
+
+def read_trace(path):
+    """
+    Returns (header, records), with one tuple of FIELDS per record.
+    """
+    with open(path, 'rb') as file:
+        data = file.read()
+    if not data.startswith(MAGIC):
+        raise Exception("'{}' is not a trace file".format(path))
+    offset = len(MAGIC)
+    (length,) = HEADER_LENGTH.unpack_from(data, offset)
+    offset += HEADER_LENGTH.size
+    header = json.loads(data[offset:offset + length].decode())
+    offset += length
+
+    record = struct.Struct(header["record_format"])
+    end = offset + (len(data) - offset) // record.size * record.size
+    return header, list(record.iter_unpack(data[offset:end]))
+
+
+@click.command()
+@click.option('--pickle_jar', required=True, help='Path to the pickle jar of a run.')
+@click.option('--start', default=0, help='First step to print.')
+@click.option('--end', default=None, type=int, help='Last step to print.')
+@click.option('--taint/--no-taint', default=True, help='Print the taint summary of each step.')
+def main(pickle_jar, start, end, taint):
+    if not os.path.isfile(get_trace_path(pickle_jar)):
+        print("'{}' has no trace. Run the interpreter with --trace=binary.".format(pickle_jar))
+        sys.exit(1)
+
+    header, records = read_trace(get_trace_path(pickle_jar))
+    opcodes = header["opcodes"]
+    lines = header["lines"]
+    for step, pc, opcode, taint_level, tainted_registers, tainted_memory in records:
+        if step < start or (end is not None and step > end):
+            continue
+        print("STEP {} RUN LINE {}: {}".format(step, pc, lines[pc]))
+        if taint and taint_level:
+            print("    {}: {} tainted registers, {} tainted memory cells".format(
+                opcodes[opcode], tainted_registers, tainted_memory))
+    return 0
+
+
+if __name__ == '__main__':
+    main()